@@ -1,3 +1,133 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections, transaction
+from django.utils.translation import ugettext_lazy as _
+from django_countries import countries
 
-# Register your models here.
+from . import forms, invalidation, models, storage
+
+
+def estimated_count(queryset):
+    """Returns the approximate row count of a queryset's table, read from
+    database statistics instead of a full COUNT(*), or None if the
+    database keeps none."""
+    connection = connections[queryset.db]
+    table = queryset.model._meta.db_table
+    if connection.vendor == 'postgresql':
+        sql = "SELECT reltuples FROM pg_class WHERE relname = %s"
+        params = [table]
+    elif connection.vendor == 'mysql':
+        sql = ("SELECT table_rows FROM information_schema.tables "
+               "WHERE table_schema = DATABASE() AND table_name = %s")
+        params = [table]
+    elif connection.vendor == 'sqlite':
+        # Ids are never reused, so the largest one bounds the row count
+        # and is read straight from the primary key.
+        sql = "SELECT MAX({}) FROM {}".format(
+            connection.ops.quote_name(queryset.model._meta.pk.column),
+            connection.ops.quote_name(table))
+        params = []
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    if not row or row[0] is None:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator that estimates the size of large unfiltered tables.
+
+    Filtered querysets, and tables estimated below `exact_below` rows, are
+    still counted exactly.
+    """
+    exact_below = 10000
+
+    def _get_count(self):
+        if self._count is None:
+            estimate = None
+            if not self.object_list.query.where:
+                estimate = estimated_count(self.object_list)
+            if estimate is not None and estimate >= self.exact_below:
+                self._count = estimate
+            else:
+                self._count = self.object_list.count()
+        return self._count
+    count = property(_get_count)
+
+
+class CountryListFilter(admin.SimpleListFilter):
+    """Filters profiles by the countries actually in use."""
+    title = _('country')
+    parameter_name = 'country'
+
+    def lookups(self, request, model_admin):
+        # A distinct scan of the country index, not of the table.
+        codes = (models.Profile.objects.order_by('country')
+                 .values_list('country', flat=True).distinct())
+        return [(code, countries.name(code)) for code in codes if code]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(country=self.value())
+        return queryset
+
+
+@admin.register(models.Profile)
+class ProfileAdmin(admin.ModelAdmin):
+    """Profile admin for large tables."""
+    form = forms.ProfileForm
+    fields = ('user', 'date_of_birth', 'bio', 'website', 'country')
+    list_display = ('user', 'country', 'date_of_birth', 'has_avatar')
+    list_select_related = ('user',)
+    list_filter = (CountryListFilter,)
+    raw_id_fields = ('user',)
+    search_fields = ('=user__username',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['clear_avatars', 'clear_bios']
+
+    def save_model(self, request, obj, form, change):
+        # Staff edits must also invalidate pages users have open.
+        obj.version += 1
+        super(ProfileAdmin, self).save_model(request, obj, form, change)
+
+    def has_avatar(self, obj):
+        return bool(obj.avatar)
+    has_avatar.boolean = True
+    has_avatar.short_description = _('avatar')
+
+    def clear_avatars(self, request, queryset):
+        """Removes the avatars of the selected profiles with one UPDATE."""
+        queryset = queryset.exclude(avatar='')
+        with transaction.atomic():
+            rows = list(queryset.values_list('user_id', 'avatar'))
+            updated = queryset.update(avatar='', avatar_hash='',
+                                      avatar_transforms='',
+                                      avatar_rendition_key='')
+            # The update sends no signals, so drop cached copies once it
+            # commits, before their files can be released.
+            invalidation.invalidate_users(user_id for user_id, _ in rows)
+            names = set(name for _, name in rows)
+
+            def release_files():
+                # Files shared with other profiles are kept.
+                for name in names:
+                    storage.release(name)
+            transaction.on_commit(release_files)
+        self.message_user(request, _("Cleared %d avatars.") % updated,
+                          messages.SUCCESS)
+    clear_avatars.short_description = _("Clear avatars of selected profiles")
+
+    def clear_bios(self, request, queryset):
+        """Removes the bios of the selected profiles with one UPDATE."""
+        queryset = queryset.exclude(bio='')
+        with transaction.atomic():
+            user_ids = list(queryset.values_list('user_id', flat=True))
+            updated = queryset.update(bio='', bio_html='', bio_length=0)
+            invalidation.invalidate_users(user_ids)
+        self.message_user(request, _("Cleared %d bios.") % updated,
+                          messages.SUCCESS)
+    clear_bios.short_description = _("Clear bios of selected profiles")
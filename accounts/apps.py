@@ -1,5 +1,13 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class AccountsConfig(AppConfig):
     name = 'accounts'
+
+    def ready(self):
+        from project_7 import metrics, sqlite
+        from . import directory
+        connection_created.connect(sqlite.set_pragmas)
+        connection_created.connect(directory.install_functions)
+        connection_created.connect(metrics.install_query_timing)
@@ -0,0 +1,196 @@
+"""Static asset bundles.
+
+`manage.py build_assets` concatenates and minifies the source files of each
+ASSET_BUNDLES entry into a content-hashed file under the bundles/ static
+directory, with gzip and, when the brotli package is installed, brotli
+variants beside it, and records the hashed names in bundles/manifest.json.
+Hashed names never change content, so they can be cached indefinitely.
+
+The {% bundle %} tag links the hashed bundle when ASSET_USE_BUNDLES is on
+and the manifest exists, and the individual source files otherwise.
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+BUNDLE_DIR = 'bundles'
+MANIFEST_NAME = 'manifest.json'
+
+STRING_RE = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')''')
+CSS_COMMENT_RE = re.compile(r'/\*.*?\*/', re.DOTALL)
+CSS_SPACE_RE = re.compile(r'\s+')
+CSS_PUNCTUATION_RE = re.compile(r'\s*([{};,>])\s*')
+# Space before a colon can be a descendant combinator, as in `a :hover`.
+CSS_COLON_RE = re.compile(r':\s+')
+CSS_URL_RE = re.compile(r'''url\(\s*(['"]?)([^'")]+)\1\s*\)''')
+
+
+def bundles():
+    """Returns the configured {bundle name: [source paths]}."""
+    return getattr(settings, 'ASSET_BUNDLES', {})
+
+
+def build_dir():
+    """Returns the directory bundles are written to."""
+    return getattr(settings, 'ASSET_BUILD_DIR',
+                   os.path.join(settings.BASE_DIR, 'assets', BUNDLE_DIR))
+
+
+def minify_css(css):
+    """Strips comments and insignificant whitespace outside of strings."""
+    parts = STRING_RE.split(CSS_COMMENT_RE.sub('', css))
+    for index in range(0, len(parts), 2):
+        part = CSS_SPACE_RE.sub(' ', parts[index])
+        part = CSS_COLON_RE.sub(':', CSS_PUNCTUATION_RE.sub(r'\1', part))
+        parts[index] = part.replace(';}', '}')
+    return ''.join(parts).strip()
+
+
+def minify_js(js):
+    """Strips indentation, blank lines and whole-line comments.
+
+    Line breaks are kept, so automatic semicolon insertion still sees the
+    statements it did before.
+    """
+    lines = []
+    for line in js.splitlines():
+        line = line.strip()
+        if line and not line.startswith('//'):
+            lines.append(line)
+    return '\n'.join(lines)
+
+
+def rewrite_css_urls(css, source_path):
+    """Rewrites relative url()s in a source file for the bundle directory."""
+    source_dir = posixpath.dirname(source_path)
+
+    def rewrite(match):
+        url = match.group(2)
+        if url.startswith(('/', '#', 'data:', 'http:', 'https:')):
+            return match.group(0)
+        target = posixpath.normpath(posixpath.join(source_dir, url))
+        return 'url("{}")'.format(posixpath.relpath(target, BUNDLE_DIR))
+    return CSS_URL_RE.sub(rewrite, css)
+
+
+def read_source(path):
+    """Returns the text of a static source file."""
+    full_path = finders.find(path)
+    if not full_path:
+        raise ValueError("Static file {} not found.".format(path))
+    with io.open(full_path, encoding='utf-8') as source:
+        return source.read()
+
+
+def build_bundle(name, paths):
+    """Returns the minified content of one bundle."""
+    contents = []
+    for path in paths:
+        text = read_source(path)
+        if name.endswith('.css'):
+            contents.append(minify_css(rewrite_css_urls(text, path)))
+        elif path.endswith('.min.js'):
+            contents.append(text.strip())
+        else:
+            contents.append(minify_js(text))
+    # Separate scripts so one missing a trailing semicolon can't run into
+    # the next.
+    separator = '\n' if name.endswith('.css') else ';\n'
+    return separator.join(content for content in contents if content)
+
+
+def hashed_name(name, content):
+    """Returns the static path of a bundle named after its content."""
+    base, extension = posixpath.splitext(name)
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    return '{}/{}.{}{}'.format(BUNDLE_DIR, base, digest, extension)
+
+
+def write_file(path, content):
+    """Writes bytes to a file atomically."""
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as output:
+        output.write(content)
+    os.replace(temporary, path)
+
+
+def compress_gzip(content):
+    """Returns reproducible gzip bytes of content."""
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9,
+                       mtime=0) as output:
+        output.write(content)
+    return buf.getvalue()
+
+
+def build(clean=False):
+    """Builds every bundle and the manifest, returning the manifest.
+
+    With `clean`, files of bundles no longer in the manifest are removed.
+    """
+    directory = build_dir()
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    manifest = {}
+    for name, paths in sorted(bundles().items()):
+        content = build_bundle(name, paths).encode('utf-8')
+        static_name = hashed_name(name, content)
+        path = os.path.join(directory, posixpath.basename(static_name))
+        if not os.path.exists(path):
+            write_file(path + '.gz', compress_gzip(content))
+            if brotli is not None:
+                write_file(path + '.br', brotli.compress(content))
+            write_file(path, content)
+        manifest[name] = static_name
+    write_file(os.path.join(directory, MANIFEST_NAME),
+               json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+
+    if clean:
+        keep = set([MANIFEST_NAME])
+        for static_name in manifest.values():
+            base = posixpath.basename(static_name)
+            keep.update([base, base + '.gz', base + '.br'])
+        for filename in os.listdir(directory):
+            if filename not in keep:
+                os.remove(os.path.join(directory, filename))
+    return manifest
+
+
+_manifest = {'mtime': None, 'entries': {}}
+
+
+def manifest():
+    """Returns the built manifest, re-read whenever it changes on disk."""
+    path = os.path.join(build_dir(), MANIFEST_NAME)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    if mtime != _manifest['mtime']:
+        with io.open(path, encoding='utf-8') as source:
+            _manifest['entries'] = json.load(source)
+        _manifest['mtime'] = mtime
+    return _manifest['entries']
+
+
+def bundle_paths(name):
+    """Returns the static paths to link for a bundle: the hashed bundle
+    once it is built and enabled, otherwise its sources."""
+    if getattr(settings, 'ASSET_USE_BUNDLES', not settings.DEBUG):
+        built = manifest().get(name)
+        if built:
+            return [built]
+    return list(bundles()[name])
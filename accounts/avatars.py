@@ -0,0 +1,367 @@
+"""Avatar image processing.
+
+Renditions are the resized copies of an avatar that templates actually
+serve. They are keyed by the content hash of the source image, so a given
+image is only ever resized and encoded once, however many times the page
+showing it is rendered.
+
+Crop, rotate and flip never touch the stored avatar. They are recorded on
+the profile as a transform list that always reduces to at most one crop
+of the source followed by one transpose, and are applied when renditions
+are built, so every rendition is a single encode of the original pixels.
+
+Pillow is imported where it is used, so workers that never touch an image
+don't pay for loading it.
+"""
+import hashlib
+import io
+import json
+import os
+import posixpath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from project_7 import metrics
+
+from . import invalidation, models, storage
+
+
+RENDITION_DIR = 'renditions'
+
+# Rendition format name -> (Pillow format, file extension, save options).
+RENDITION_FORMATS = {
+    'jpeg': ('JPEG', 'jpg', {'quality': 85, 'optimize': True,
+                             'progressive': True}),
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+}
+
+# Pillow format -> save options of oversized uploads scaled down to become
+# the rendition source, which every rendition is encoded from again.
+SOURCE_SAVE_OPTIONS = {
+    'JPEG': {'quality': 95, 'subsampling': 0},
+}
+
+
+def rendition_sizes():
+    """Returns rendition sizes in pixels, largest first."""
+    sizes = getattr(settings, 'AVATAR_RENDITION_SIZES', (48, 96, 240, 600))
+    return sorted(sizes, reverse=True)
+
+
+def rendition_formats():
+    """Returns configured rendition formats the installed Pillow can write."""
+    from PIL import features
+    formats = getattr(settings, 'AVATAR_RENDITION_FORMATS', ('jpeg', 'webp'))
+    return [fmt for fmt in formats
+            if fmt != 'webp' or features.check('webp')]
+
+
+# Transposes as (a, b, c, d) matrices mapping centred source coordinates
+# to x' = a * x + b * y, y' = c * x + d * y.
+TRANSPOSES = {
+    'flip_left_right': (-1, 0, 0, 1),
+    'flip_top_bottom': (1, 0, 0, -1),
+    'rotate_90': (0, 1, -1, 0),
+    'rotate_180': (-1, 0, 0, -1),
+    'rotate_270': (0, -1, 1, 0),
+    'transpose': (0, 1, 1, 0),
+    'transverse': (0, -1, -1, 0),
+}
+IDENTITY = (1, 0, 0, 1)
+
+# User facing edit operations.
+OPERATIONS = {
+    'rotate': TRANSPOSES['rotate_270'],
+    'flip': TRANSPOSES['flip_top_bottom'],
+}
+
+
+def file_hash(field_file):
+    """Returns SHA-1 hex digest of a stored file's content."""
+    sha = hashlib.sha1()
+    field_file.open('rb')
+    try:
+        for chunk in field_file.chunks():
+            sha.update(chunk)
+    finally:
+        field_file.close()
+    return sha.hexdigest()
+
+
+def rendition_key(profile):
+    """Returns the key identifying the renditions of a profile's avatar."""
+    if not profile.avatar_hash or not profile.avatar_transforms:
+        return profile.avatar_hash
+    key = '{}:{}'.format(profile.avatar_hash, profile.avatar_transforms)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def multiply(first, second):
+    """Returns the matrix applying `second` and then `first`."""
+    a, b, c, d = first
+    e, f, g, h = second
+    return (a * e + b * g, a * f + b * h, c * e + d * g, c * f + d * h)
+
+
+def read_transforms(profile, size):
+    """Returns the (crop box, transpose matrix) recorded on a profile."""
+    box = (0, 0) + tuple(size)
+    matrix = IDENTITY
+    for transform in json.loads(profile.avatar_transforms or '[]'):
+        if transform['op'] == 'crop':
+            box = tuple(transform['box'])
+        elif transform['op'] == 'transpose':
+            matrix = TRANSPOSES[transform['method']]
+    return box, matrix
+
+
+def write_transforms(profile, size, box, matrix):
+    """Stores a crop box and transpose on a profile in canonical form."""
+    transforms = []
+    if box != (0, 0) + tuple(size):
+        transforms.append({'op': 'crop', 'box': list(box)})
+    for method, candidate in TRANSPOSES.items():
+        if candidate == matrix:
+            transforms.append({'op': 'transpose', 'method': method})
+    profile.avatar_transforms = (
+        json.dumps(transforms, sort_keys=True) if transforms else '')
+
+
+def displayed_size(box, matrix):
+    """Returns the size of the image a crop box and transpose produce."""
+    width, height = box[2] - box[0], box[3] - box[1]
+    if matrix[0] == 0:
+        return height, width
+    return width, height
+
+
+def map_crop(box, matrix, crop):
+    """Maps a crop of the displayed image back to source coordinates."""
+    display_width, display_height = displayed_size(box, matrix)
+    width, height = box[2] - box[0], box[3] - box[1]
+    left, top, right, bottom = crop
+    xs, ys = [], []
+    for x, y in ((left, top), (right, bottom)):
+        x = min(max(x, 0), display_width)
+        y = min(max(y, 0), display_height)
+        # Doubled centred coordinates keep the arithmetic in integers; the
+        # inverse of a transpose matrix is its transpose.
+        dx, dy = 2 * x - display_width, 2 * y - display_height
+        a, b, c, d = matrix
+        xs.append(box[0] + (a * dx + c * dy + width) // 2)
+        ys.append(box[1] + (b * dx + d * dy + height) // 2)
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def source_size(profile):
+    """Returns the stored avatar's size, reading only the image header."""
+    from PIL import Image
+    profile.avatar.open('rb')
+    try:
+        return Image.open(profile.avatar).size
+    finally:
+        profile.avatar.close()
+
+
+@metrics.timed('avatar.size')
+def edited_size(profile):
+    """Returns the size of the avatar once its transforms are applied."""
+    return displayed_size(*read_transforms(profile, source_size(profile)))
+
+
+def add_edit(profile, operation, crop=None):
+    """Records a rotate, flip or crop of the avatar as currently displayed.
+
+    Crop coordinates are relative to the displayed image. Edits compose
+    with the recorded ones, so four rotations leave no transform at all.
+    """
+    size = source_size(profile)
+    box, matrix = read_transforms(profile, size)
+    if operation == 'crop':
+        new_box = map_crop(box, matrix, crop)
+        if new_box[0] < new_box[2] and new_box[1] < new_box[3]:
+            box = new_box
+    else:
+        matrix = multiply(OPERATIONS[operation], matrix)
+    write_transforms(profile, size, box, matrix)
+
+
+def apply_transforms(profile, image):
+    """Applies a profile's recorded crop and transpose to its avatar image.
+
+    Both steps only move pixels, so nothing is lost before the encode.
+    """
+    from PIL import Image
+    box, matrix = read_transforms(profile, image.size)
+    if box != (0, 0) + image.size:
+        image = image.crop(box)
+    for method, candidate in TRANSPOSES.items():
+        if candidate == matrix:
+            image = image.transpose(getattr(Image, method.upper()))
+    return image
+
+
+def rendition_name(key, size, fmt):
+    """Returns storage name of one rendition."""
+    extension = RENDITION_FORMATS[fmt][1]
+    return '{}/{}/{}/{}.{}'.format(RENDITION_DIR, key[:2], key, size,
+                                   extension)
+
+
+def rendition_url(profile, size, fmt='jpeg'):
+    """Returns URL of the smallest built rendition covering `size` pixels.
+
+    Falls back to the stored avatar while no renditions have been built.
+    """
+    if not profile.avatar:
+        return ''
+    key = profile.avatar_rendition_key
+    if not key or fmt not in rendition_formats():
+        return profile.avatar.url if fmt == 'jpeg' else ''
+    sizes = rendition_sizes()
+    best = sizes[0]
+    for candidate in sizes:
+        if candidate >= size:
+            best = candidate
+    return default_storage.url(rendition_name(key, best, fmt))
+
+
+def open_avatar(profile, size=None):
+    """Opens and fully loads a profile's stored avatar.
+
+    With `size`, JPEGs are decoded at the smallest reduced scale still
+    covering `size` pixels, instead of at full resolution.
+    """
+    from PIL import Image
+    profile.avatar.open('rb')
+    try:
+        image = Image.open(profile.avatar)
+        if size:
+            image.draft(image.mode, (size, size))
+        image.load()
+    finally:
+        profile.avatar.close()
+    return image
+
+
+def encode(image, fmt):
+    """Encodes image in a rendition format, returning bytes."""
+    pillow_format, _, options = RENDITION_FORMATS[fmt]
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buf = io.BytesIO()
+    image.save(buf, pillow_format, **options)
+    return buf.getvalue()
+
+
+def build_renditions(profile):
+    """Builds every missing rendition of a profile's avatar.
+
+    The largest JPEG is written last and doubles as the marker that the set
+    is complete, so an existing set costs a single storage lookup. The set
+    is only published on the profile if its avatar hasn't changed since.
+    """
+    from PIL import Image
+    key = rendition_key(profile)
+    if not profile.avatar or not key:
+        return
+    sizes = rendition_sizes()
+    marker = rendition_name(key, sizes[0], 'jpeg')
+    try:
+        # Also refreshes the grace period that protects an existing set
+        # from pruning until it is published again.
+        os.utime(default_storage.path(marker), None)
+    except OSError:
+        image = apply_transforms(profile, open_avatar(profile))
+        outputs = []
+        # Each size is resized from the previous one rather than the
+        # source, so only the first step touches the full-size image.
+        for size in sizes:
+            image = image.copy()
+            image.thumbnail((size, size), Image.LANCZOS)
+            for fmt in rendition_formats():
+                outputs.append((rendition_name(key, size, fmt), image, fmt))
+        outputs.sort(key=lambda output: output[0] == marker)
+        for name, image, fmt in outputs:
+            if not default_storage.exists(name):
+                default_storage.save(name, ContentFile(encode(image, fmt)))
+
+    models.Profile.objects.filter(
+        pk=profile.pk,
+        avatar_hash=profile.avatar_hash,
+        avatar_transforms=profile.avatar_transforms,
+    ).update(avatar_rendition_key=key)
+    profile.avatar_rendition_key = key
+    invalidation.invalidate_users([profile.user_id])
+
+
+def reset(profile):
+    """Forgets the hash and transforms of a profile's replaced avatar."""
+    profile.avatar_hash = ''
+    profile.avatar_transforms = ''
+    profile.save(update_fields=['avatar_hash', 'avatar_transforms'])
+
+
+def process_upload(profile):
+    """Records the hash of a newly stored avatar and builds its renditions.
+
+    The upload itself is kept as the source renditions are built from, so
+    they are a single encode of its pixels. Only uploads larger than
+    AVATAR_SOURCE_MAX_DIMENSION are replaced first, see shrink_upload().
+    """
+    if not profile.avatar:
+        return
+    upload = profile.avatar.name
+    max_dimension = getattr(settings, 'AVATAR_SOURCE_MAX_DIMENSION', 2048)
+    if max(source_size(profile)) > max_dimension:
+        if not shrink_upload(profile, max_dimension):
+            return
+    else:
+        profile.avatar_hash = profile.avatar.storage.digest(upload)
+        updated = models.Profile.objects.filter(
+            pk=profile.pk,
+            avatar=upload,
+        ).update(avatar_hash=profile.avatar_hash)
+        if not updated:
+            return
+    build_renditions(profile)
+
+
+def shrink_upload(profile, max_dimension):
+    """Replaces an oversized avatar with a copy scaled to fit
+    `max_dimension`, re-encoded at high quality, and releases the upload.
+
+    The copy is only published if the profile still has the upload and no
+    recorded edits, so a job that ran late can't replace a newer avatar or
+    shift a crop made on the upload. Returns True if it was published.
+    """
+    from PIL import Image
+    upload = profile.avatar.name
+    image = open_avatar(profile, max_dimension)
+    pillow_format = image.format or 'PNG'
+    image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+    buf = io.BytesIO()
+    image.save(buf, pillow_format,
+               **SOURCE_SAVE_OPTIONS.get(pillow_format, {}))
+    data = buf.getvalue()
+    profile.avatar.save(posixpath.basename(upload), ContentFile(data),
+                        save=False)
+    profile.avatar_hash = hashlib.sha1(data).hexdigest()
+    updated = models.Profile.objects.filter(
+        pk=profile.pk,
+        avatar=upload,
+        avatar_transforms='',
+    ).update(avatar=profile.avatar.name, avatar_hash=profile.avatar_hash)
+    if not updated:
+        storage.release(profile.avatar.name)
+        return False
+    storage.release(upload)
+    return True
+
+
+@metrics.timed('avatar.edit')
+def record_edit(profile, operation, crop=None):
+    """Records a user edit of a profile's avatar."""
+    add_edit(profile, operation, crop)
+    profile.save(update_fields=['avatar_transforms'])
@@ -0,0 +1,62 @@
+"""Authentication backend that loads users together with their profiles."""
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.models import User
+from django.core.cache import caches
+
+
+def user_cache():
+    """Returns the cache holding authenticated users."""
+    return caches[getattr(settings, 'ACCOUNTS_USER_CACHE', 'default')]
+
+
+def user_cache_key(user_id):
+    """Returns the cache key of a user and profile pair."""
+    return 'accounts:user:{}'.format(user_id)
+
+
+def invalidate_user(user_id):
+    """Drops a cached user and profile pair."""
+    user_cache().delete(user_cache_key(user_id))
+
+
+def load_user(user_id):
+    """Loads a user joined with its profile in one query.
+
+    The profile is created if the user has none, which happens for users
+    written without going through the create_profile signal. The pair is
+    always read from the primary, even in views reading from replicas, as
+    it is cached well past the time replicas may lag by.
+    """
+    try:
+        user = User._default_manager.using('default').select_related(
+            'profile').get(pk=user_id)
+    except User.DoesNotExist:
+        return None
+    profile_model = apps.get_model('accounts', 'Profile')
+    try:
+        user.profile
+    except profile_model.DoesNotExist:
+        user.profile, _ = profile_model.objects.get_or_create(user=user)
+    return user
+
+
+class ProfileBackend(ModelBackend):
+    """ModelBackend whose users come with their profile already loaded.
+
+    The user and profile pair is cached until either row is saved, so most
+    authenticated requests need no query at all to resolve request.user.
+    Saves made in one process only drop the pair for the others when
+    ACCOUNTS_USER_CACHE is shared by all of them.
+    """
+    def get_user(self, user_id):
+        cache = user_cache()
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = load_user(user_id)
+            if user is not None:
+                cache.set(key, user, getattr(
+                    settings, 'ACCOUNTS_USER_CACHE_TIMEOUT', 300))
+        return user
@@ -0,0 +1,94 @@
+"""Helpers shared by the benchmark management commands."""
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test.runner import DiscoverRunner
+from project_7 import testing
+
+from .models import Profile
+
+
+COUNTRIES = ('US', 'GB', 'DE', 'FR', 'IN', 'BR', 'JP', 'CA', 'AU', 'NG')
+
+
+def percentile(samples, fraction):
+    """Returns the `fraction` percentile of samples, by nearest rank."""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(samples):
+    """Returns latency statistics, in milliseconds, of timings in seconds."""
+    return {
+        'count': len(samples),
+        'mean_ms': 1000.0 * sum(samples) / len(samples) if samples else 0.0,
+        'p50_ms': 1000.0 * percentile(samples, 0.50),
+        'p95_ms': 1000.0 * percentile(samples, 0.95),
+        'p99_ms': 1000.0 * percentile(samples, 0.99),
+    }
+
+
+def time_calls(func, arguments, repeat=1):
+    """Calls `func` once per argument, `repeat` times over, returning the
+    best total run time in seconds."""
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for argument in arguments:
+            func(argument)
+        elapsed = time.perf_counter() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+@contextmanager
+def test_database():
+    """Runs the block against a fresh test database, destroyed afterwards."""
+    test_settings = connection.settings_dict['TEST']
+    old_name = test_settings.get('NAME')
+    with tempfile.TemporaryDirectory() as directory:
+        if connection.vendor == 'sqlite':
+            # An in-memory test database can't be shared between threads.
+            test_settings['NAME'] = os.path.join(directory, 'test.sqlite3')
+        try:
+            runner = DiscoverRunner(verbosity=0)
+            old_config = runner.setup_databases()
+            try:
+                with testing.isolated_caches():
+                    yield
+            finally:
+                for alias in connections:
+                    connections[alias].close()
+                runner.teardown_databases(old_config)
+        finally:
+            test_settings['NAME'] = old_name
+
+
+def seed_users(count, password, rng):
+    """Creates `count` users named bench_<n>, all with `password`, and their
+    profiles. Returns the users in creation order."""
+    # Hashing once keeps seeding fast, however many users there are.
+    encoded = make_password(password)
+    User.objects.bulk_create(
+        [User(username='bench_{}'.format(index), first_name='Bench',
+              last_name='User{}'.format(index),
+              email='bench_{}@example.com'.format(index), password=encoded)
+         for index in range(count)],
+        batch_size=500)
+    users = list(User.objects.filter(username__startswith='bench_')
+                 .order_by('pk'))
+    Profile.objects.bulk_create(
+        [Profile(user=user, country=rng.choice(COUNTRIES),
+                 bio='I like benchmarks.', bio_html='I like benchmarks.',
+                 bio_length=18) for user in users],
+        batch_size=500)
+    return users
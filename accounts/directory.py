@@ -0,0 +1,227 @@
+"""Profile directory search.
+
+On SQLite, names and bios are matched through the accounts_profile_fts
+FTS5 table, whose rowids are profile ids. Triggers on accounts_profile and
+auth_user keep it in sync with every write, including bulk ones that skip
+model signals. Bios are indexed as the plain text of the sanitized HTML,
+extracted by the accounts_html_text() SQL function, which install_functions
+registers on every connection Django opens, so markup never matches a
+search. Other clients, such as the sqlite3 shell, have no such function and
+can't write to either table while the triggers exist. Other databases fall
+back to lookups on the same text. SQLite migrations that rebuild either
+table drop or break the triggers, so they must run uninstall_fts_migration
+before and install_fts_migration afterwards.
+
+Results are ordered by (last name, first name, user id), which the
+accounts_user_directory index covers, and paged with a cursor holding the
+last row shown rather than an OFFSET, so deep pages cost the same as the
+first one.
+"""
+import base64
+import html
+import json
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+from . import models
+
+
+FTS_TABLE = 'accounts_profile_fts'
+
+FTS_SQL = (
+    "CREATE VIRTUAL TABLE accounts_profile_fts USING fts5("
+    "first_name, last_name, bio, prefix='2 3')",
+    "CREATE TRIGGER accounts_profile_fts_insert AFTER INSERT ON "
+    "accounts_profile BEGIN "
+    "INSERT INTO accounts_profile_fts (rowid, first_name, last_name, bio) "
+    "SELECT new.id, first_name, last_name, accounts_html_text(new.bio_html) "
+    "FROM auth_user WHERE id = new.user_id; "
+    "END",
+    "CREATE TRIGGER accounts_profile_fts_update AFTER UPDATE OF bio_html, "
+    "user_id ON accounts_profile BEGIN "
+    "DELETE FROM accounts_profile_fts WHERE rowid = old.id; "
+    "INSERT INTO accounts_profile_fts (rowid, first_name, last_name, bio) "
+    "SELECT new.id, first_name, last_name, accounts_html_text(new.bio_html) "
+    "FROM auth_user WHERE id = new.user_id; "
+    "END",
+    "CREATE TRIGGER accounts_profile_fts_delete AFTER DELETE ON "
+    "accounts_profile BEGIN "
+    "DELETE FROM accounts_profile_fts WHERE rowid = old.id; "
+    "END",
+    "CREATE TRIGGER accounts_profile_fts_user_update AFTER UPDATE OF "
+    "first_name, last_name ON auth_user BEGIN "
+    "DELETE FROM accounts_profile_fts WHERE rowid IN "
+    "(SELECT id FROM accounts_profile WHERE user_id = new.id); "
+    "INSERT INTO accounts_profile_fts (rowid, first_name, last_name, bio) "
+    "SELECT id, new.first_name, new.last_name, accounts_html_text(bio_html) "
+    "FROM accounts_profile WHERE user_id = new.id; "
+    "END",
+)
+
+FTS_POPULATE_SQL = (
+    "INSERT INTO accounts_profile_fts (rowid, first_name, last_name, bio) "
+    "SELECT p.id, u.first_name, u.last_name, accounts_html_text(p.bio_html) "
+    "FROM accounts_profile p INNER JOIN auth_user u ON u.id = p.user_id"
+)
+
+FTS_DROP_SQL = (
+    "DROP TRIGGER IF EXISTS accounts_profile_fts_insert",
+    "DROP TRIGGER IF EXISTS accounts_profile_fts_update",
+    "DROP TRIGGER IF EXISTS accounts_profile_fts_delete",
+    "DROP TRIGGER IF EXISTS accounts_profile_fts_user_update",
+    "DROP TABLE IF EXISTS accounts_profile_fts",
+)
+
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+TAG_RE = re.compile(r'<[^>]*>')
+
+# Matches a term in the text of sanitized HTML: after the start or the end
+# of a tag, past only text and whole entities, so neither tag names,
+# attributes nor entity names match. Terms are words, so need no escaping.
+TEXT_TERM_REGEX = r'(^|>)([^<&]|&[#a-z0-9]+;)*{}'
+
+
+def html_text(value):
+    """Returns the plain text of sanitized HTML, for indexing."""
+    return html.unescape(TAG_RE.sub(' ', value or ''))
+
+
+def install_functions(sender, connection, **kwargs):
+    """Registers the SQL functions the FTS triggers call on each new SQLite
+    connection."""
+    if connection.vendor != 'sqlite':
+        return
+    connection.connection.create_function('accounts_html_text', 1, html_text)
+
+
+def supports_fts(connection):
+    """Returns True if a connection's database can hold the FTS5 table."""
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        options = set(row[0] for row in cursor.fetchall())
+    return 'ENABLE_FTS5' in options
+
+
+def install_fts(connection):
+    """Creates and fills the FTS table and its triggers, where supported."""
+    if not supports_fts(connection):
+        return
+    with connection.cursor() as cursor:
+        for sql in FTS_DROP_SQL + FTS_SQL + (FTS_POPULATE_SQL,):
+            cursor.execute(sql)
+
+
+def uninstall_fts(connection):
+    """Drops the FTS table and its triggers."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for sql in FTS_DROP_SQL:
+            cursor.execute(sql)
+
+
+def install_fts_migration(apps, schema_editor):
+    """RunPython callable installing the FTS table in a migration."""
+    install_fts(schema_editor.connection)
+
+
+def uninstall_fts_migration(apps, schema_editor):
+    """RunPython callable dropping the FTS table in a migration."""
+    uninstall_fts(schema_editor.connection)
+
+
+_fts_tables = {}
+
+
+def has_fts():
+    """Returns True if the FTS table exists in the default database."""
+    if connection.vendor != 'sqlite':
+        return False
+    name = connection.settings_dict['NAME']
+    if name not in _fts_tables:
+        _fts_tables[name] = (
+            FTS_TABLE in connection.introspection.table_names())
+    return _fts_tables[name]
+
+
+def search_terms(query):
+    """Splits a search query into words."""
+    return TERM_RE.findall(query or '')
+
+
+def match_expression(terms):
+    """Returns an FTS5 query matching rows containing every term as a word
+    prefix.
+
+    Terms are quoted, so user input can never be read as FTS syntax.
+    """
+    return ' '.join('"{}"*'.format(term.replace('"', '""'))
+                    for term in terms)
+
+
+def encode_cursor(profile):
+    """Returns the opaque cursor pointing just past a profile."""
+    position = [profile.user.last_name, profile.user.first_name,
+                profile.user_id]
+    return base64.urlsafe_b64encode(
+        json.dumps(position).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """Returns the (last name, first name, user id) a cursor points past,
+    or None if it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        last_name, first_name, user_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        return str(last_name), str(first_name), int(user_id)
+    except (TypeError, ValueError, UnicodeError):
+        return None
+
+
+def search(query='', country=None, cursor=None, per_page=20):
+    """Returns (profiles, next cursor) of one directory page.
+
+    The next cursor is None on the last page.
+    """
+    # Ordering on auth_user.id rather than the equal user_id lets the
+    # whole ORDER BY be read from the accounts_user_directory index.
+    profiles = models.Profile.objects.select_related('user').extra(
+        order_by=['auth_user.last_name', 'auth_user.first_name',
+                  'auth_user.id'])
+    if country:
+        profiles = profiles.filter(country=country.upper())
+
+    terms = search_terms(query)
+    if terms and has_fts():
+        profiles = profiles.extra(
+            where=["accounts_profile.id IN (SELECT rowid FROM "
+                   "accounts_profile_fts WHERE accounts_profile_fts "
+                   "MATCH %s)"],
+            params=[match_expression(terms)],
+        )
+    else:
+        for term in terms:
+            profiles = profiles.filter(
+                Q(user__first_name__icontains=term) |
+                Q(user__last_name__icontains=term) |
+                Q(bio_html__iregex=TEXT_TERM_REGEX.format(term)))
+
+    position = decode_cursor(cursor)
+    if position:
+        profiles = profiles.extra(
+            where=["(auth_user.last_name, auth_user.first_name, "
+                   "auth_user.id) > (%s, %s, %s)"],
+            params=list(position),
+        )
+
+    page = list(profiles[:per_page + 1])
+    if len(page) > per_page:
+        page = page[:per_page]
+        return page, encode_cursor(page[-1])
+    return page, None
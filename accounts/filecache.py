@@ -0,0 +1,32 @@
+"""File-based cache backend that doesn't scan its directory on every write.
+
+Django's FileBasedCache lists the whole cache directory on every set() to
+decide whether MAX_ENTRIES has been reached, so each write costs more the
+more entries there are. This backend only makes that check once every
+CULL_INTERVAL seconds per process, so the cache can briefly hold the
+entries written in between on top of MAX_ENTRIES.
+"""
+import threading
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+# Cache directory -> time this process last checked it for culling.
+_culled = {}
+_lock = threading.Lock()
+
+
+class PeriodicCullFileBasedCache(FileBasedCache):
+    def __init__(self, dir, params):
+        super(PeriodicCullFileBasedCache, self).__init__(dir, params)
+        options = params.get('OPTIONS', {})
+        self._cull_interval = float(options.get('CULL_INTERVAL', 60))
+
+    def _cull(self):
+        now = time.time()
+        with _lock:
+            if now - _culled.get(self._dir, 0) < self._cull_interval:
+                return
+            _culled[self._dir] = now
+        super(PeriodicCullFileBasedCache, self)._cull()
@@ -1,13 +1,15 @@
-from bs4 import BeautifulSoup
 from django import forms
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth.models import User
 from django.core import validators
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save
 from django_countries.widgets import CountrySelectWidget
-from html5.forms import widgets as html5_widgets
+from project_7 import metrics
 
 
-from . import models
+from . import models, sanitizer
 
 
 forms.DateField.default_error_messages = {
@@ -22,7 +24,16 @@ def longer_than_9(value):
         raise forms.ValidationError('must be 10 characters or longer')
 
 
-class UserForm(forms.ModelForm):
+class ChangedFieldsMixin(object):
+    """Reports which model fields a ModelForm changed."""
+    def changed_fields(self):
+        """Returns names of the changed fields stored on the model."""
+        model_fields = set(
+            field.name for field in self.instance._meta.concrete_fields)
+        return [name for name in self.changed_data if name in model_fields]
+
+
+class UserForm(ChangedFieldsMixin, forms.ModelForm):
     """Form for standard user information."""
     verify_email = forms.EmailField(
         label="Please verify your email address",
@@ -47,7 +58,6 @@ class UserForm(forms.ModelForm):
         elif 'email' in cleaned_data and 'verify_email' in cleaned_data:
             email = cleaned_data['email']
             verify_email = cleaned_data['verify_email']
-            print(email, verify_email)
             if email != verify_email:
                 raise forms.ValidationError(
                     "You need to enter the same email in both fields.")
@@ -56,8 +66,11 @@ class UserForm(forms.ModelForm):
                 "You need to enter the same email in both fields.")
 
 
-class ProfileForm(forms.ModelForm):
+class ProfileForm(ChangedFieldsMixin, forms.ModelForm):
     """Form for additional user information."""
+    version = forms.IntegerField(widget=forms.HiddenInput, error_messages={
+        'required': "Reload the page before saving your profile."})
+
     class Meta:
         model = models.Profile
         fields = [
@@ -67,7 +80,8 @@ class ProfileForm(forms.ModelForm):
             'country',
         ]
         widgets = {
-            'date_of_birth': html5_widgets.DateInput,
+            'date_of_birth': forms.DateInput(format='%Y-%m-%d',
+                                             attrs={'type': 'date'}),
             'country': CountrySelectWidget(
                 layout='{widget}'
             ),
@@ -76,14 +90,93 @@ class ProfileForm(forms.ModelForm):
     def clean_bio(self):
         """Checks that if bio is present its length is 10 characters or more,
         not taking into consideration HTML formatting."""
-        bio = BeautifulSoup(self.cleaned_data['bio'], "html.parser")
-        char_num = len(bio.get_text().replace(' ', ''))
-        print(char_num)
+        with metrics.timed('bio.sanitize'):
+            self.sanitized_bio = sanitizer.sanitize(self.cleaned_data['bio'])
+        char_num = self.sanitized_bio[1]
         if 0 < char_num < 10:
             raise forms.ValidationError('If you want to share bio, make it '
                                         '10 characters or longer')
         return self.cleaned_data['bio']
 
+    def __init__(self, *args, **kwargs):
+        super(ProfileForm, self).__init__(*args, **kwargs)
+        self.fields['version'].initial = self.instance.version
+
+    def changed_fields(self):
+        """Returns changed model fields, including the stored sanitized
+        bio."""
+        fields = [name for name in super(ProfileForm, self).changed_fields()
+                  if name != 'version']
+        if 'bio' in fields:
+            fields += ['bio_html', 'bio_length']
+        return fields
+
+    def save(self, commit=True):
+        """Stores the sanitized bio alongside the submitted one."""
+        self.instance.bio_html, self.instance.bio_length = self.sanitized_bio
+        return super(ProfileForm, self).save(commit)
+
+
+class EditProfileForm(object):
+    """Edits a user and their profile on one page.
+
+    Only changed columns are written and unchanged rows aren't written at
+    all. Saves are refused if the profile version changed since the page
+    was rendered, and every profile write bumps it, so edits made in
+    another window are never silently overwritten.
+    """
+    def __init__(self, user, data=None, files=None):
+        self.user_form = UserForm(instance=user, data=data, files=files,
+                                  initial={'verify_email': user.email})
+        self.profile_form = ProfileForm(instance=user.profile, data=data,
+                                        files=files, prefix='profile')
+
+    def is_valid(self):
+        user_valid = self.user_form.is_valid()
+        return self.profile_form.is_valid() and user_valid
+
+    def save(self):
+        """Writes the changes, returning False if the profile was edited
+        elsewhere in the meantime."""
+        user_fields = self.user_form.changed_fields()
+        profile_fields = self.profile_form.changed_fields()
+        if not user_fields and not profile_fields:
+            return True
+
+        user = self.user_form.save(commit=False)
+        profile = self.profile_form.save(commit=False)
+        version = self.profile_form.cleaned_data['version']
+        # Catches stale pages without a query when only the user changed;
+        # the conditional update below catches races on profile writes.
+        if version != profile.version:
+            self.refuse()
+            return False
+        with transaction.atomic():
+            if profile_fields:
+                profiles = models.Profile.objects.filter(pk=profile.pk,
+                                                         version=version)
+                values = dict((name, getattr(profile, name))
+                              for name in profile_fields)
+                if not profiles.update(version=F('version') + 1, **values):
+                    self.refuse()
+                    return False
+                profile.version = version + 1
+                # update() sends no signals, so cached copies of the
+                # profile are dropped by sending post_save for it.
+                post_save.send(sender=models.Profile, instance=profile,
+                               created=False, raw=False, using=profiles.db,
+                               update_fields=frozenset(profile_fields +
+                                                       ['version']))
+            if user_fields:
+                user.save(update_fields=user_fields)
+        return True
+
+    def refuse(self):
+        """Reports that the profile was edited elsewhere."""
+        self.profile_form.add_error(
+            None, "Your profile was changed in another window. "
+                  "Reload the page before saving again.")
+
 
 class ChangePasswordForm(PasswordChangeForm):
     """Form to change user password."""
@@ -107,10 +200,12 @@ class ChangeAvatarForm(forms.ModelForm):
         model = models.Profile
         fields = ['avatar']
 
-UserProfileInlineFormSet = forms.inlineformset_factory(
-    User,
-    models.Profile,
-    ProfileForm,
-    fields=('date_of_birth', 'website', 'country', 'bio'),
-    can_delete=False
-)
+    def __init__(self, *args, **kwargs):
+        self.upload_error = kwargs.pop('upload_error', None)
+        super(ChangeAvatarForm, self).__init__(*args, **kwargs)
+
+    def clean_avatar(self):
+        """Reports an upload rejected while it was streaming in."""
+        if self.upload_error:
+            raise forms.ValidationError(self.upload_error)
+        return self.cleaned_data['avatar']
@@ -0,0 +1,20 @@
+"""Dropping everything cached about users whose rows changed."""
+from django.db import transaction
+
+from . import backends, profile_cache
+
+
+def invalidate_users(user_ids):
+    """Drops the cached user, profile and rendered profile of each user
+    once the current transaction commits, or straight away outside one.
+
+    Dropping them any earlier would let a request in another process cache
+    the rows as they were before the commit.
+    """
+    user_ids = list(user_ids)
+
+    def invalidate():
+        for user_id in user_ids:
+            backends.invalidate_user(user_id)
+            profile_cache.invalidate(user_id)
+    transaction.on_commit(invalidate)
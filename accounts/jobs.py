@@ -0,0 +1,166 @@
+"""Background jobs for avatar image processing.
+
+Pillow work runs in a process pool so it never holds up a request thread;
+views enqueue a job and redirect straight away. Job state is kept by a
+pluggable backend, selected with the AVATAR_JOB_BACKEND setting, so the
+status endpoint can tell the browser when the new avatar is ready.
+
+Setting AVATAR_JOB_WORKERS to 0 runs jobs inline, in the request.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django import db
+from django.conf import settings
+from django.utils.module_loading import import_string
+from project_7 import concurrency, metrics
+
+from . import avatars, invalidation, models
+
+
+logger = logging.getLogger(__name__)
+
+PENDING = models.AvatarJob.PENDING
+DONE = models.AvatarJob.DONE
+FAILED = models.AvatarJob.FAILED
+
+TASKS = {
+    'process_upload': avatars.process_upload,
+    'build_renditions': avatars.build_renditions,
+}
+
+
+class BaseJobBackend(object):
+    """Stores the state of avatar jobs."""
+    def create(self, user_id, task):
+        """Records a new pending job, returning its id."""
+        raise NotImplementedError
+
+    def finish(self, job_id, state):
+        """Records that a job has finished."""
+        raise NotImplementedError
+
+    def latest_state(self, user_id):
+        """Returns the state of a user's most recent job, or None."""
+        raise NotImplementedError
+
+
+class LocMemJobBackend(BaseJobBackend):
+    """Keeps job state in memory; only usable with a single process."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._latest = {}
+        self._next_id = 0
+
+    def create(self, user_id, task):
+        with self._lock:
+            self._next_id += 1
+            self._jobs[self._next_id] = PENDING
+            self._latest[user_id] = self._next_id
+            return self._next_id
+
+    def finish(self, job_id, state):
+        with self._lock:
+            self._jobs[job_id] = state
+
+    def latest_state(self, user_id):
+        with self._lock:
+            return self._jobs.get(self._latest.get(user_id))
+
+
+class DatabaseJobBackend(BaseJobBackend):
+    """Keeps job state in the AvatarJob table."""
+    def create(self, user_id, task):
+        return models.AvatarJob.objects.create(user_id=user_id, task=task).pk
+
+    def finish(self, job_id, state):
+        models.AvatarJob.objects.filter(pk=job_id).update(state=state)
+
+    def latest_state(self, user_id):
+        states = models.AvatarJob.objects.filter(
+            user_id=user_id).order_by('-pk').values_list('state', flat=True)
+        return states.first()
+
+
+_backend = None
+_executor = None
+_executor_pid = None
+_worker_pid = None
+_lock = threading.Lock()
+
+
+def get_backend():
+    """Returns the configured job backend."""
+    global _backend
+    if _backend is None:
+        _backend = import_string(getattr(
+            settings, 'AVATAR_JOB_BACKEND',
+            'accounts.jobs.DatabaseJobBackend'))()
+    return _backend
+
+
+def get_executor():
+    """Returns this process's worker pool, creating it on first use."""
+    global _executor, _executor_pid
+    with _lock:
+        # A pool inherited through fork belongs to the parent process.
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'AVATAR_JOB_WORKERS', 2))
+            _executor_pid = os.getpid()
+        return _executor
+
+
+def run(task, profile_id):
+    """Runs a task on a profile; the entry point inside worker processes."""
+    global _worker_pid
+    if _worker_pid != os.getpid():
+        # Connections copied from the parent process must not be reused.
+        for connection in db.connections.all():
+            connection.close()
+        _worker_pid = os.getpid()
+    profile = models.Profile.objects.get(pk=profile_id)
+    TASKS[task](profile)
+
+
+def enqueue(profile, task):
+    """Queues a task on a profile's avatar, returning the job id."""
+    backend = get_backend()
+    job_id = backend.create(profile.user_id, task)
+
+    if not getattr(settings, 'AVATAR_JOB_WORKERS', 2):
+        try:
+            with concurrency.cpu_bound(), metrics.timed('avatar.' + task):
+                TASKS[task](profile)
+        except Exception:
+            backend.finish(job_id, FAILED)
+            raise
+        backend.finish(job_id, DONE)
+        return job_id
+
+    def done(future):
+        # Includes the wait for a free worker.
+        metrics.record('avatar.' + task, time.perf_counter() - submitted)
+        if future.exception() is not None:
+            logger.error("Avatar job %s (%s) failed: %r", job_id, task,
+                         future.exception())
+            backend.finish(job_id, FAILED)
+        else:
+            backend.finish(job_id, DONE)
+        # The job ran in another process, so drops made there don't reach
+        # caches kept in this one.
+        invalidation.invalidate_users([profile.user_id])
+        db.close_old_connections()
+
+    submitted = time.perf_counter()
+    get_executor().submit(run, task, profile.pk).add_done_callback(done)
+    return job_id
+
+
+def latest_state(user):
+    """Returns the state of a user's most recent avatar job, or None."""
+    return get_backend().latest_state(user.pk)
@@ -0,0 +1,106 @@
+"""Thread-safe in-memory cache backend with least-recently-used eviction.
+
+Django's LocMemCache culls an arbitrary slice of its keys once MAX_ENTRIES
+is reached. This backend evicts the least recently used entries instead,
+so hot keys stay cached however small the bound is set.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+try:
+    from django.utils.six.moves import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+# Global in-memory stores, keyed by name, so every instance of a cache
+# alias within a process shares its data.
+_caches = {}
+_locks = {}
+
+
+class LRUCache(BaseCache):
+    def __init__(self, name, params):
+        BaseCache.__init__(self, params)
+        # Key -> (expiry time or None, pickled value), oldest use first.
+        self._cache = _caches.setdefault(name, OrderedDict())
+        self._lock = _locks.setdefault(name, threading.Lock())
+
+    def _get(self, key):
+        """Returns the pickled value of a live key, marking it as used."""
+        try:
+            expiry, pickled = self._cache[key]
+        except KeyError:
+            return None
+        if expiry is not None and expiry <= time.time():
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return pickled
+
+    def _set(self, key, pickled, timeout):
+        self._cache.pop(key, None)
+        while len(self._cache) >= self._max_entries:
+            self._cache.popitem(last=False)
+        self._cache[key] = (self.get_backend_timeout(timeout), pickled)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if self._get(key) is not None:
+                return False
+            self._set(key, pickled, timeout)
+            return True
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            pickled = self._get(key)
+        if pickled is None:
+            return default
+        try:
+            return pickle.loads(pickled)
+        except pickle.PickleError:
+            return default
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._set(key, pickled, timeout)
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            pickled = self._get(key)
+            if pickled is None:
+                raise ValueError("Key '%s' not found" % key)
+            new_value = pickle.loads(pickled) + delta
+            expiry = self._cache[key][0]
+            self._cache[key] = (
+                expiry, pickle.dumps(new_value, pickle.HIGHEST_PROTOCOL))
+        return new_value
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            return self._get(key) is not None
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
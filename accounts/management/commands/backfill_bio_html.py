@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from accounts import invalidation, sanitizer
+from accounts.models import Profile
+
+
+class Command(BaseCommand):
+    help = "Stores sanitized HTML and text length of every profile's bio."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        total = sanitizer.backfill(Profile, options['batch_size'],
+                                   invalidation.invalidate_users)
+        self.stdout.write("Backfilled {} profiles.".format(total))
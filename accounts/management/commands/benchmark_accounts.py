@@ -0,0 +1,352 @@
+import io
+import itertools
+import json
+import random
+import resource
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from PIL import Image
+
+from accounts import avatars, benchmarks
+from accounts.models import Profile
+
+
+PASSWORDS = ('Bench-mark-pass-1!', 'Bench-mark-pass-2!')
+
+
+def image_bytes(rng, size=800):
+    """Returns a JPEG of random colour blocks."""
+    image = Image.new('RGB', (size, size))
+    block = size // 8
+    for x in range(0, size, block):
+        for y in range(0, size, block):
+            colour = tuple(rng.randint(0, 255) for _ in range(3))
+            image.paste(colour, (x, y, x + block, y + block))
+    buf = io.BytesIO()
+    image.save(buf, 'JPEG', quality=90)
+    return buf.getvalue()
+
+
+class BenchmarkClient(object):
+    """A signed in test client with its own user."""
+    counter = itertools.count()
+
+    def __init__(self, user, rng):
+        self.user = user
+        self.rng = rng
+        self.password = PASSWORDS[0]
+        self.client = Client()
+        self.client.force_login(user)
+
+
+# Each endpoint prepares a client, untimed, and returns the timed request
+# along with the status codes it should answer with.
+
+def sign_in(bench):
+    bench.client.logout()
+    return (lambda: bench.client.post(reverse('accounts:sign_in'), {
+        'username': bench.user.username, 'password': bench.password}),
+        (302,))
+
+
+def sign_up(bench):
+    bench.client.logout()
+    username = 'bench_new_{}_{}'.format(
+        bench.user.pk, next(BenchmarkClient.counter))
+    return (lambda: bench.client.post(reverse('accounts:sign_up'), {
+        'username': username,
+        'password1': PASSWORDS[0],
+        'password2': PASSWORDS[0],
+    }), (302,))
+
+
+def sign_out(bench):
+    bench.client.force_login(bench.user)
+    return lambda: bench.client.get(reverse('accounts:sign_out')), (302,)
+
+
+def profile(bench):
+    bench.client.force_login(bench.user)
+    return lambda: bench.client.get(reverse('accounts:profile')), (200,)
+
+
+def directory(bench):
+    query = {'q': bench.rng.choice(('be', 'bench', 'py', '')),
+             'country': bench.rng.choice(benchmarks.COUNTRIES + ('',))}
+    return (lambda: bench.client.get(reverse('accounts:directory'), query),
+            (200,))
+
+
+def edit_profile(bench):
+    return lambda: bench.client.get(reverse('accounts:edit_profile')), (200,)
+
+
+def edit_profile_save(bench):
+    profile = Profile.objects.get(user=bench.user)
+    data = {
+        'first_name': 'Bench',
+        'last_name': bench.user.last_name,
+        'email': bench.user.email,
+        'verify_email': bench.user.email,
+        'profile-version': profile.version,
+        'profile-bio': '<p>Benchmark bio number {}.</p>'.format(
+            bench.rng.randint(0, 10 ** 6)),
+        'profile-website': '',
+        'profile-country': bench.rng.choice(benchmarks.COUNTRIES),
+        'profile-date_of_birth': '',
+    }
+    return (lambda: bench.client.post(reverse('accounts:edit_profile'), data),
+            (302,))
+
+
+def change_password(bench):
+    old, new = bench.password, PASSWORDS[bench.password == PASSWORDS[0]]
+    bench.password = new
+    return (lambda: bench.client.post(reverse('accounts:change_password'), {
+        'old_password': old,
+        'new_password1': new,
+        'new_password2': new,
+    }), (302,))
+
+
+def edit_avatar(bench):
+    return lambda: bench.client.get(reverse('accounts:edit_avatar')), (200,)
+
+
+def edit_avatar_upload(bench):
+    upload = io.BytesIO(image_bytes(bench.rng))
+    upload.name = 'avatar.jpg'
+    return (lambda: bench.client.post(reverse('accounts:edit_avatar'),
+                                      {'avatar': upload}), (302,))
+
+
+def edit_avatar_status(bench):
+    return (lambda: bench.client.get(reverse('accounts:edit_avatar_status')),
+            (200,))
+
+
+def edit_avatar_crop(bench):
+    box = {'x1': 10, 'y1': 10, 'x2': 10 + bench.rng.randint(100, 400),
+           'y2': 10 + bench.rng.randint(100, 400)}
+    return (lambda: bench.client.get(reverse('accounts:edit_avatar_crop'),
+                                     box), (302,))
+
+
+def edit_avatar_rotate(bench):
+    return (lambda: bench.client.get(reverse('accounts:edit_avatar_rotate')),
+            (302,))
+
+
+def edit_avatar_flip(bench):
+    return (lambda: bench.client.get(reverse('accounts:edit_avatar_flip')),
+            (302,))
+
+
+def export_profiles(bench):
+    def request():
+        response = bench.client.get(reverse('accounts:export_profiles'),
+                                    {'format': 'csv'})
+        # The export is streamed, so it's only produced while read.
+        b''.join(response.streaming_content)
+        return response
+    return request, (200,)
+
+
+ENDPOINTS = [
+    sign_in, sign_up, sign_out, profile, directory, edit_profile,
+    edit_profile_save, change_password, edit_avatar, edit_avatar_upload,
+    edit_avatar_status, edit_avatar_crop, edit_avatar_rotate,
+    edit_avatar_flip, export_profiles,
+]
+
+
+def run_client(endpoint, bench, requests):
+    """Makes `requests` requests to an endpoint with one client. Returns
+    (timings, queries per request, descriptions of failed requests)."""
+    timings = []
+    queries = []
+    errors = []
+    try:
+        for _ in range(requests):
+            request, expected = endpoint(bench)
+            started = time.perf_counter()
+            try:
+                response = request()
+            except Exception as e:
+                # The test client raises what would have been a 500.
+                timings.append(time.perf_counter() - started)
+                errors.append(repr(e))
+                continue
+            timings.append(time.perf_counter() - started)
+            stats = getattr(response.wsgi_request, 'metrics', None)
+            if stats is not None:
+                queries.append(stats.queries)
+            if response.status_code not in expected:
+                errors.append('status {}'.format(response.status_code))
+    finally:
+        connection.close()
+    return timings, queries, errors
+
+
+def peak_rss_kb():
+    """Returns the peak resident set size of this process, in kilobytes."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Command(BaseCommand):
+    help = ("Seeds a fresh test database and drives every accounts view with "
+            "concurrent clients, reporting latency, throughput, queries per "
+            "request and peak memory. Results can be saved as JSON and "
+            "compared with a baseline, failing on regressions.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--avatars', type=int, default=100,
+                            help="Seeded profiles given an avatar.")
+        parser.add_argument('--concurrency', type=int, default=4)
+        parser.add_argument('--requests', type=int, default=25,
+                            help="Requests per client and endpoint.")
+        parser.add_argument('--endpoint', action='append', default=None,
+                            help="Endpoint to run; may be repeated.")
+        parser.add_argument('--output', help="File to save results to.")
+        parser.add_argument('--baseline',
+                            help="Results file to compare against.")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Allowed relative p95 slowdown.")
+        parser.add_argument('--min-delta-ms', type=float, default=2.0,
+                            help="p95 slowdowns below this are noise.")
+
+    def handle(self, *args, **options):
+        names = [endpoint.__name__ for endpoint in ENDPOINTS]
+        endpoints = ENDPOINTS
+        if options['endpoint']:
+            unknown = set(options['endpoint']) - set(names)
+            if unknown:
+                raise CommandError("Unknown endpoints: {}. Choose from {}."
+                                   .format(', '.join(sorted(unknown)),
+                                           ', '.join(names)))
+            endpoints = [endpoint for endpoint in ENDPOINTS
+                         if endpoint.__name__ in options['endpoint']]
+
+        # Avatars are processed inline, so their cost is measured.
+        with benchmarks.test_database(), override_settings(
+                MEDIA_ROOT=tempfile.mkdtemp(), ALLOWED_HOSTS=['testserver'],
+                AVATAR_JOB_WORKERS=0, DEBUG=False):
+            results = self.run(endpoints, options)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = self.compare(baseline, results, options)
+            if regressions:
+                raise CommandError("Regressions against {}:\n  {}".format(
+                    options['baseline'], '\n  '.join(regressions)))
+            self.stdout.write("No regressions against {}.".format(
+                options['baseline']))
+
+    def run(self, endpoints, options):
+        rng = random.Random(0)
+        self.stdout.write("Seeding {} users, {} with avatars...".format(
+            options['users'], options['avatars']))
+        clients = [BenchmarkClient(user, random.Random(index))
+                   for index, user in enumerate(self.seed(rng, options))]
+        if 'export_profiles' in [e.__name__ for e in endpoints]:
+            User.objects.filter(pk=clients[0].user.pk).update(is_staff=True)
+
+        results = {
+            'settings': {key: options[key] for key in (
+                'users', 'avatars', 'concurrency', 'requests')},
+            'endpoints': {},
+        }
+        for endpoint in endpoints:
+            # Staff only.
+            endpoint_clients = (clients[:1] if endpoint is export_profiles
+                                else clients)
+            timings, queries, errors = [], [], []
+            started = time.perf_counter()
+            with ThreadPoolExecutor(len(endpoint_clients)) as pool:
+                for client_timings, client_queries, client_errors in pool.map(
+                        run_client, [endpoint] * len(endpoint_clients),
+                        endpoint_clients,
+                        [options['requests']] * len(endpoint_clients)):
+                    timings.extend(client_timings)
+                    queries.extend(client_queries)
+                    errors.extend(client_errors)
+            elapsed = time.perf_counter() - started
+
+            stats = benchmarks.summarize(timings)
+            stats.update({
+                'requests_per_second': len(timings) / elapsed,
+                'queries_per_request': (
+                    float(sum(queries)) / len(queries) if queries else None),
+                'errors': len(errors),
+                'peak_rss_kb': peak_rss_kb(),
+            })
+            results['endpoints'][endpoint.__name__] = stats
+            self.stdout.write(
+                "{:<20} {:>7.1f} req/s  p50={p50_ms:.1f}ms "
+                "p95={p95_ms:.1f}ms p99={p99_ms:.1f}ms  {} queries/req  "
+                "rss={peak_rss_kb}KB{}".format(
+                    endpoint.__name__, stats['requests_per_second'],
+                    '?' if stats['queries_per_request'] is None
+                    else '{:.1f}'.format(stats['queries_per_request']),
+                    '  {} errors, e.g. {}'.format(len(errors), errors[0])
+                    if errors else '', **stats))
+        return results
+
+    def seed(self, rng, options):
+        """Creates the users, profiles and avatars, returning the users the
+        clients sign in as."""
+        users = benchmarks.seed_users(
+            max(options['users'], options['concurrency']), PASSWORDS[0], rng)
+
+        # Clients need avatars to crop, rotate and flip.
+        with_avatars = max(options['avatars'], options['concurrency'])
+        for profile in Profile.objects.filter(
+                user__in=users[:with_avatars]).select_related('user'):
+            profile.avatar.save('seed.jpg', ContentFile(image_bytes(rng)),
+                                save=False)
+            profile.save()
+            avatars.process_upload(profile)
+        return users[:options['concurrency']]
+
+    def compare(self, baseline, results, options):
+        """Returns descriptions of regressions against a baseline."""
+        regressions = []
+        for name, current in sorted(results['endpoints'].items()):
+            previous = baseline.get('endpoints', {}).get(name)
+            if previous is None:
+                continue
+            delta = current['p95_ms'] - previous['p95_ms']
+            if (current['p95_ms'] > previous['p95_ms'] * (
+                    1 + options['tolerance']) and
+                    delta > options['min_delta_ms']):
+                regressions.append("{}: p95 {:.1f}ms -> {:.1f}ms".format(
+                    name, previous['p95_ms'], current['p95_ms']))
+            if (current['queries_per_request'] is not None and
+                    previous.get('queries_per_request') is not None and
+                    current['queries_per_request'] >
+                    previous['queries_per_request'] + 0.5):
+                regressions.append("{}: {:.1f} -> {:.1f} queries/request"
+                                   .format(name,
+                                           previous['queries_per_request'],
+                                           current['queries_per_request']))
+            error_rate = float(current['errors']) / max(current['count'], 1)
+            previous_rate = (float(previous.get('errors', 0)) /
+                             max(previous.get('count', 0), 1))
+            if error_rate > previous_rate + 0.01:
+                regressions.append("{}: {:.1%} -> {:.1%} failed requests"
+                                   .format(name, previous_rate, error_rate))
+        return regressions
@@ -0,0 +1,157 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import (HTTPCookieProcessor, HTTPRedirectHandler,
+                            build_opener)
+
+from django.core.management.base import BaseCommand
+from django.core.servers.basehttp import WSGIRequestHandler, WSGIServer
+from django.core.urlresolvers import reverse
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils.six.moves import socketserver
+
+from accounts import benchmarks
+
+
+PASSWORD = 'Bench-mark-pass-1!'
+
+MODES = ('sync', 'threaded')
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadedWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class NoRedirects(HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPClient(object):
+    """A browser-like client with its own cookies, signed in as a user."""
+    def __init__(self, base_url, username):
+        self.base_url = base_url
+        self.username = username
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies),
+                                   NoRedirects)
+        self.request('GET', reverse('accounts:sign_in'))
+        self.sign_in()
+
+    def request(self, method, path, data=None):
+        """Makes a request, returning its status code."""
+        if data is not None:
+            data = urlencode(data).encode('ascii')
+        try:
+            with self.opener.open(self.base_url + path, data) as response:
+                response.read()
+                return response.status
+        except HTTPError as e:
+            e.read()
+            return e.code
+
+    def sign_in(self):
+        token = next(cookie.value for cookie in self.cookies
+                     if cookie.name == 'csrftoken')
+        return self.request('POST', reverse('accounts:sign_in'), {
+            'csrfmiddlewaretoken': token,
+            'username': self.username,
+            'password': PASSWORD,
+        })
+
+    def profile(self):
+        return self.request('GET', reverse('accounts:profile'))
+
+
+def run_client(client, requests, sign_in_ratio, rng):
+    """Makes a mix of sign ins and profile views, returning timings by
+    request type and the number of unexpected responses."""
+    timings = {'sign_in': [], 'profile': []}
+    errors = 0
+    for _ in range(requests):
+        kind = 'sign_in' if rng.random() < sign_in_ratio else 'profile'
+        expected = 302 if kind == 'sign_in' else 200
+        started = time.perf_counter()
+        status = getattr(client, kind)()
+        timings[kind].append(time.perf_counter() - started)
+        if status != expected:
+            errors += 1
+    return timings, errors
+
+
+class Command(BaseCommand):
+    help = ("Serves the project over HTTP from one worker process, either "
+            "one request at a time or from a thread per request, and "
+            "compares them under concurrent clients mixing password "
+            "checking sign ins with cheap profile views.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=20,
+                            help="Requests per client.")
+        parser.add_argument('--sign-in-ratio', type=float, default=0.25,
+                            help="Fraction of requests that sign in.")
+        parser.add_argument('--mode', action='append', choices=MODES,
+                            default=None,
+                            help="Serving mode to test; may be repeated.")
+
+    def handle(self, *args, **options):
+        with benchmarks.test_database(), override_settings(
+                ALLOWED_HOSTS=['127.0.0.1'], DEBUG=False):
+            users = benchmarks.seed_users(options['clients'], PASSWORD,
+                                          random.Random(0))
+            connection.close()
+            application = get_wsgi_application()
+            for mode in options['mode'] or MODES:
+                self.run(mode, application, users, options)
+
+    def run(self, mode, application, users, options):
+        server_class = ThreadedWSGIServer if mode == 'threaded' else (
+            WSGIServer)
+        server = server_class(('127.0.0.1', 0), QuietRequestHandler)
+        server.set_app(application)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        base_url = 'http://127.0.0.1:{}'.format(server.server_port)
+        try:
+            with ThreadPoolExecutor(options['clients']) as pool:
+                clients = list(pool.map(
+                    lambda user: HTTPClient(base_url, user.username), users))
+                started = time.perf_counter()
+                results = list(pool.map(
+                    run_client, clients,
+                    [options['requests']] * len(clients),
+                    [options['sign_in_ratio']] * len(clients),
+                    [random.Random(index) for index in range(len(clients))]))
+                elapsed = time.perf_counter() - started
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        timings = {'sign_in': [], 'profile': []}
+        errors = 0
+        for client_timings, client_errors in results:
+            for kind, samples in client_timings.items():
+                timings[kind].extend(samples)
+            errors += client_errors
+        total = sum(len(samples) for samples in timings.values())
+        self.stdout.write("{:<9} {:>7.1f} req/s{}".format(
+            mode, total / elapsed,
+            '  {} unexpected responses'.format(errors) if errors else ''))
+        for kind, samples in sorted(timings.items()):
+            self.stdout.write(
+                "  {:<8} {count:>5}  p50={p50_ms:.1f}ms p95={p95_ms:.1f}ms "
+                "p99={p99_ms:.1f}ms".format(
+                    kind, **benchmarks.summarize(samples)))
@@ -0,0 +1,121 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts import benchmarks, directory, sanitizer
+from accounts.models import Profile
+
+
+SYLLABLES = ('an', 'bel', 'cor', 'da', 'el', 'fin', 'gar', 'hal', 'is',
+             'jon', 'kar', 'lin', 'mor', 'nel', 'or', 'per', 'quin', 'ros',
+             'sal', 'tor', 'ul', 'var', 'wes', 'yor', 'zan')
+WORDS = ('python', 'django', 'hiking', 'music', 'coffee', 'travel', 'design',
+         'photography', 'running', 'cooking', 'chess', 'gardening')
+
+
+def make_name(rng):
+    """Returns a random capitalized name."""
+    return ''.join(rng.choice(SYLLABLES)
+                   for _ in range(rng.randint(2, 3))).capitalize()
+
+
+class Command(BaseCommand):
+    help = ("Times directory searches and deep keyset pages, either against "
+            "the configured database or, with --seed, against a throwaway "
+            "test database filled with synthetic profiles.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0,
+                            help="Number of synthetic profiles to create "
+                                 "in a test database first, e.g. 1000000.")
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--pages', type=int, default=50,
+                            help="Pages to walk for the deep paging test.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        if not options['seed']:
+            self.run(rng, options)
+            return
+        with benchmarks.test_database():
+            self.seed(rng, options['seed'], options['batch_size'])
+            self.run(rng, options)
+
+    def run(self, rng, options):
+        self.stdout.write("FTS table: {}".format(
+            'yes' if directory.has_fts() else 'no (icontains fallback)'))
+        count = options['queries']
+        self.report('first page', [
+            self.timed(directory.search) for _ in range(count)])
+        self.report('name prefix', [
+            self.timed(directory.search, make_name(rng)[:3])
+            for _ in range(count)])
+        self.report('bio word', [
+            self.timed(directory.search, rng.choice(WORDS))
+            for _ in range(count)])
+        self.report('country', [
+            self.timed(directory.search,
+                       country=rng.choice(benchmarks.COUNTRIES))
+            for _ in range(count)])
+        self.report('name and country', [
+            self.timed(directory.search, make_name(rng)[:2],
+                       country=rng.choice(benchmarks.COUNTRIES))
+            for _ in range(count)])
+
+        cursor = None
+        samples = []
+        for _ in range(options['pages']):
+            started = time.perf_counter()
+            profiles, cursor = directory.search(cursor=cursor)
+            samples.append(time.perf_counter() - started)
+            if cursor is None:
+                break
+        self.report('successive pages', samples)
+
+    def timed(self, func, *args, **kwargs):
+        """Returns the run time of one call, in seconds."""
+        started = time.perf_counter()
+        func(*args, **kwargs)
+        return time.perf_counter() - started
+
+    def report(self, label, samples):
+        stats = benchmarks.summarize(samples)
+        self.stdout.write(
+            "{:<20} n={count:<6} mean={mean_ms:.2f}ms p50={p50_ms:.2f}ms "
+            "p95={p95_ms:.2f}ms p99={p99_ms:.2f}ms".format(label, **stats))
+
+    def seed(self, rng, total, batch_size):
+        """Creates `total` users with profiles using bulk inserts."""
+        start = (User.objects.order_by('-pk').values_list(
+            'pk', flat=True).first() or 0) + 1
+        created = 0
+        while created < total:
+            size = min(batch_size, total - created)
+            usernames = ['bench{}'.format(start + created + i)
+                         for i in range(size)]
+            with transaction.atomic():
+                User.objects.bulk_create([
+                    User(username=username, password='!',
+                         first_name=make_name(rng),
+                         last_name=make_name(rng))
+                    for username in usernames
+                ])
+                user_ids = User.objects.filter(
+                    username__in=usernames).values_list('pk', flat=True)
+                profiles = []
+                for user_id in user_ids:
+                    bio = '<p><strong>{}</strong> {}&nbsp;{}</p>'.format(
+                        *rng.sample(WORDS, 3))
+                    bio_html, bio_length = sanitizer.sanitize(bio)
+                    profiles.append(Profile(
+                        user_id=user_id,
+                        country=rng.choice(benchmarks.COUNTRIES),
+                        bio=bio, bio_html=bio_html, bio_length=bio_length))
+                Profile.objects.bulk_create(profiles)
+            created += size
+            self.stdout.write("Seeded {} of {} profiles".format(
+                created, total))
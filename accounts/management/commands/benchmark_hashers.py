@@ -0,0 +1,56 @@
+import math
+import time
+
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = ("Times each PASSWORD_HASHERS entry on this host and recommends "
+            "work factors for a target hashing latency.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target-ms', type=float, default=250.0)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        target = options['target_ms']
+        self.stdout.write("{:<28}{:>12}{:>14}  {}".format(
+            'hasher', 'work factor', 'ms/hash', 'recommendation'))
+        for hasher in get_hashers():
+            try:
+                elapsed = self.time_hasher(hasher, options['repeat'])
+            except ValueError as e:
+                # Raised when the hasher's library isn't installed.
+                self.stdout.write("{:<28}{:>12}{:>14}  {}".format(
+                    hasher.algorithm, '-', '-', e))
+                continue
+            factor, recommendation = self.recommend(hasher, elapsed, target)
+            self.stdout.write("{:<28}{:>12}{:>14.2f}  {}".format(
+                hasher.algorithm, factor, elapsed, recommendation))
+
+    def time_hasher(self, hasher, repeat):
+        """Returns the best of `repeat` hash times, in milliseconds."""
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            hasher.encode('correct horse battery staple', hasher.salt())
+            elapsed = 1000.0 * (time.perf_counter() - started)
+            if best is None or elapsed < best:
+                best = elapsed
+        return best
+
+    def recommend(self, hasher, elapsed, target):
+        """Returns (current work factor, advice) for reaching `target` ms."""
+        scale = target / elapsed if elapsed else 1.0
+        if hasattr(hasher, 'iterations'):
+            iterations = max(int(round(hasher.iterations * scale, -3)), 1000)
+            return hasher.iterations, "iterations = {}".format(iterations)
+        if hasattr(hasher, 'rounds'):
+            # bcrypt cost doubles with every round.
+            rounds = max(hasher.rounds + int(round(math.log(scale, 2))), 4)
+            return hasher.rounds, "rounds = {}".format(rounds)
+        if hasattr(hasher, 'time_cost'):
+            time_cost = max(int(round(hasher.time_cost * scale)), 1)
+            return hasher.time_cost, "time_cost = {}".format(time_cost)
+        return '-', "not tunable; avoid for new passwords"
@@ -0,0 +1,154 @@
+import random
+import re
+import string
+
+from django.contrib.auth.password_validation import get_default_password_validators
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.translation import ugettext as _
+
+from accounts import benchmarks
+from project_7 import validators
+
+
+# Character sets passwords are drawn from, so the corpus holds passwords
+# failing each rule, and characters the rules must not count.
+ALPHABETS = (
+    string.ascii_letters + string.digits + string.punctuation,
+    string.ascii_lowercase + string.digits + string.punctuation,
+    string.ascii_letters + string.punctuation,
+    string.ascii_letters + string.digits,
+    string.ascii_letters + string.digits + ' \t',
+    string.ascii_letters + 'éÄß€٣',
+    string.punctuation + string.digits,
+)
+
+
+# The single-rule regex validators the policy engine replaced, kept to time
+# it against and to check its results against.
+class RegexUpperLowerCaseValidator(object):
+    def validate(self, password, user=None):
+        if not re.search(r'[a-z]+', password) or (
+                not re.search(r'[A-Z]+', password)):
+            raise ValidationError(
+                _("Your password doesn't contain both uppercase and lowercase"
+                  " letters."),
+            )
+
+
+class RegexContainsNumberValidator(object):
+    def validate(self, password, user=None):
+        if not re.search(r'[0-9]+', password):
+            raise ValidationError(
+                _("Your password doesn't contain numerical digits."),
+            )
+
+
+class RegexContainsSpecialCharactersValidator(object):
+    def validate(self, password, user=None):
+        # Checks for digits again; the policy engine fixes this.
+        if not re.search(r'[0-9]+', password):
+            raise ValidationError(
+                _("Your password doesn't contain special characters, such as"
+                  " @, #, $."),
+            )
+
+
+def passes(validator, password):
+    """Returns True if a validator accepts a password."""
+    try:
+        validator.validate(password)
+    except ValidationError:
+        return False
+    return True
+
+
+def failed_codes(validator, password):
+    """Returns the codes of the rules a password fails."""
+    try:
+        validator.validate(password)
+    except ValidationError as e:
+        return set(error.code for error in e.error_list)
+    return set()
+
+
+def has_special(password):
+    """The corrected special character rule."""
+    return any(not character.isalnum() and not character.isspace()
+               for character in password)
+
+
+class Command(BaseCommand):
+    help = ("Times the password policy engine against the regex validators "
+            "it replaced, after checking that both give the same results "
+            "apart from the special character fix.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--passwords', type=int, default=100000)
+        parser.add_argument('--length', type=int, default=16)
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        passwords = []
+        for _ in range(options['passwords']):
+            alphabet = rng.choice(ALPHABETS)
+            passwords.append(''.join(rng.choice(alphabet)
+                                     for _ in range(options['length'])))
+
+        self.check_results(passwords)
+
+        candidates = [
+            ('regex chain', [
+                RegexUpperLowerCaseValidator(),
+                RegexContainsNumberValidator(),
+                RegexContainsSpecialCharactersValidator(),
+            ]),
+            ('policy engine', [validators.PasswordPolicyValidator()]),
+            ('configured validators', get_default_password_validators()),
+        ]
+        for name, chain in candidates:
+            def check(password, chain=chain):
+                for validator in chain:
+                    try:
+                        validator.validate(password)
+                    except ValidationError:
+                        pass
+
+            elapsed = benchmarks.time_calls(check, passwords,
+                                            options['repeat'])
+            self.stdout.write("{:<24}{:>10.2f} us/password{:>12.0f}/s".format(
+                name, 1e6 * elapsed / len(passwords),
+                len(passwords) / elapsed))
+
+    def check_results(self, passwords):
+        """Raises CommandError unless the engine accepts and rejects the
+        corpus as the regex validators do, bar the special character fix."""
+        rules = (
+            ('password_no_mixed_case', RegexUpperLowerCaseValidator(), None),
+            ('password_no_digit', RegexContainsNumberValidator(), None),
+            ('password_no_special_character',
+             RegexContainsSpecialCharactersValidator(), has_special),
+        )
+        engine = validators.PasswordPolicyValidator()
+        mismatches = []
+        changed = 0
+        for password in passwords:
+            codes = failed_codes(engine, password)
+            for code, old, fixed in rules:
+                expected = fixed(password) if fixed else passes(old, password)
+                if (code not in codes) != expected:
+                    mismatches.append((password, code))
+            if passes(engine, password) != all(
+                    passes(rule[1], password) for rule in rules):
+                changed += 1
+        if mismatches:
+            raise CommandError(
+                "The policy engine disagrees with the regex validators on "
+                "{} checks, e.g. {!r}".format(len(mismatches),
+                                             mismatches[:5]))
+        self.stdout.write(
+            "Results match the regex validators; the special character fix "
+            "changes the verdict on {} of {} passwords.".format(
+                changed, len(passwords)))
@@ -0,0 +1,83 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from accounts import benchmarks
+
+
+ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+    'accounts.sessions',
+)
+WRITES = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def simulate_client(engine, requests):
+    """Signs a simulated client in and makes `requests` requests, as the
+    session and auth middleware would. Returns (request timings, database
+    writes)."""
+    store_class = import_module(engine).SessionStore
+    timings = []
+    try:
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            session = store_class()
+            session.create()
+            session['_auth_user_id'] = '1'
+            session['_auth_user_backend'] = 'accounts.backends.ProfileBackend'
+            session['_auth_user_hash'] = 'hash'
+            session.save()
+            timings.append(time.perf_counter() - started)
+            for _ in range(requests):
+                started = time.perf_counter()
+                session = store_class(session.session_key)
+                session.get('_auth_user_id')
+                # As update_session_auth_hash does when nothing changed.
+                session['_auth_user_hash'] = 'hash'
+                session.save()
+                timings.append(time.perf_counter() - started)
+        writes = sum(1 for query in queries
+                     if query['sql'].lstrip().upper().startswith(WRITES))
+        session.delete()
+    finally:
+        connection.close()
+    return timings, writes
+
+
+class Command(BaseCommand):
+    help = ("Compares session backends under concurrent simulated sign-ins "
+            "and requests against the configured database and cache.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=200)
+        parser.add_argument('--requests', type=int, default=10,
+                            help="Requests per client after signing in.")
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--engine', action='append', default=None,
+                            help="Session engine to test; may be repeated.")
+
+    def handle(self, *args, **options):
+        for engine in options['engine'] or ENGINES:
+            timings = []
+            writes = 0
+            started = time.perf_counter()
+            with ThreadPoolExecutor(options['concurrency']) as pool:
+                results = pool.map(
+                    simulate_client,
+                    [engine] * options['clients'],
+                    [options['requests']] * options['clients'])
+                for client_timings, client_writes in results:
+                    timings.extend(client_timings)
+                    writes += client_writes
+            elapsed = time.perf_counter() - started
+            stats = benchmarks.summarize(timings)
+            self.stdout.write(
+                "{:<45} {:>8.0f} req/s  p50={p50_ms:.2f}ms "
+                "p95={p95_ms:.2f}ms p99={p99_ms:.2f}ms  "
+                "{} db writes".format(engine, len(timings) / elapsed,
+                                      writes, **stats))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import assets
+
+
+class Command(BaseCommand):
+    help = ("Builds the minified, content-hashed and precompressed static "
+            "bundles listed in ASSET_BUNDLES, and their manifest.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clean', action='store_true',
+                            help="Remove bundles no longer in the manifest.")
+
+    def handle(self, *args, **options):
+        try:
+            manifest = assets.build(clean=options['clean'])
+        except ValueError as e:
+            raise CommandError(e)
+        for name, static_name in sorted(manifest.items()):
+            self.stdout.write("{} -> {}".format(name, static_name))
+        if assets.brotli is None:
+            self.stdout.write("brotli isn't installed; wrote gzip only.")
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from accounts import avatars
+from accounts.models import Profile
+
+
+class Command(BaseCommand):
+    help = "Builds missing renditions for every stored avatar."
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.exclude(avatar='').exclude(avatar=None)
+        count = 0
+        for profile in profiles.iterator():
+            if not profile.avatar_hash:
+                profile.avatar_hash = avatars.file_hash(profile.avatar)
+                profile.save(update_fields=['avatar_hash'])
+            avatars.build_renditions(profile)
+            count += 1
+        self.stdout.write("Checked renditions for {} avatars.".format(count))
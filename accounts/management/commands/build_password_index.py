@@ -0,0 +1,31 @@
+import os
+
+from django.conf import settings
+from django.contrib.auth import password_validation
+from django.core.management.base import BaseCommand
+
+from project_7 import password_index
+
+
+class Command(BaseCommand):
+    help = ("Builds the memory-mapped common password index from plain or "
+            "gzipped word lists, one password per line. Without word lists, "
+            "Django's own list is used.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('word_lists', nargs='*')
+        parser.add_argument('--output', default=None)
+
+    def handle(self, *args, **options):
+        word_lists = options['word_lists'] or [os.path.join(
+            os.path.dirname(os.path.realpath(password_validation.__file__)),
+            'common-passwords.txt.gz')]
+        output = options['output'] or settings.COMMON_PASSWORD_INDEX
+
+        def words():
+            for path in word_lists:
+                for word in password_index.read_words(path):
+                    yield word
+
+        count = password_index.build_index(words(), output)
+        self.stdout.write("Wrote {} passwords to {}.".format(count, output))
@@ -0,0 +1,47 @@
+import io
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts import export
+
+
+class Command(BaseCommand):
+    help = "Streams users joined with their profiles as CSV or JSON lines."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(export.FORMATS),
+                            default='csv')
+        parser.add_argument('--output', default=None,
+                            help="File to write to; defaults to stdout.")
+        parser.add_argument('--database', default=None,
+                            help="Alias to read from, e.g. a replica.")
+        parser.add_argument('--country', default=None)
+        parser.add_argument('--joined-after', default=None,
+                            help="YYYY-MM-DD, inclusive.")
+        parser.add_argument('--joined-before', default=None,
+                            help="YYYY-MM-DD, exclusive.")
+
+    def handle(self, *args, **options):
+        try:
+            lines = export.export_lines(
+                options['format'],
+                country=options['country'],
+                joined_after=options['joined_after'],
+                joined_before=options['joined_before'],
+                using=options['database'],
+            )
+        except ValueError as e:
+            raise CommandError(e)
+
+        if options['output']:
+            output = io.open(options['output'], 'w', encoding='utf-8',
+                             newline='')
+        else:
+            output = sys.stdout
+        try:
+            for line in lines:
+                output.write(line)
+        finally:
+            if output is not sys.stdout:
+                output.close()
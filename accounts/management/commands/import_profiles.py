@@ -0,0 +1,162 @@
+import csv
+import io
+import json
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_date
+
+from accounts import sanitizer
+from accounts.models import Profile
+
+
+USER_FIELDS = ('email', 'first_name', 'last_name')
+
+
+def read_rows(path, file_format):
+    """Yields row dicts from a CSV or JSON lines file."""
+    with io.open(path, encoding='utf-8', newline='') as source:
+        if file_format == 'csv':
+            for row in csv.DictReader(source):
+                yield row
+        else:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def batches(rows, size):
+    """Groups rows into lists of at most `size`."""
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Command(BaseCommand):
+    help = ("Imports users and their profiles from CSV or JSON lines, "
+            "hashing passwords in a process pool and writing rows with "
+            "bulk inserts. Columns: username, email, first_name, last_name, "
+            "password or password_hash, date_of_birth, website, country, "
+            "bio.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['csv', 'jsonl'],
+                            default=None)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--workers', type=int, default=None,
+                            help="Password hashing processes; defaults to "
+                                 "the number of CPUs.")
+        parser.add_argument('--resume', action='store_true',
+                            help="Skip usernames that already exist, e.g. "
+                                 "from an interrupted run.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Validate the input without writing.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or (
+            'csv' if path.endswith('.csv') else 'jsonl')
+        self.resume = options['resume']
+        self.dry_run = options['dry_run']
+        self.imported = self.skipped = 0
+        self.workers = options['workers']
+        self.pool = None
+
+        rows = read_rows(path, file_format)
+        try:
+            for batch in batches(rows, options['batch_size']):
+                self.import_batch(batch)
+                self.stdout.write("{} imported, {} skipped".format(
+                    self.imported, self.skipped))
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+
+        action = "Would import" if self.dry_run else "Imported"
+        self.stdout.write("{} {} users; skipped {}.".format(
+            action, self.imported, self.skipped))
+
+    def import_batch(self, batch):
+        """Writes one batch of users and profiles in a single transaction."""
+        rows = {}
+        for row in batch:
+            username = (row.get('username') or '').strip()
+            if not username:
+                raise CommandError("Row without a username: {!r}".format(row))
+            if username in rows:
+                self.skipped += 1
+                continue
+            rows[username] = row
+        existing = set(User.objects.filter(
+            username__in=list(rows)).values_list('username', flat=True))
+        if existing and not self.resume:
+            raise CommandError(
+                "Users already exist: {}. Use --resume to skip them.".format(
+                    ', '.join(sorted(existing)[:10])))
+        for username in existing:
+            del rows[username]
+            self.skipped += 1
+        profiles = [self.build_profile(row) for row in rows.values()]
+        if self.dry_run or not rows:
+            self.imported += len(rows)
+            return
+
+        hashes = self.hash_passwords([
+            row.get('password') or None for row in rows.values()
+            if not row.get('password_hash')])
+        users = []
+        for username, row in rows.items():
+            users.append(User(
+                username=username,
+                password=row.get('password_hash') or next(hashes),
+                **{field: row.get(field) or '' for field in USER_FIELDS}
+            ))
+
+        # bulk_create() sends no post_save, so create_profile doesn't run
+        # and profiles are inserted here in bulk too.
+        with transaction.atomic():
+            User.objects.bulk_create(users)
+            ids = dict(User.objects.filter(
+                username__in=list(rows)).values_list('username', 'id'))
+            for username, profile in zip(rows, profiles):
+                profile.user_id = ids[username]
+            Profile.objects.bulk_create(profiles)
+        self.imported += len(rows)
+
+    def hash_passwords(self, passwords):
+        """Returns an iterator over the hashes of `passwords`, computed in a
+        process pool started the first time any are needed."""
+        if not passwords:
+            return iter(())
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self.pool.map(make_password, passwords,
+                             chunksize=max(len(passwords) // 64, 1))
+
+    def build_profile(self, row):
+        """Returns an unsaved Profile for an input row."""
+        date_of_birth = None
+        if row.get('date_of_birth'):
+            date_of_birth = parse_date(row['date_of_birth'])
+            if date_of_birth is None:
+                raise CommandError("Invalid date_of_birth for {}: {}".format(
+                    row['username'], row['date_of_birth']))
+        bio = row.get('bio') or None
+        bio_html, bio_length = sanitizer.sanitize(bio)
+        return Profile(
+            date_of_birth=date_of_birth,
+            website=row.get('website') or None,
+            country=(row.get('country') or '').upper() or None,
+            bio=bio,
+            bio_html=bio_html,
+            bio_length=bio_length,
+        )
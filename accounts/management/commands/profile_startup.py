@@ -0,0 +1,214 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+# Runs in a fresh interpreter: loads the WSGI application the way a new
+# worker does and serves one request, timing each phase.
+WORKER = r'''
+import json
+import sys
+import time
+
+started = time.perf_counter()
+imports = []
+
+if %(hook)r:
+    # Stands in for -X importtime, which needs Python 3.7.
+    import builtins
+    import importlib
+    import importlib.util
+
+    nested = [0.0]
+
+    def timed(name, load):
+        loaded = len(sys.modules)
+        nested.append(0.0)
+        begun = time.perf_counter()
+        try:
+            return load()
+        finally:
+            elapsed = time.perf_counter() - begun
+            children = nested.pop()
+            if len(sys.modules) > loaded:
+                imports.append((name, elapsed - children, elapsed))
+                nested[-1] += elapsed
+            else:
+                nested[-1] += children
+
+    original_import = builtins.__import__
+    original_import_module = importlib.import_module
+
+    def timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+        absolute = name
+        if level:
+            absolute = importlib.util.resolve_name(
+                '.' * level + name, (globals or {}).get('__package__'))
+        if fromlist and absolute in sys.modules:
+            # `from package import module` only loads the submodules.
+            absolute += '.' + ('{' + ','.join(fromlist) + '}'
+                               if len(fromlist) > 1 else fromlist[0])
+        return timed(absolute, lambda: original_import(
+            name, globals, locals, fromlist, level))
+
+    def timed_import_module(name, package=None):
+        return timed(importlib.util.resolve_name(name, package),
+                     lambda: original_import_module(name, package))
+
+    builtins.__import__ = timed_import
+    importlib.import_module = timed_import_module
+
+import project_7.wsgi
+loaded = time.perf_counter()
+
+statuses = []
+environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': %(path)r,
+           'HTTP_HOST': %(host)r}
+from wsgiref.util import setup_testing_defaults
+setup_testing_defaults(environ)
+response = project_7.wsgi.application(
+    environ, lambda status, headers, exc_info=None: statuses.append(status))
+b''.join(response)
+response.close()
+responded = time.perf_counter()
+
+print(json.dumps({
+    'load_ms': 1000 * (loaded - started),
+    'first_response_ms': 1000 * (responded - loaded),
+    'status': statuses[0],
+    'modules_loaded': len(sys.modules),
+    'imports': [(name, 1000 * own, 1000 * total)
+                for name, own, total in imports],
+}))
+'''
+
+
+def parse_importtime(stderr):
+    """Returns (module, self ms, cumulative ms) from `-X importtime`
+    output."""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        own, total, name = line[len('import time:'):].split('|')
+        imports.append((name.strip(), int(own) / 1000.0,
+                        int(total) / 1000.0))
+    return imports
+
+
+class Command(BaseCommand):
+    help = ("Starts fresh interpreters that load the WSGI application and "
+            "serve one request, as a new worker does. Reports the time to "
+            "the first response and the import cost of each package, and "
+            "can compare them with a saved baseline.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5,
+                            help="Cold starts to take the median of.")
+        parser.add_argument('--path', default='/',
+                            help="Path of the first request.")
+        parser.add_argument('--top', type=int, default=15,
+                            help="Packages and modules to list.")
+        parser.add_argument('--output', help="File to save results to.")
+        parser.add_argument('--baseline',
+                            help="Results file to compare against.")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Allowed relative slowdown.")
+        parser.add_argument('--min-delta-ms', type=float, default=20.0,
+                            help="Slowdowns below this are noise.")
+
+    def handle(self, *args, **options):
+        runs = [self.cold_start(options['path'])
+                for _ in range(options['runs'])]
+        fastest = min(runs, key=lambda run: run['total_ms'])
+
+        packages = {}
+        for name, own, total in fastest['imports']:
+            package = name.split('.')[0]
+            packages[package] = packages.get(package, 0.0) + own
+        results = {
+            'runs': len(runs),
+            'path': options['path'],
+            'status': fastest['status'],
+            'modules_loaded': fastest['modules_loaded'],
+            'packages_ms': packages,
+        }
+        for phase in ('total_ms', 'load_ms', 'first_response_ms'):
+            results[phase] = statistics.median(run[phase] for run in runs)
+
+        self.stdout.write(
+            "Cold start to first response ({}): {total_ms:.0f}ms, of which "
+            "loading the application {load_ms:.0f}ms and the first request "
+            "{first_response_ms:.0f}ms; {modules_loaded} modules loaded. "
+            "Medians of {runs} runs.".format(fastest['status'], **results))
+        self.stdout.write("Import time by package (self):")
+        for package, own in sorted(packages.items(),
+                                   key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write("  {:<30} {:>7.1f}ms".format(package, own))
+        self.stdout.write("Slowest modules (self / cumulative):")
+        for name, own, total in sorted(
+                fastest['imports'],
+                key=lambda item: -item[1])[:options['top']]:
+            self.stdout.write("  {:<45} {:>7.1f}ms {:>7.1f}ms".format(
+                name, own, total))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = self.compare(baseline, results, options)
+            if regressions:
+                raise CommandError("Regressions against {}:\n  {}".format(
+                    options['baseline'], '\n  '.join(regressions)))
+            self.stdout.write("No regressions against {}.".format(
+                options['baseline']))
+
+    def cold_start(self, path):
+        """Times one fresh interpreter from launch to first response."""
+        hosts = [host for host in settings.ALLOWED_HOSTS
+                 if not host.startswith(('.', '*'))]
+        importtime = sys.version_info >= (3, 7)
+        command = [sys.executable]
+        if importtime:
+            command += ['-X', 'importtime']
+        command += ['-c', WORKER % {
+            'hook': not importtime,
+            'path': path,
+            'host': hosts[0] if hosts else 'localhost',
+        }]
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            command, cwd=settings.BASE_DIR, env=os.environ.copy(),
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            universal_newlines=True)
+        stdout, stderr = process.communicate()
+        elapsed = time.perf_counter() - started
+        if process.returncode:
+            raise CommandError("Cold start failed:\n" + stderr)
+        run = json.loads(stdout.strip().splitlines()[-1])
+        run['total_ms'] = 1000 * elapsed
+        if importtime:
+            run['imports'] = parse_importtime(stderr)
+        return run
+
+    def compare(self, baseline, results, options):
+        """Returns descriptions of regressions against a baseline."""
+        regressions = []
+        for phase in ('total_ms', 'load_ms', 'first_response_ms'):
+            previous, current = baseline[phase], results[phase]
+            if (current > previous * (1 + options['tolerance']) and
+                    current - previous > options['min_delta_ms']):
+                regressions.append("{}: {:.0f}ms -> {:.0f}ms".format(
+                    phase, previous, current))
+        if results['modules_loaded'] > baseline['modules_loaded'] * 1.05:
+            regressions.append("modules loaded: {} -> {}".format(
+                baseline['modules_loaded'], results['modules_loaded']))
+        return regressions
@@ -0,0 +1,137 @@
+import os
+import posixpath
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts import avatars, invalidation, storage
+from accounts.models import Profile
+
+
+class Command(BaseCommand):
+    help = ("Moves avatars stored under their upload names into the "
+            "content-addressed layout, in batches, deleting the old files "
+            "once no profile references them.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--prune', action='store_true',
+                            help="Also delete unreferenced content-addressed "
+                                 "files and rendition sets older than "
+                                 "AVATAR_RELEASE_GRACE.")
+
+    def handle(self, *args, **options):
+        field = Profile._meta.get_field('avatar')
+        self.storage = field.storage
+        self.prefix = field.upload_to.rstrip('/') + '/'
+        self.batch_size = options['batch_size']
+
+        moved, missing = self.relocate()
+        self.stdout.write("Relocated {} avatars; {} files were missing.".format(
+            moved, missing))
+        if options['prune']:
+            self.stdout.write("Pruned {} unreferenced files.".format(
+                self.prune()))
+            self.stdout.write("Pruned {} unreferenced rendition sets.".format(
+                self.prune_renditions()))
+
+    def relocate(self):
+        """Moves every avatar outside the content-addressed prefix."""
+        moved = missing = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                Profile.objects.filter(pk__gt=last_pk)
+                .exclude(avatar='').exclude(avatar=None)
+                .exclude(avatar__startswith=self.prefix)
+                .order_by('pk').values_list('pk', 'user_id', 'avatar')
+                [:self.batch_size])
+            if not batch:
+                return moved, missing
+            last_pk = batch[-1][0]
+
+            relocated = []
+            with transaction.atomic():
+                for pk, user_id, name in batch:
+                    if not self.storage.exists(name):
+                        self.stderr.write("Missing {}".format(name))
+                        missing += 1
+                        continue
+                    with self.storage.open(name) as source:
+                        new_name = self.storage.save(
+                            self.prefix + posixpath.basename(name), source)
+                    # Conditional, in case the user replaced the avatar
+                    # meanwhile.
+                    if Profile.objects.filter(pk=pk, avatar=name).update(
+                            avatar=new_name,
+                            avatar_hash=self.storage.digest(new_name)):
+                        relocated.append((user_id, name))
+            invalidation.invalidate_users(
+                user_id for user_id, name in relocated)
+            for user_id, name in relocated:
+                storage.release(name, grace=0)
+            moved += len(relocated)
+            self.stdout.write("{} avatars relocated".format(moved))
+
+    def prune(self):
+        """Deletes unreferenced files under the content-addressed prefix."""
+        root = self.storage.path(self.prefix)
+        cutoff = time.time() - storage.grace_period()
+        names = []
+        for directory, _, filenames in os.walk(root):
+            relative = os.path.relpath(directory, self.storage.location)
+            for filename in filenames:
+                names.append(posixpath.join(
+                    *relative.split(os.sep) + [filename]))
+        pruned = 0
+        for start in range(0, len(names), self.batch_size):
+            chunk = names[start:start + self.batch_size]
+            referenced = set(Profile.objects.filter(avatar__in=chunk)
+                             .values_list('avatar', flat=True))
+            for name in chunk:
+                if name in referenced:
+                    continue
+                if os.path.getmtime(self.storage.path(name)) < cutoff:
+                    self.storage.delete(name)
+                    pruned += 1
+        return pruned
+
+    def prune_renditions(self):
+        """Deletes rendition sets no profile's rendition key names.
+
+        A set is kept until all its files are older than the grace period,
+        as it may be about to be published.
+        """
+        if not default_storage.exists(avatars.RENDITION_DIR):
+            return 0
+        directories = []
+        for shard in default_storage.listdir(avatars.RENDITION_DIR)[0]:
+            parent = posixpath.join(avatars.RENDITION_DIR, shard)
+            for key in default_storage.listdir(parent)[0]:
+                directories.append((key, posixpath.join(parent, key)))
+        cutoff = time.time() - storage.grace_period()
+        pruned = 0
+        for start in range(0, len(directories), self.batch_size):
+            chunk = directories[start:start + self.batch_size]
+            referenced = set(Profile.objects.filter(
+                avatar_rendition_key__in=[key for key, _ in chunk])
+                .values_list('avatar_rendition_key', flat=True))
+            for key, directory in chunk:
+                if key in referenced:
+                    continue
+                names = [posixpath.join(directory, filename) for filename
+                         in default_storage.listdir(directory)[1]]
+                if any(os.path.getmtime(default_storage.path(name)) >= cutoff
+                       for name in names):
+                    continue
+                for name in names:
+                    default_storage.delete(name)
+                try:
+                    os.rmdir(default_storage.path(directory))
+                except OSError:
+                    # A build wrote into the set meanwhile.
+                    continue
+                pruned += 1
+        return pruned
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from accounts.sessions import SessionStore
+
+
+class Command(BaseCommand):
+    help = ("Deletes expired sessions in small batches, pausing between "
+            "them so that the table is never locked for long.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.05,
+                            help="Seconds to wait between batches.")
+
+    def handle(self, *args, **options):
+        deleted = SessionStore.clear_expired(
+            batch_size=options['batch_size'], pause=options['pause'])
+        self.stdout.write("Deleted {} expired sessions.".format(deleted))
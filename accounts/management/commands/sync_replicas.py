@@ -0,0 +1,33 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = ("Refreshes SQLite replica files with a consistent snapshot of "
+            "the primary database, for trying replica routing locally.")
+
+    def handle(self, *args, **options):
+        primary = connections['default']
+        if primary.vendor != 'sqlite':
+            raise CommandError("Replicas can only be synced from SQLite.")
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("Set DATABASE_REPLICA_FILES to configure "
+                               "replicas.")
+        for alias in settings.DATABASE_REPLICAS:
+            path = connections[alias].settings_dict['NAME']
+            connections[alias].close()
+            temporary = path + '.sync'
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            with primary.cursor() as cursor:
+                cursor.execute('VACUUM INTO %s', [temporary])
+            # Processes with the old file open keep reading it until they
+            # reconnect, which CONN_MAX_AGE bounds.
+            os.replace(temporary, path)
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            self.stdout.write("Synced {} ({})".format(alias, path))
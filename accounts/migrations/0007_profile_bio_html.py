@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 08:46
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from accounts import sanitizer
+
+
+def backfill_bio_html(apps, schema_editor):
+    # Large tables can be backfilled later with `manage.py backfill_bio_html`.
+    sanitizer.backfill(apps.get_model('accounts', 'Profile'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_avatar_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='bio_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='bio_length',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_bio_html, migrations.RunPython.noop),
+    ]
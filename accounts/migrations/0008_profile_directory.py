@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 08:52
+from __future__ import unicode_literals
+
+from django.db import migrations
+import django_countries.fields
+
+from accounts import directory
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_profile_bio_html'),
+        # The triggers reference auth_user, so it must be in its final
+        # shape before they are created.
+        ('auth', '0007_alter_validators_add_error_messages'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='profile',
+            name='country',
+            field=django_countries.fields.CountryField(blank=True, db_index=True, max_length=2, null=True),
+        ),
+        migrations.RunSQL(
+            "CREATE INDEX accounts_user_directory "
+            "ON auth_user (last_name, first_name, id)",
+            "DROP INDEX accounts_user_directory",
+        ),
+        migrations.RunPython(directory.install_fts_migration,
+                             directory.uninstall_fts_migration),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 08:55
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from accounts import directory
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_profile_directory'),
+    ]
+
+    operations = [
+        # SQLite rebuilds accounts_profile to add the column, which would
+        # break the directory search triggers.
+        migrations.RunPython(directory.uninstall_fts_migration,
+                             directory.install_fts_migration),
+        migrations.AddField(
+            model_name='profile',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(directory.install_fts_migration,
+                             directory.uninstall_fts_migration),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.13 on 2026-10-18 09:01
+from __future__ import unicode_literals
+
+import accounts.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_profile_version'),
+    ]
+
+    operations = [
+        # Only the index touches the database. Creating it directly spares
+        # SQLite a rebuild of accounts_profile, which would also break the
+        # directory search triggers.
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    "CREATE INDEX accounts_profile_avatar_idx "
+                    "ON accounts_profile (avatar)",
+                    "DROP INDEX accounts_profile_avatar_idx",
+                ),
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='profile',
+                    name='avatar',
+                    field=models.ImageField(blank=True, db_index=True, null=True, storage=accounts.storage.ContentAddressedStorage(), upload_to='avatars/'),
+                ),
+            ],
+        ),
+    ]
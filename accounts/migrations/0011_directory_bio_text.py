@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from accounts import directory
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_content_addressed_avatars'),
+    ]
+
+    operations = [
+        # Rebuilds the directory search index from the plain text of
+        # bio_html rather than the raw bio, with triggers on bio_html.
+        # The triggers call accounts_html_text(), which only exists on
+        # connections Django opened (see accounts.directory), so from here
+        # on other SQLite clients can't write accounts_profile or auth_user
+        # without registering it themselves.
+        migrations.RunPython(directory.install_fts_migration,
+                             directory.install_fts_migration),
+    ]
@@ -1,7 +1,9 @@
 from django.contrib.auth.models import User
 from django_countries.fields import CountryField
-from django.db.models.signals import post_save
-from django.db import models
+from django.db.models.signals import post_delete, post_init, post_save
+from django.db import models, transaction
+
+from . import invalidation, storage
 
 
 class Profile(models.Model):
@@ -9,9 +11,40 @@ class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     date_of_birth = models.DateField(blank=True, null=True)
     bio = models.TextField(blank=True, null=True)
-    avatar = models.ImageField(upload_to='images/', blank=True, null=True)
+    bio_html = models.TextField(blank=True, default='', editable=False)
+    bio_length = models.PositiveIntegerField(default=0, editable=False)
+    avatar = models.ImageField(upload_to='avatars/',
+                               storage=storage.avatar_storage,
+                               blank=True, null=True, db_index=True)
+    avatar_hash = models.CharField(max_length=40, blank=True, default='',
+                                   editable=False)
+    avatar_transforms = models.TextField(blank=True, default='',
+                                         editable=False)
+    avatar_rendition_key = models.CharField(max_length=40, blank=True,
+                                            default='', editable=False)
     website = models.URLField(blank=True, null=True)
-    country = CountryField(blank=True, null=True, blank_label='Select country')
+    country = CountryField(blank=True, null=True, blank_label='Select country',
+                          db_index=True)
+    # Bumped on every edit, so concurrent edits can detect each other.
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+
+class AvatarJob(models.Model):
+    """Background avatar job state, stored by DatabaseJobBackend."""
+    PENDING = 'pending'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATES = (
+        (PENDING, 'Pending'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    task = models.CharField(max_length=30)
+    state = models.CharField(max_length=10, choices=STATES, default=PENDING)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
 
 
 def create_profile(sender, **kwargs):
@@ -22,3 +55,38 @@ def create_profile(sender, **kwargs):
         user_profile.save()
 
 post_save.connect(create_profile, sender=User)
+
+
+def invalidate_user_caches(sender, instance, **kwargs):
+    """Drop cached copies of a user and profile when either row changes."""
+    invalidation.invalidate_users([getattr(instance, 'user_id', instance.pk)])
+
+post_save.connect(invalidate_user_caches, sender=User)
+post_save.connect(invalidate_user_caches, sender=Profile)
+post_delete.connect(invalidate_user_caches, sender=User)
+post_delete.connect(invalidate_user_caches, sender=Profile)
+
+
+def remember_avatar(sender, instance, **kwargs):
+    """Remember the stored avatar name, to release it once replaced."""
+    instance._stored_avatar = instance.__dict__.get('avatar')
+
+
+def release_replaced_avatar(sender, instance, **kwargs):
+    """Release the previous avatar file once a new one is saved."""
+    previous = getattr(instance, '_stored_avatar', None)
+    current = instance.avatar.name
+    if previous and previous != current:
+        transaction.on_commit(lambda: storage.release(previous))
+    instance._stored_avatar = current
+
+
+def release_deleted_avatar(sender, instance, **kwargs):
+    """Release the avatar file of a deleted profile."""
+    name = instance.avatar.name
+    if name:
+        transaction.on_commit(lambda: storage.release(name))
+
+post_init.connect(remember_avatar, sender=Profile)
+post_save.connect(release_replaced_avatar, sender=Profile)
+post_delete.connect(release_deleted_avatar, sender=Profile)
@@ -0,0 +1,66 @@
+"""Per-user cache of the rendered profile page body.
+
+Entries hold the rendered profile details with the ETag and Last-Modified
+values derived from them, so repeat profile views neither rebuild nor
+re-render anything and conditional requests can be answered with a 304.
+Entries are dropped whenever the user, profile or avatar changes. The drop
+only reaches other processes through a shared cache, so when several
+workers run, ACCOUNTS_PROFILE_CACHE must name a shared backend rather than
+the default in-process one.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+
+
+def profile_cache():
+    """Returns the cache holding rendered profiles."""
+    return caches[getattr(settings, 'ACCOUNTS_PROFILE_CACHE', 'default')]
+
+
+def cache_key(user_id):
+    """Returns the cache key of a user's rendered profile."""
+    return 'accounts:profile:{}'.format(user_id)
+
+
+def user_data(user):
+    """Returns the (name, value) rows shown on a user's profile."""
+    data = [
+        ('first_name', user.first_name),
+        ('last_name', user.last_name),
+        ('email', user.email),
+        ('date_of_birth', user.profile.date_of_birth),
+        ('website', user.profile.website),
+        ('country', user.profile.country),
+        ('bio', user.profile.bio_html),
+    ]
+
+    # Remove items with NULL values
+    return [(key, value) for key, value in data if value]
+
+
+def get_entry(user):
+    """Returns a user's cached profile entry, rendering it if needed."""
+    cache = profile_cache()
+    key = cache_key(user.pk)
+    entry = cache.get(key)
+    if entry is None:
+        data = user_data(user)
+        html = render_to_string('accounts/profile_details.html', {
+            'user': user, 'user_data': data})
+        entry = {
+            'html': html,
+            'etag': hashlib.md5(html.encode('utf-8')).hexdigest(),
+            'last_modified': int(time.time()),
+        }
+        cache.set(key, entry, getattr(
+            settings, 'ACCOUNTS_PROFILE_CACHE_TIMEOUT', 3600))
+    return entry
+
+
+def invalidate(user_id):
+    """Drops a user's rendered profile."""
+    profile_cache().delete(cache_key(user_id))
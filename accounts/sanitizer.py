@@ -0,0 +1,121 @@
+"""Streaming HTML sanitizer for user bios.
+
+Bios are written with TinyMCE, so they arrive as HTML. They are parsed
+once, when saved, by the standard library's event-based HTMLParser: only
+whitelisted tags and attributes survive, and the length of the plain text
+is counted in the same pass. Pages then render the stored result as is.
+"""
+from html.parser import HTMLParser
+
+from django.db import transaction
+from django.utils.html import escape
+
+
+ALLOWED_TAGS = {
+    'a', 'b', 'blockquote', 'br', 'code', 'em', 'h1', 'h2', 'h3', 'h4', 'h5',
+    'h6', 'hr', 'i', 'li', 'ol', 'p', 'pre', 's', 'span', 'strike', 'strong',
+    'sub', 'sup', 'u', 'ul',
+}
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+}
+ALLOWED_SCHEMES = ('http:', 'https:', 'mailto:')
+VOID_TAGS = {'br', 'hr'}
+# Tags dropped together with everything inside them.
+DROPPED_TAGS = {'script', 'style', 'iframe', 'object', 'embed'}
+
+
+class BioSanitizer(HTMLParser):
+    """Rebuilds HTML from whitelisted parts while counting its text."""
+    def __init__(self):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        self.output = []
+        self.open_tags = []
+        self.dropping = 0
+        self.length = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_TAGS:
+            self.dropping += 1
+        if self.dropping or tag not in ALLOWED_TAGS:
+            return
+        allowed = ALLOWED_ATTRIBUTES.get(tag, ())
+        parts = [tag]
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name == 'href' and not value.strip().lower().startswith(
+                    ALLOWED_SCHEMES):
+                continue
+            parts.append('{}="{}"'.format(name, escape(value)))
+        self.output.append('<{}>'.format(' '.join(parts)))
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag not in DROPPED_TAGS:
+            self.handle_starttag(tag, attrs)
+            if tag in self.open_tags[-1:]:
+                self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping or tag not in self.open_tags:
+            return
+        # Close anything left open inside this tag as well.
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.output.append('</{}>'.format(open_tag))
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.dropping:
+            return
+        self.output.append(escape(data))
+        self.length += len(data.replace(' ', ''))
+
+    def result(self):
+        """Returns the sanitized HTML and its plain text length."""
+        self.close()
+        closing = ''.join('</{}>'.format(tag)
+                          for tag in reversed(self.open_tags))
+        return ''.join(self.output) + closing, self.length
+
+
+def sanitize(bio):
+    """Returns (sanitized HTML, plain text length) of a bio.
+
+    The length leaves out spaces, as the bio length validation always has.
+    """
+    parser = BioSanitizer()
+    parser.feed(bio or '')
+    return parser.result()
+
+
+def backfill(profile_model, batch_size=500, on_batch=None):
+    """Fills in sanitized bios of existing profiles, a batch at a time.
+
+    Each batch is written in its own transaction. `on_batch` is called with
+    the user ids of every written batch. Returns the number of profiles.
+    """
+    last_pk = 0
+    total = 0
+    while True:
+        rows = list(
+            profile_model.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', 'user_id', 'bio')[:batch_size]
+        )
+        if not rows:
+            return total
+        with transaction.atomic():
+            for pk, user_id, bio in rows:
+                bio_html, bio_length = sanitize(bio)
+                profile_model.objects.filter(pk=pk).update(
+                    bio_html=bio_html, bio_length=bio_length)
+        if on_batch is not None:
+            on_batch([user_id for pk, user_id, bio in rows])
+        last_pk = rows[-1][0]
+        total += len(rows)
@@ -0,0 +1,150 @@
+"""Write-through cached session backend.
+
+Sessions are read from the SESSION_CACHE_ALIAS cache and fall back to the
+database, like Django's cached_db backend. Saves are skipped entirely when
+the session data is unchanged since it was loaded or last saved, unless the
+stored expiry date is over halfway to lapsing. The cache can be any
+backend; use one shared by all processes, such as FileBasedCache, when
+running several.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.sessions.backends.base import VALID_KEY_CHARS
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.core.cache import caches
+from django.core.exceptions import SuspiciousOperation
+from django.db import transaction
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+
+
+KEY_PREFIX = 'accounts.sessions'
+
+
+class SessionStore(DBStore):
+    """Cached database session store that only writes real changes."""
+    cache_key_prefix = KEY_PREFIX
+
+    def __init__(self, session_key=None):
+        self._cache = caches[settings.SESSION_CACHE_ALIAS]
+        # Serialized data and expiry time of the stored copy, if known.
+        self._stored = None
+        self._stored_expiry = None
+        super(SessionStore, self).__init__(session_key)
+
+    @property
+    def cache_key(self):
+        return self.cache_key_prefix + self._get_or_create_session_key()
+
+    def load(self):
+        try:
+            entry = self._cache.get(self.cache_key)
+        except Exception:
+            # Some cache backends reject unusual keys.
+            entry = None
+        if entry is not None:
+            data, expiry = entry
+            if expiry > time.time():
+                self._remember(data, expiry)
+                return data
+
+        try:
+            session = self.model.objects.get(
+                session_key=self.session_key,
+                expire_date__gt=timezone.now()
+            )
+            data = self.decode(session.session_data)
+        except (self.model.DoesNotExist, SuspiciousOperation):
+            self._session_key = None
+            return {}
+        expiry = time.time() + (
+            session.expire_date - timezone.now()).total_seconds()
+        self._remember(data, expiry)
+        self._cache_entry(data, expiry)
+        return data
+
+    def exists(self, session_key):
+        if session_key and (self.cache_key_prefix + session_key) in (
+                self._cache):
+            return True
+        return super(SessionStore, self).exists(session_key)
+
+    def save(self, must_create=False):
+        if self.session_key is None:
+            return self.create()
+        data = self._get_session(no_load=must_create)
+        if not must_create and not self._needs_write(data):
+            return
+        super(SessionStore, self).save(must_create)
+        expiry = time.time() + self.get_expiry_age()
+        self._remember(data, expiry)
+        self._cache_entry(data, expiry)
+
+    def cycle_key(self):
+        """Moves the session data to a new key.
+
+        Unlike the base implementation, a session that was never stored
+        isn't deleted and inserted again under its new key.
+        """
+        data = self._session
+        key = self.session_key
+        self.create()
+        self._session_cache = data
+        if key:
+            self.delete(key)
+
+    def delete(self, session_key=None):
+        if session_key is None:
+            if self.session_key is None:
+                return
+            session_key = self.session_key
+        self.model.objects.filter(session_key=session_key).delete()
+        self._cache.delete(self.cache_key_prefix + session_key)
+        if session_key == self.session_key:
+            self._stored = self._stored_expiry = None
+
+    def _get_new_session_key(self):
+        # create() inserts with must_create, which already fails on the
+        # vanishingly rare collision, so no query checks the key is free.
+        return get_random_string(32, VALID_KEY_CHARS)
+
+    def _remember(self, data, expiry):
+        self._stored = self.serializer().dumps(data)
+        self._stored_expiry = expiry
+
+    def _cache_entry(self, data, expiry):
+        self._cache.set(self.cache_key, (data, expiry),
+                        max(int(expiry - time.time()), 1))
+
+    def _needs_write(self, data):
+        """Returns True if the stored copy is stale or expiring soon."""
+        if self._stored is None or (
+                self.serializer().dumps(data) != self._stored):
+            return True
+        remaining = self._stored_expiry - time.time()
+        return remaining < self.get_expiry_age() / 2
+
+    @classmethod
+    def clear_expired(cls, batch_size=1000, pause=0.0):
+        """Deletes expired sessions in batches, each in its own short
+        transaction, returning the number deleted.
+
+        Writers can get at the table between batches, so a large backlog
+        never holds the database lock for long.
+        """
+        model = cls.get_model_class()
+        now = timezone.now()
+        deleted = 0
+        while True:
+            with transaction.atomic():
+                keys = list(model.objects.filter(expire_date__lt=now)
+                            .values_list('session_key', flat=True)
+                            [:batch_size])
+                if keys:
+                    model.objects.filter(session_key__in=keys).delete()
+            deleted += len(keys)
+            if len(keys) < batch_size:
+                return deleted
+            if pause:
+                time.sleep(pause)
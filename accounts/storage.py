@@ -0,0 +1,129 @@
+"""Content-addressed avatar storage.
+
+Files are named after the SHA-1 of their content and sharded into nested
+directories, e.g. avatars/3f/a2/3fa2...c1.jpg, so no directory grows large
+and identical uploads share one file. A file is referenced by every
+profile whose avatar names it, and is only deleted once none does.
+"""
+import hashlib
+import os
+import posixpath
+import time
+
+from django.conf import settings
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+from django.core.signals import setting_changed
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import LazyObject, empty
+
+
+class DuplicateContent(Exception):
+    """Raised when identical content was stored concurrently."""
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage naming files by content hash.
+
+    The directory part of the name passed to `save()` (the field's
+    upload_to) is kept, followed by `depth` levels of `width` hex digits.
+    """
+    def __init__(self, depth=2, width=2, **kwargs):
+        self.depth = depth
+        self.width = width
+        super(ContentAddressedStorage, self).__init__(**kwargs)
+
+    def content_hash(self, content):
+        """Returns the SHA-1 hex digest of a file, leaving it rewound."""
+        sha = hashlib.sha1()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            sha.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        return sha.hexdigest()
+
+    def hashed_name(self, name, digest):
+        """Returns the sharded name of content with `digest`."""
+        directory = posixpath.dirname(name)
+        extension = posixpath.splitext(name)[1].lower()
+        shards = [digest[i * self.width:(i + 1) * self.width]
+                  for i in range(self.depth)]
+        return posixpath.join(directory, *shards + [digest + extension])
+
+    def digest(self, name):
+        """Returns the content hash a stored name was derived from."""
+        return posixpath.splitext(posixpath.basename(name))[0]
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.hashed_name(name, self.content_hash(content))
+        if self.exists(name):
+            # Refreshes the grace period that protects new references from
+            # a concurrent release().
+            os.utime(self.path(name), None)
+            return name
+        return self._save(name, content)
+
+    def get_available_name(self, name, max_length=None):
+        # Only reached when _save() loses a race to store identical
+        # content, which is as good as storing it.
+        raise DuplicateContent(name)
+
+    def _save(self, name, content):
+        try:
+            return super(ContentAddressedStorage, self)._save(name, content)
+        except DuplicateContent:
+            return name
+
+
+class AvatarStorage(LazyObject):
+    """Creates the avatar storage on first use, like default_storage, so
+    it follows MEDIA_ROOT overrides."""
+    def _setup(self):
+        self._wrapped = ContentAddressedStorage()
+
+
+avatar_storage = AvatarStorage()
+
+
+def reset_avatar_storage(setting, **kwargs):
+    """Recreates the avatar storage when the media settings change."""
+    if setting in ('MEDIA_ROOT', 'MEDIA_URL', 'FILE_UPLOAD_PERMISSIONS',
+                   'FILE_UPLOAD_DIRECTORY_PERMISSIONS'):
+        avatar_storage._wrapped = empty
+
+setting_changed.connect(reset_avatar_storage)
+
+
+def grace_period():
+    """Returns the age in seconds under which unreferenced files are kept,
+    as they may be about to be referenced."""
+    return getattr(settings, 'AVATAR_RELEASE_GRACE', 3600)
+
+
+def release(name, grace=None):
+    """Deletes a stored avatar unless a profile still references it, or it
+    was stored or reused within `grace` seconds.
+
+    Returns True if the file was deleted.
+    """
+    from .models import Profile
+    if not name or Profile.objects.filter(avatar=name).exists():
+        return False
+    storage = Profile._meta.get_field('avatar').storage
+    try:
+        modified = os.path.getmtime(storage.path(name))
+    except OSError:
+        return False
+    if grace is None:
+        grace = grace_period()
+    if time.time() - modified < grace:
+        return False
+    storage.delete(name)
+    return True
@@ -1,5 +1,7 @@
 from django import template
 
+from .. import avatars
+
 
 register = template.Library()
 
@@ -9,3 +11,34 @@ def underscore_to_space(string):
     """Changes underscore to a space."""
     new_string = string.replace('_', ' ')
     return new_string
+
+
+@register.simple_tag
+def avatar_url(profile, size, fmt='jpeg'):
+    """Returns URL of the avatar rendition best suited to `size` pixels."""
+    return avatars.rendition_url(profile, int(size), fmt)
+
+
+@register.inclusion_tag('accounts/avatar.html')
+def avatar_img(user, size):
+    """Renders a user's avatar, offering WebP and smaller renditions."""
+    profile = user.profile
+    size = int(size)
+    sources = {'webp': '', 'jpeg': ''}
+    # Until renditions are published, the URLs fall back to the stored
+    # avatar, which has no smaller widths to offer.
+    if profile.avatar and profile.avatar_rendition_key:
+        widths = [width for width in sorted(avatars.rendition_sizes())
+                  if width <= size]
+        for fmt in avatars.rendition_formats():
+            urls = [(avatars.rendition_url(profile, width, fmt), width)
+                    for width in widths]
+            sources[fmt] = ', '.join(
+                '{} {}w'.format(url, width) for url, width in urls if url)
+    return {
+        'user': user,
+        'size': size,
+        'src': avatars.rendition_url(profile, size),
+        'webp_srcset': sources['webp'],
+        'jpeg_srcset': sources['jpeg'],
+    }
@@ -0,0 +1,18 @@
+from django import template
+from django.contrib.staticfiles.templatetags.staticfiles import static
+from django.utils.html import format_html_join
+
+from .. import assets
+
+register = template.Library()
+
+
+@register.simple_tag
+def bundle(name):
+    """Links a CSS or JS bundle, or its sources while it isn't built."""
+    if name.endswith('.css'):
+        markup = '<link rel="stylesheet" href="{}" type="text/css">\n'
+    else:
+        markup = '<script type="text/javascript" src="{}"></script>\n'
+    return format_html_join(
+        '', markup, ((static(path),) for path in assets.bundle_paths(name)))
@@ -1,3 +1,1014 @@
-from django.test import TestCase
+import base64
+import datetime
+import io
+import json
+import os
+import posixpath
+import shutil
+import tempfile
+import time
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connection, transaction
+from django.db.models.signals import post_save
+from django.http import HttpResponse
+from django.test import (RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase)
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+from project_7 import (media, password_index, proxy, routers,
+                       validators)
+
+from . import admin as accounts_admin
+from . import (avatars, backends, directory, export, forms,
+               profile_cache, sessions, storage, throttle)
+from .models import Profile
+from .sanitizer import sanitize
+
+
+def run_commit_hooks():
+    """Runs the on_commit callbacks TestCase's transaction holds back."""
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for savepoints, callback in callbacks:
+        callback()
+
+
+class ProfileAdminTests(TestCase):
+    """Query counts of the Profile admin changelist and actions."""
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_superuser(
+            'staff', 'staff@example.com', 'Staff-pass-123!')
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def create_profiles(self, count, **fields):
+        start = User.objects.count()
+        for i in range(start, start + count):
+            user = User.objects.create_user('user{}'.format(i))
+            Profile.objects.filter(user=user).update(**fields)
+
+    def changelist_queries(self, query=''):
+        url = reverse('admin:accounts_profile_changelist') + query
+        # Warms the cached request user, so only the page itself counts.
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.create_profiles(3, country='NZ')
+        few = self.changelist_queries()
+        self.create_profiles(40, country='NZ')
+        self.assertEqual(self.changelist_queries(), few)
+
+    def test_filtered_changelist_queries_do_not_grow_with_rows(self):
+        self.create_profiles(3, country='NZ')
+        few = self.changelist_queries('?country=NZ')
+        self.create_profiles(40, country='NZ')
+        self.assertEqual(self.changelist_queries('?country=NZ'), few)
+
+    def test_clear_avatars_is_one_update(self):
+        self.create_profiles(20, avatar='images/a.jpg', avatar_hash='a' * 40)
+        ids = list(Profile.objects.values_list('pk', flat=True))
+        user = User.objects.get(username='user1')
+        run_commit_hooks()
+        profile_cache.get_entry(backends.load_user(user.pk))
+        url = reverse('admin:accounts_profile_changelist')
+        data = {'action': 'clear_avatars', '_selected_action': ids}
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post(url, data)
+        updates = [query for query in queries
+                   if query['sql'].startswith('UPDATE "accounts_profile"')]
+        self.assertEqual(len(updates), 1)
+        self.assertFalse(Profile.objects.exclude(avatar='').exists())
+        self.assertFalse(Profile.objects.exclude(avatar_hash='').exists())
+        run_commit_hooks()
+        self.assertIsNone(profile_cache.profile_cache().get(
+            profile_cache.cache_key(user.pk)))
+
+    def test_paginator_estimates_large_unfiltered_tables(self):
+        self.create_profiles(3)
+        paginator = accounts_admin.EstimatedCountPaginator(
+            Profile.objects.all(), 100)
+        paginator.exact_below = 0
+        self.assertEqual(paginator.count,
+                         Profile.objects.order_by('-pk').first().pk)
+
+    def test_paginator_counts_filtered_querysets(self):
+        self.create_profiles(3, country='NZ')
+        self.create_profiles(2)
+        paginator = accounts_admin.EstimatedCountPaginator(
+            Profile.objects.filter(country='NZ'), 100)
+        paginator.exact_below = 0
+        self.assertEqual(paginator.count, 3)
+
+
+class SanitizerTests(SimpleTestCase):
+    """Bio sanitizing and plain text counting."""
+    def assertSanitized(self, bio, html):
+        self.assertEqual(sanitize(bio)[0], html)
+
+    def test_drops_script_and_style_blocks(self):
+        self.assertSanitized(
+            '<p>Hi<script>alert("<p>")</script>'
+            '<style>p { color: red }</style> there</p>',
+            '<p>Hi there</p>')
+
+    def test_drops_event_handlers(self):
+        self.assertSanitized('<p onclick="steal()">a</p>', '<p>a</p>')
+        self.assertSanitized(
+            '<a href="http://example.com" onmouseover="steal()">a</a>',
+            '<a href="http://example.com">a</a>')
+        self.assertSanitized('<img src="x" onerror="steal()">', '')
+
+    def test_drops_javascript_hrefs(self):
+        for href in ('javascript:steal()', ' JaVaScRiPt:steal()',
+                     '&#106;avascript:steal()',
+                     '&#x6A;ava&#x09;script:steal()'):
+            self.assertSanitized('<a href="{}">a</a>'.format(href),
+                                 '<a>a</a>')
+
+    def test_closes_unclosed_tags(self):
+        self.assertSanitized('<p><strong>bold', '<p><strong>bold</strong></p>')
+        self.assertSanitized('<p><em>a</p>b', '<p><em>a</em></p>b')
+        self.assertSanitized('</div></p>text', 'text')
+
+    def test_length_matches_beautifulsoup_count(self):
+        from bs4 import BeautifulSoup
+        bios = [
+            '',
+            'Plain text bio',
+            '<p>I like <strong>hiking</strong> and&nbsp;<em>chess</em>.</p>',
+            '<ul><li>one</li><li>two &amp; three</li></ul>',
+            '<p>Caf&eacute; &lt;owner&gt;</p><p>  spaced   out  </p>',
+            '<p><a href="http://example.com">link</a><br>line</p>',
+            '<h1>Title</h1><div>unknown <span>tags</span></div>',
+        ]
+        for bio in bios:
+            expected = len(BeautifulSoup(bio, 'html.parser').get_text()
+                           .replace(' ', ''))
+            self.assertEqual(sanitize(bio)[1], expected, bio)
+
+
+class AvatarEditTests(SimpleTestCase):
+    """Rotate, flip and crop edits recorded as avatar transforms."""
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        overrides = override_settings(MEDIA_ROOT=media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        # Every pixel is distinct, so any misplaced crop shows.
+        self.source = Image.new('RGB', (6, 4))
+        self.source.putdata([(x, y, 0) for y in range(4) for x in range(6)])
+        buf = io.BytesIO()
+        self.source.save(buf, 'PNG')
+        self.profile = Profile()
+        self.profile.avatar.save('avatar.png', ContentFile(buf.getvalue()),
+                                 save=False)
+
+    def displayed(self):
+        """Returns the avatar as the recorded transforms display it."""
+        return avatars.apply_transforms(self.profile, self.source.copy())
+
+    def assertCropsDisplayed(self, crop):
+        expected = self.displayed().crop(crop)
+        avatars.add_edit(self.profile, 'crop', crop)
+        edited = self.displayed()
+        self.assertEqual(edited.size, expected.size)
+        self.assertEqual(list(edited.getdata()), list(expected.getdata()))
+
+    def test_crop(self):
+        self.assertCropsDisplayed((1, 1, 4, 3))
+
+    def test_crop_after_rotate(self):
+        avatars.add_edit(self.profile, 'rotate')
+        self.assertEqual(self.displayed().size, (4, 6))
+        self.assertCropsDisplayed((1, 2, 3, 5))
+
+    def test_crop_after_flip(self):
+        avatars.add_edit(self.profile, 'flip')
+        self.assertCropsDisplayed((0, 1, 5, 4))
+
+    def test_crop_after_rotate_and_flip(self):
+        avatars.add_edit(self.profile, 'rotate')
+        avatars.add_edit(self.profile, 'flip')
+        self.assertCropsDisplayed((1, 0, 4, 2))
+
+    def test_crops_compose(self):
+        self.assertCropsDisplayed((1, 0, 6, 4))
+        avatars.add_edit(self.profile, 'rotate')
+        self.assertCropsDisplayed((1, 1, 3, 5))
+
+    def test_crop_is_clamped_to_the_image(self):
+        avatars.add_edit(self.profile, 'crop', (-5, -5, 50, 2))
+        self.assertEqual(self.displayed().size, (6, 2))
+
+    def test_four_rotations_cancel_out(self):
+        for _ in range(4):
+            avatars.add_edit(self.profile, 'rotate')
+        self.assertEqual(self.profile.avatar_transforms, '')
+
+    def test_four_rotations_keep_the_crop(self):
+        avatars.add_edit(self.profile, 'crop', (1, 1, 4, 3))
+        cropped = self.profile.avatar_transforms
+        for _ in range(4):
+            avatars.add_edit(self.profile, 'rotate')
+        self.assertEqual(self.profile.avatar_transforms, cropped)
+
+    def test_two_flips_cancel_out(self):
+        avatars.add_edit(self.profile, 'flip')
+        avatars.add_edit(self.profile, 'flip')
+        self.assertEqual(self.profile.avatar_transforms, '')
+
+
+class MediaServeTests(SimpleTestCase):
+    """Conditional and range requests for uploaded media."""
+    content = bytes(range(100))
+
+    def setUp(self):
+        parent = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, parent)
+        media_root = os.path.join(parent, 'media')
+        overrides = override_settings(MEDIA_ROOT=media_root,
+                                      MEDIA_OFFLOAD=None)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        # A file next to MEDIA_ROOT, which must never be reachable.
+        with open(os.path.join(parent, 'secret.txt'), 'wb') as f:
+            f.write(b'secret')
+        os.makedirs(os.path.join(media_root, 'images'))
+        with open(os.path.join(media_root, 'images', 'a.bin'), 'wb') as f:
+            f.write(self.content)
+        self.url = reverse('media', args=['images/a.bin'])
+
+    def get(self, url=None, **headers):
+        response = self.client.get(url or self.url, **headers)
+        body = b''
+        if response.status_code in (200, 206):
+            body = b''.join(response.streaming_content)
+        return response, body
+
+    def test_parse_range(self):
+        cases = [
+            ('bytes=0-9', (0, 9)),
+            ('bytes=95-', (95, 99)),
+            ('bytes=95-200', (95, 99)),
+            ('bytes=-10', (90, 99)),
+            ('bytes=-500', (0, 99)),
+            ('bytes=-0', False),
+            ('bytes=100-', False),
+            ('bytes=5-2', False),
+            ('bytes=0-5,10-20', None),
+            ('items=0-5', None),
+            ('bytes=-', None),
+        ]
+        for header, expected in cases:
+            self.assertEqual(media.parse_range(header, 100), expected, header)
+
+    def test_whole_file(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+
+    def test_range(self):
+        response, body = self.get(HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content[10:20])
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/100')
+        self.assertEqual(response['Content-Length'], '10')
+
+    def test_suffix_range(self):
+        response, body = self.get(HTTP_RANGE='bytes=-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(body, self.content[-5:])
+        self.assertEqual(response['Content-Range'], 'bytes 95-99/100')
+
+    def test_unsatisfiable_range(self):
+        response, body = self.get(HTTP_RANGE='bytes=100-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */100')
+
+    def test_if_range(self):
+        response, _ = self.get()
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        for validator in (etag, last_modified):
+            response, body = self.get(HTTP_RANGE='bytes=0-4',
+                                      HTTP_IF_RANGE=validator)
+            self.assertEqual(response.status_code, 206, validator)
+            self.assertEqual(body, self.content[:5])
+        for validator in ('"stale"', http_date(0)):
+            response, body = self.get(HTTP_RANGE='bytes=0-4',
+                                      HTTP_IF_RANGE=validator)
+            self.assertEqual(response.status_code, 200, validator)
+            self.assertEqual(body, self.content)
+
+    def test_not_modified(self):
+        response, _ = self.get()
+        response, _ = self.get(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        response, _ = self.get(
+            HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        response, _ = self.get(HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_rejects_paths_outside_media_root(self):
+        for path in ('../secret.txt', 'images/../../secret.txt',
+                     '%2e%2e/secret.txt', '/../secret.txt', 'images', ''):
+            response, _ = self.get('/uploads/' + path)
+            self.assertEqual(response.status_code, 404, path)
+
+
+class SignInThrottleTests(TestCase):
+    """Lockouts of repeated failed sign-ins."""
+    password = 'Secret-pass-123!xyz'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('bob', 'bob@example.com',
+                                            cls.password)
+
+    def setUp(self):
+        self.cache = caches[throttle.config('CACHE')]
+        self.cache.clear()
+        self.addCleanup(self.cache.clear)
+
+    def request(self, **meta):
+        meta.setdefault('REMOTE_ADDR', '198.51.100.1')
+        return RequestFactory().post('/', **meta)
+
+    def sign_in(self, password):
+        return self.client.post(reverse('accounts:sign_in'), {
+            'username': 'bob', 'password': password})
+
+    def test_lockout_doubles_on_repeat(self):
+        request = self.request()
+        for _ in range(throttle.config('USERNAME_LIMIT') - 1):
+            throttle.record_failure(request, 'bob')
+        self.assertEqual(throttle.blocked_for(request, 'bob'), 0)
+        throttle.record_failure(request, 'bob')
+        lockout = throttle.config('LOCKOUT')
+        self.assertAlmostEqual(throttle.blocked_for(request, 'bob'),
+                               lockout, delta=2)
+        # Once the lockout lapses, the next failure locks out twice as long.
+        self.cache.delete(throttle.make_key('lock', 'username', 'bob'))
+        self.assertEqual(throttle.blocked_for(request, 'bob'), 0)
+        throttle.record_failure(request, 'bob')
+        self.assertAlmostEqual(throttle.blocked_for(request, 'bob'),
+                               2 * lockout, delta=2)
+
+    def test_successful_sign_in_resets_failures(self):
+        for _ in range(throttle.config('USERNAME_LIMIT') - 1):
+            self.assertEqual(self.sign_in('wrong').status_code, 200)
+        self.assertEqual(self.sign_in(self.password).status_code, 302)
+        self.client.logout()
+        for _ in range(throttle.config('USERNAME_LIMIT') - 1):
+            self.sign_in('wrong')
+        self.assertEqual(throttle.blocked_for(self.request(), 'bob'), 0)
+
+    def test_locked_out_sign_in_skips_authentication(self):
+        request = self.request(REMOTE_ADDR='127.0.0.1')
+        for _ in range(throttle.config('USERNAME_LIMIT')):
+            throttle.record_failure(request, 'bob')
+        with mock.patch('django.contrib.auth.forms.authenticate') as auth:
+            response = self.sign_in(self.password)
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(auth.called)
+
+    @override_settings(CLIENT_IP_HEADER='HTTP_X_FORWARDED_FOR')
+    def test_spoofed_forwarded_for_is_ignored(self):
+        for index in range(throttle.config('IP_LIMIT')):
+            request = self.request(
+                HTTP_X_FORWARDED_FOR='10.0.0.{}, 203.0.113.7'.format(index))
+            throttle.record_failure(request, 'user{}'.format(index))
+        request = self.request(HTTP_X_FORWARDED_FOR='10.9.9.9, 203.0.113.7')
+        self.assertGreater(throttle.blocked_for(request, 'someone'), 0)
+        request = self.request(HTTP_X_FORWARDED_FOR='203.0.113.8')
+        self.assertEqual(throttle.blocked_for(request, 'someone'), 0)
+
+    @override_settings(CLIENT_IP_HEADER='HTTP_X_REAL_IP')
+    def test_client_ip_falls_back_to_remote_addr(self):
+        self.assertEqual(proxy.client_ip(self.request(
+            HTTP_X_REAL_IP='203.0.113.7')), '203.0.113.7')
+        self.assertEqual(proxy.client_ip(self.request()), '198.51.100.1')
+
+
+class CacheInvalidationTests(TransactionTestCase):
+    """Cached users and profiles are dropped once changes are committed."""
+    def setUp(self):
+        self.user = User.objects.create_user('bob')
+        backends.user_cache().clear()
+        profile_cache.profile_cache().clear()
+
+    def cached(self):
+        return (backends.user_cache().get(
+                    backends.user_cache_key(self.user.pk)),
+                profile_cache.profile_cache().get(
+                    profile_cache.cache_key(self.user.pk)))
+
+    def test_caches_are_dropped_on_commit(self):
+        backends.ProfileBackend().get_user(self.user.pk)
+        profile_cache.get_entry(backends.load_user(self.user.pk))
+        with transaction.atomic():
+            self.user.profile.website = 'http://example.com'
+            self.user.profile.save()
+            # Another process reloading now would see the old row.
+            self.assertNotIn(None, self.cached())
+        self.assertEqual(self.cached(), (None, None))
+
+    def test_caches_are_kept_on_rollback(self):
+        backends.ProfileBackend().get_user(self.user.pk)
+        try:
+            with transaction.atomic():
+                self.user.first_name = 'Robert'
+                self.user.save()
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertIsNotNone(self.cached()[0])
+
+
+class EditProfileFormTests(TestCase):
+    """Profile edits write only what changed and refuse stale pages."""
+    def setUp(self):
+        User.objects.create_user('bob', 'bob@example.com', first_name='Bob')
+        self.user = self.load_user()
+
+    def load_user(self):
+        return User.objects.select_related('profile').get(username='bob')
+
+    def data(self, **changes):
+        data = {
+            'first_name': self.user.first_name,
+            'last_name': self.user.last_name,
+            'email': self.user.email,
+            'verify_email': self.user.email,
+            'profile-version': self.user.profile.version,
+        }
+        data.update(changes)
+        return data
+
+    def save(self, **changes):
+        form = forms.EditProfileForm(self.user, data=self.data(**changes))
+        self.assertTrue(form.is_valid())
+        return form, form.save()
+
+    def test_unchanged_submit_makes_no_queries(self):
+        with self.assertNumQueries(0):
+            form, saved = self.save()
+        self.assertTrue(saved)
+
+    def test_only_changed_columns_are_written(self):
+        saves = []
+
+        def record(sender, **kwargs):
+            saves.append((sender, kwargs['update_fields']))
+        post_save.connect(record)
+        self.addCleanup(post_save.disconnect, record)
+        form, saved = self.save(**{'profile-website': 'http://example.com',
+                                   'last_name': 'Smith'})
+        self.assertTrue(saved)
+        self.assertEqual(sorted(saves, key=lambda save: save[0].__name__), [
+            (Profile, frozenset(['website', 'version'])),
+            (User, frozenset(['last_name'])),
+        ])
+        user = self.load_user()
+        self.assertEqual(user.last_name, 'Smith')
+        self.assertEqual(user.profile.website, 'http://example.com')
+        self.assertEqual(user.profile.version, 1)
+
+    def test_user_only_change_leaves_profile_alone(self):
+        with CaptureQueriesContext(connection) as queries:
+            form, saved = self.save(last_name='Smith')
+        self.assertTrue(saved)
+        self.assertFalse([query for query in queries
+                          if 'accounts_profile' in query['sql']])
+        self.assertEqual(self.load_user().profile.version, 0)
+
+    def test_stale_version_is_refused(self):
+        Profile.objects.filter(user=self.user).update(version=1)
+        form, saved = self.save(**{'profile-website': 'http://example.com'})
+        self.assertFalse(saved)
+        self.assertTrue(form.profile_form.non_field_errors())
+        self.assertIsNone(self.load_user().profile.website)
+
+    def test_concurrent_edit_is_refused(self):
+        form = forms.EditProfileForm(self.user, data=self.data(
+            **{'profile-website': 'http://example.com'}))
+        self.assertTrue(form.is_valid())
+        # Another window saves after this page's version was checked.
+        Profile.objects.filter(user=self.user).update(version=1)
+        self.assertFalse(form.save())
+        self.assertIsNone(self.load_user().profile.website)
+
+    def test_missing_version_is_refused(self):
+        data = self.data(last_name='Smith')
+        del data['profile-version']
+        form = forms.EditProfileForm(self.user, data=data)
+        self.assertFalse(form.is_valid())
+        self.assertIn('version', form.profile_form.errors)
+
+
+class RenditionPruneTests(TestCase):
+    """relocate_avatars --prune deletes unreferenced rendition sets."""
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        overrides = override_settings(MEDIA_ROOT=media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def create_set(self, key, age):
+        for size in avatars.rendition_sizes():
+            name = default_storage.save(
+                avatars.rendition_name(key, size, 'jpeg'), ContentFile(b'x'))
+            modified = time.time() - age
+            os.utime(default_storage.path(name), (modified, modified))
+
+    def exists(self, key):
+        marker = avatars.rendition_name(key, avatars.rendition_sizes()[0],
+                                        'jpeg')
+        return default_storage.exists(marker)
+
+    def test_prune(self):
+        user = User.objects.create_user('bob')
+        Profile.objects.filter(user=user).update(
+            avatar_rendition_key='a' * 40)
+        self.create_set('a' * 40, 7200)
+        self.create_set('b' * 40, 7200)
+        self.create_set('c' * 40, 60)
+        out = io.StringIO()
+        call_command('relocate_avatars', prune=True, stdout=out)
+        self.assertIn("Pruned 1 unreferenced rendition sets.",
+                      out.getvalue())
+        self.assertTrue(self.exists('a' * 40))
+        self.assertFalse(self.exists('b' * 40))
+        self.assertFalse(os.path.exists(default_storage.path(
+            posixpath.dirname(avatars.rendition_name('b' * 40, 48, 'jpeg')))))
+        # Possibly about to be published.
+        self.assertTrue(self.exists('c' * 40))
+
+
+class PasswordIndexTests(SimpleTestCase):
+    """Lookups in the memory-mapped common password index."""
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'common.idx')
+
+    def test_lookup(self):
+        self.assertEqual(password_index.build_index(
+            ['letmein', 'Dragon', 'letmein'], self.path), 2)
+        index = password_index.get_index(self.path)
+        self.assertEqual(len(index), 2)
+        self.assertIn('letmein', index)
+        self.assertIn(' DRAGON ', index)
+        self.assertNotIn('Secret-pass-123!xyz', index)
+
+    def test_rebuilt_index_is_mapped_again(self):
+        password_index.build_index(['letmein'], self.path)
+        self.assertIn('letmein', password_index.get_index(self.path))
+        password_index.build_index(['dragon'], self.path)
+        index = password_index.get_index(self.path)
+        self.assertNotIn('letmein', index)
+        self.assertIn('dragon', index)
+
+    def test_validator_falls_back_to_word_list(self):
+        validator = validators.IndexedCommonPasswordValidator(self.path)
+        with self.assertLogs('project_7.validators', 'WARNING'):
+            with self.assertRaises(ValidationError) as raised:
+                validator.validate('password')
+        self.assertEqual(raised.exception.code, 'password_too_common')
+        validator.validate('Secret-pass-123!xyz')
+
+    def test_validator_uses_index(self):
+        password_index.build_index(['Secret-pass-123!xyz'], self.path)
+        validator = validators.IndexedCommonPasswordValidator(self.path)
+        validator.validate('password')
+        with self.assertRaises(ValidationError):
+            validator.validate('Secret-pass-123!xyz')
+
+
+@override_settings(AVATAR_SOURCE_MAX_DIMENSION=100,
+                   AVATAR_RENDITION_SIZES=(48,),
+                   AVATAR_RENDITION_FORMATS=('jpeg',))
+class ProcessUploadTests(TestCase):
+    """Uploads are kept as the rendition source unless oversized."""
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        overrides = override_settings(MEDIA_ROOT=media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.profile = User.objects.create_user('bob').profile
+
+    def upload(self, size, transforms=''):
+        buf = io.BytesIO()
+        Image.new('RGB', size, (200, 10, 10)).save(buf, 'JPEG')
+        self.profile.avatar.save('a.jpg', ContentFile(buf.getvalue()))
+        Profile.objects.filter(pk=self.profile.pk).update(
+            avatar_transforms=transforms)
+        avatars.process_upload(self.profile)
+        return buf.getvalue(), Profile.objects.get(pk=self.profile.pk)
+
+    def test_upload_is_kept(self):
+        data, profile = self.upload((80, 60))
+        self.assertEqual(profile.avatar.read(), data)
+        self.assertEqual(profile.avatar_hash,
+                         profile.avatar.storage.digest(profile.avatar.name))
+        self.assertEqual(profile.avatar_rendition_key, profile.avatar_hash)
+
+    def test_oversized_upload_is_scaled_down(self):
+        data, profile = self.upload((300, 150))
+        self.assertNotEqual(profile.avatar.read(), data)
+        self.assertEqual(Image.open(profile.avatar.path).size, (100, 50))
+        self.assertEqual(profile.avatar_rendition_key, profile.avatar_hash)
+
+    def test_oversized_upload_with_edits_is_kept(self):
+        # A crop recorded before the job ran, in the upload's coordinates.
+        data, profile = self.upload(
+            (300, 150), '[{"box": [0, 0, 10, 10], "op": "crop"}]')
+        self.assertEqual(profile.avatar.read(), data)
+
+
+class SessionStoreTests(TestCase):
+    """Sessions are only written when they change."""
+    def setUp(self):
+        caches[settings.SESSION_CACHE_ALIAS].clear()
+
+    def session_queries(self, queries):
+        return [query['sql'].split()[0] for query in queries
+                if 'django_session' in query['sql']]
+
+    def stored_session(self):
+        session = sessions.SessionStore()
+        session['colour'] = 'blue'
+        session.save()
+        return sessions.SessionStore(session.session_key)
+
+    def test_unchanged_save_makes_no_queries(self):
+        session = self.stored_session()
+        self.assertEqual(session['colour'], 'blue')
+        with self.assertNumQueries(0):
+            session.save()
+
+    def test_changed_save_is_one_update(self):
+        session = self.stored_session()
+        session['colour'] = 'red'
+        with CaptureQueriesContext(connection) as queries:
+            session.save()
+        self.assertEqual(self.session_queries(queries), ['UPDATE'])
+        self.assertEqual(
+            sessions.SessionStore(session.session_key)['colour'], 'red')
+
+    def test_sign_in_inserts_and_updates_once(self):
+        User.objects.create_user('bob', password='Secret-pass-123!xyz')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('accounts:sign_in'), {
+                'username': 'bob', 'password': 'Secret-pass-123!xyz'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.session_queries(queries), ['INSERT', 'UPDATE'])
+
+    def test_clear_expired_deletes_in_batches(self):
+        model = sessions.SessionStore.get_model_class()
+        expired = timezone.now() - datetime.timedelta(days=1)
+        for i in range(5):
+            model.objects.create(session_key='expired{}'.format(i),
+                                 session_data='', expire_date=expired)
+        self.stored_session()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(
+                sessions.SessionStore.clear_expired(batch_size=2), 5)
+        self.assertEqual(self.session_queries(queries).count('DELETE'), 3)
+        self.assertEqual(model.objects.count(), 1)
+
+
+class DirectorySearchTests(TestCase):
+    """Directory search queries and keyset paging."""
+    @classmethod
+    def setUpTestData(cls):
+        names = [('Ann', 'Lee'), ('Bob', 'Lee'), ('Ann', 'Lee'),
+                 ('Cara', 'Adams'), ('Dan', 'Young'), ('Eve', 'Lee'),
+                 ('Finn', 'Adams')]
+        for i, (first_name, last_name) in enumerate(names):
+            user = User.objects.create_user('user{}'.format(i),
+                                            first_name=first_name,
+                                            last_name=last_name)
+            Profile.objects.filter(user=user).update(
+                bio_html='<p>I like <b>hiking</b></p>' if i % 2 else '')
+
+    def walk(self, query='', per_page=2):
+        names = []
+        cursor = None
+        while True:
+            page, cursor = directory.search(query, cursor=cursor,
+                                            per_page=per_page)
+            names.extend(profile.user.username for profile in page)
+            if cursor is None:
+                return names
+
+    def assertPagesContinue(self, query):
+        everything = self.walk(query, per_page=100)
+        self.assertTrue(everything)
+        self.assertEqual(self.walk(query), everything)
+        self.assertEqual(self.walk(query, per_page=1), everything)
+
+    def test_pages_continue(self):
+        self.assertEqual(self.walk(per_page=100), [
+            'user3', 'user6', 'user0', 'user2', 'user1', 'user5', 'user4'])
+        self.assertPagesContinue('')
+
+    def test_search_pages_continue(self):
+        self.assertTrue(directory.has_fts())
+        self.assertEqual(self.walk('hik', per_page=100),
+                         ['user3', 'user1', 'user5'])
+        self.assertPagesContinue('lee')
+
+    def test_fallback_search_pages_continue(self):
+        with mock.patch.object(directory, 'has_fts', return_value=False):
+            self.assertEqual(self.walk('hiking', per_page=100),
+                             ['user3', 'user1', 'user5'])
+            self.assertPagesContinue('lee')
+
+    def test_markup_is_not_searched(self):
+        self.assertEqual(self.walk('p', per_page=100), [])
+        with mock.patch.object(directory, 'has_fts', return_value=False):
+            self.assertEqual(self.walk('p', per_page=100), [])
+
+    def test_match_expression_quotes_terms(self):
+        self.assertEqual(directory.match_expression(['ab"c', 'OR']),
+                         '"ab""c"* "OR"*')
+        # FTS5 syntax in a query is searched for as plain words.
+        self.assertEqual(self.walk('ann" OR NEAR(bob*', per_page=100), [])
+        self.assertEqual(self.walk('-ann AND lee', per_page=100), [])
+
+    def test_decode_cursor(self):
+        profile = Profile.objects.select_related('user').get(
+            user__username='user0')
+        self.assertEqual(
+            directory.decode_cursor(directory.encode_cursor(profile)),
+            ('Lee', 'Ann', profile.user_id))
+        encoded = base64.urlsafe_b64encode(b'[1, 2]').decode('ascii')
+        for cursor in (None, '', 'not a cursor', 'é', encoded,
+                       base64.urlsafe_b64encode(b'{').decode('ascii')):
+            self.assertIsNone(directory.decode_cursor(cursor), cursor)
+
+
+@override_settings(AVATAR_RELEASE_GRACE=0)
+class AvatarStorageTests(TestCase):
+    """Avatar files shared by content and released once unreferenced."""
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        overrides = override_settings(MEDIA_ROOT=media_root)
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def profile(self, username, content=b'avatar'):
+        profile = User.objects.create_user(username).profile
+        profile.avatar.save('a.jpg', ContentFile(content))
+        return profile
+
+    def age(self, name, seconds):
+        modified = time.time() - seconds
+        os.utime(storage.avatar_storage.path(name), (modified, modified))
+
+    def test_shared_file_is_kept_while_referenced(self):
+        first = self.profile('ann')
+        second = self.profile('bob')
+        name = first.avatar.name
+        self.assertEqual(second.avatar.name, name)
+        run_commit_hooks()
+        first.avatar.save('b.jpg', ContentFile(b'other'))
+        run_commit_hooks()
+        self.assertTrue(storage.avatar_storage.exists(name))
+        second.delete()
+        run_commit_hooks()
+        self.assertFalse(storage.avatar_storage.exists(name))
+
+    def test_release_respects_grace_period(self):
+        name = storage.avatar_storage.save('avatars/a.jpg',
+                                           ContentFile(b'avatar'))
+        with self.settings(AVATAR_RELEASE_GRACE=3600):
+            self.assertFalse(storage.release(name))
+            self.assertTrue(storage.avatar_storage.exists(name))
+            self.age(name, 7200)
+            self.assertTrue(storage.release(name))
+        self.assertFalse(storage.avatar_storage.exists(name))
+
+    def test_duplicate_upload_is_not_written(self):
+        first = self.profile('ann')
+        self.age(first.avatar.name, 7200)
+        with mock.patch.object(FileSystemStorage, '_save') as save:
+            second = self.profile('bob')
+        save.assert_not_called()
+        self.assertEqual(second.avatar.name, first.avatar.name)
+        # Reuse restarts the grace period protecting the new reference.
+        self.assertLess(time.time() - os.path.getmtime(
+            storage.avatar_storage.path(first.avatar.name)), 60)
+
+
+class PasswordPolicyTests(SimpleTestCase):
+    """Each rule of the password policy is checked and reported."""
+    def failed_codes(self, password, **rules):
+        try:
+            validators.PasswordPolicyValidator(**rules).validate(password)
+        except ValidationError as e:
+            return sorted(error.code for error in e.error_list)
+        return []
+
+    def test_valid_password(self):
+        self.assertEqual(self.failed_codes('Secret-pass-123'), [])
+
+    def test_mixed_case(self):
+        self.assertEqual(self.failed_codes('secret-pass-123'),
+                         ['password_no_mixed_case'])
+        self.assertEqual(self.failed_codes('SECRET-PASS-123'),
+                         ['password_no_mixed_case'])
+
+    def test_digit(self):
+        self.assertEqual(self.failed_codes('Secret-pass-abc'),
+                         ['password_no_digit'])
+        # Only ASCII digits count.
+        self.assertEqual(self.failed_codes('Secret-pass-٣'),
+                         ['password_no_digit'])
+
+    def test_special_character(self):
+        self.assertEqual(self.failed_codes('Secretpass123'),
+                         ['password_no_special_character'])
+        # Whitespace isn't special, but non-ASCII symbols are.
+        self.assertEqual(self.failed_codes('Secret pass\t123'),
+                         ['password_no_special_character'])
+        self.assertEqual(self.failed_codes('Secretpass123€'), [])
+        self.assertEqual(self.failed_codes('Secretpass123ß'),
+                         ['password_no_special_character'])
+
+    def test_every_failing_rule_is_reported(self):
+        self.assertEqual(self.failed_codes('secret'), [
+            'password_no_digit', 'password_no_mixed_case',
+            'password_no_special_character'])
+
+    def test_rules_can_be_disabled(self):
+        self.assertEqual(self.failed_codes(
+            'secret', require_mixed_case=False, require_digit=False,
+            require_special=False), [])
+        self.assertEqual(self.failed_codes('secret', require_digit=False),
+                         ['password_no_mixed_case',
+                          'password_no_special_character'])
+
+    def test_single_rule_validators(self):
+        for validator, code in (
+                (validators.UpperLowerCaseValidator(),
+                 'password_no_mixed_case'),
+                (validators.ContainsNumberValidator(), 'password_no_digit'),
+                (validators.ContainsSpecialCharactersValidator(),
+                 'password_no_special_character')):
+            with self.assertRaises(ValidationError) as raised:
+                validator.validate('secret')
+            self.assertEqual([error.code for error in
+                              raised.exception.error_list], [code])
+            validator.validate('Secret-pass-123')
+
+
+class ExportTests(TestCase):
+    """Streaming profile exports."""
+    @classmethod
+    def setUpTestData(cls):
+        for i, (country, joined) in enumerate([
+                ('NZ', '2020-01-01'), ('NZ', '2020-02-01'),
+                ('DE', '2020-02-01'), ('NZ', '2020-03-01'),
+                ('NZ', '2020-04-01')]):
+            user = User.objects.create_user(
+                'user{}'.format(i), 'user{}@example.com'.format(i),
+                date_joined=export.parse_filter_date(joined))
+            Profile.objects.filter(user=user).update(country=country)
+        cls.staff = User.objects.create_superuser(
+            'staff', 'staff@example.com', 'Staff-pass-123!',
+            date_joined=export.parse_filter_date('2021-01-01'))
+
+    def usernames(self, chunk_size=2000, **filters):
+        return [row[0] for row in export.iter_rows(
+            export.filtered_profiles(**filters), chunk_size)]
+
+    def test_chunks_cover_every_row_once(self):
+        everything = self.usernames()
+        self.assertEqual(len(everything), 6)
+        for chunk_size in (1, 2, 3, 6, 7):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.usernames(chunk_size), everything)
+            self.assertEqual(len(queries), 6 // chunk_size + 1)
+
+    def test_filters(self):
+        self.assertEqual(self.usernames(country='nz'),
+                         ['user0', 'user1', 'user3', 'user4'])
+        self.assertEqual(self.usernames(country='NZ',
+                                        joined_after='2020-02-01',
+                                        joined_before='2020-04-01'),
+                         ['user1', 'user3'])
+
+    def test_serialized_values(self):
+        row = next(export.iter_rows(export.filtered_profiles(
+            joined_before='2020-01-02')))
+        self.assertEqual(row[:5], ['user0', 'user0@example.com', '', '',
+                                   '2020-01-01T00:00:00+00:00'])
+        self.assertEqual(row[5:8], ['', '', 'NZ'])
+
+    def test_view(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('accounts:export_profiles'), {
+            'format': 'jsonl', 'country': 'DE'})
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['username'] for line in lines],
+                         ['user2'])
+
+    def test_invalid_date_is_rejected(self):
+        self.client.force_login(self.staff)
+        url = reverse('accounts:export_profiles')
+        for date in ('01/02/2020', '2020-13-01'):
+            response = self.client.get(url, {'joined_after': date})
+            self.assertEqual(response.status_code, 400, date)
+        response = self.client.get(url, {'format': 'xml'})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_STICKY_SECONDS=10)
+class ReplicaRoutingTests(SimpleTestCase):
+    """Reads routed to replicas, and browsers pinned after writing."""
+    def setUp(self):
+        self.router = routers.ReplicaRouter()
+        self.middleware = routers.ReplicaStickinessMiddleware()
+
+    def request(self, method='get', cookie=None):
+        request = getattr(RequestFactory(), method)('/')
+        if cookie is not None:
+            request.COOKIES[routers.STICKY_COOKIE] = cookie
+        self.middleware.process_request(request)
+        return request
+
+    def test_router(self):
+        self.assertEqual(self.router.db_for_read(User), 'default')
+        with routers.use_replica():
+            self.assertEqual(self.router.db_for_read(User), 'replica')
+            self.assertEqual(self.router.db_for_write(User), 'default')
+        with routers.use_replica(enabled=False):
+            self.assertEqual(self.router.db_for_read(User), 'default')
+        self.assertTrue(self.router.allow_migrate('default', 'accounts'))
+        self.assertFalse(self.router.allow_migrate('replica', 'accounts'))
+
+    def test_no_replicas(self):
+        with self.settings(DATABASE_REPLICAS=[]), routers.use_replica():
+            self.assertEqual(self.router.db_for_read(User), 'default')
+            self.assertEqual(routers.read_database(), 'default')
+
+    def test_replica_reads_skips_pinned_browsers(self):
+        @routers.replica_reads
+        def view(request):
+            return self.router.db_for_read(User)
+        self.assertEqual(view(self.request()), 'replica')
+        pinned = self.request(cookie=str(time.time() + 5))
+        self.assertTrue(pinned.pin_primary)
+        self.assertEqual(view(pinned), 'default')
+        self.assertEqual(routers.read_database(pinned), 'default')
+        self.assertEqual(routers.read_database(self.request()), 'replica')
+
+    def test_pin_expires(self):
+        for cookie in (str(time.time() - 1), 'garbage'):
+            self.assertFalse(self.request(cookie=cookie).pin_primary, cookie)
+
+    def test_writes_set_the_sticky_cookie(self):
+        request = self.request('post')
+        response = self.middleware.process_response(request, HttpResponse())
+        cookie = response.cookies[routers.STICKY_COOKIE]
+        self.assertEqual(cookie['max-age'], 10)
+        self.assertAlmostEqual(float(cookie.value), time.time() + 10,
+                               delta=5)
+        self.assertTrue(self.request(cookie=cookie.value).pin_primary)
+
+    def test_reads_set_no_cookie(self):
+        request = self.request()
+        response = self.middleware.process_response(request, HttpResponse())
+        self.assertNotIn(routers.STICKY_COOKIE, response.cookies)
+
+    def test_wrote_primary_on_a_safe_method(self):
+        request = self.request()
+        routers.wrote_primary(request)
+        self.assertTrue(request.pin_primary)
+        response = self.middleware.process_response(request, HttpResponse())
+        self.assertIn(routers.STICKY_COOKIE, response.cookies)
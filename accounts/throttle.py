@@ -0,0 +1,113 @@
+"""Sign-in throttling by username and client IP.
+
+Failed sign-ins are counted per username and per client address with a
+sliding window counter (the current and previous fixed windows, weighted
+by how much of the previous one still overlaps the window). A key that
+reaches its limit is locked out; each further lockout within the decay
+period doubles the lockout, up to a maximum. Checking a lockout costs one
+cache read and no password hashing, so attempts over the limit are
+rejected before authenticate() is ever called.
+
+State lives in the cache alias named by LOGIN_THROTTLE['CACHE'], so any
+Django cache backend (local memory, file based or database) can hold it.
+Client addresses are read from CLIENT_IP_HEADER (see project_7.proxy).
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from project_7 import proxy
+
+
+DEFAULTS = {
+    'CACHE': 'default',
+    'USERNAME_LIMIT': 5,
+    'IP_LIMIT': 20,
+    'WINDOW': 300,
+    'LOCKOUT': 60,
+    'MAX_LOCKOUT': 3600,
+    'DECAY': 86400,
+}
+
+
+def config(name):
+    """Returns a LOGIN_THROTTLE setting, falling back to its default."""
+    return getattr(settings, 'LOGIN_THROTTLE', {}).get(name, DEFAULTS[name])
+
+
+def subjects(request, username):
+    """Returns the (scope, identifier, limit) triples a sign-in counts
+    against."""
+    return [
+        ('username', username.lower(), config('USERNAME_LIMIT')),
+        ('ip', proxy.client_ip(request), config('IP_LIMIT')),
+    ]
+
+
+def make_key(kind, scope, identifier, *parts):
+    """Returns a cache key; identifiers are hashed to keep keys valid."""
+    digest = hashlib.sha1(identifier.encode('utf-8')).hexdigest()
+    return ':'.join(['throttle', kind, scope, digest] + [str(part)
+                                                         for part in parts])
+
+
+def blocked_for(request, username):
+    """Returns seconds until a sign-in may be attempted, 0 if it may now."""
+    cache = caches[config('CACHE')]
+    keys = [make_key('lock', scope, identifier)
+            for scope, identifier, limit in subjects(request, username)]
+    now = time.time()
+    return max([int(until - now) + 1
+                for until in cache.get_many(keys).values()
+                if until > now] or [0])
+
+
+def record_failure(request, username):
+    """Counts a failed sign-in, locking out keys that reach their limit."""
+    cache = caches[config('CACHE')]
+    window = config('WINDOW')
+    now = time.time()
+    bucket = int(now // window)
+    overlap = 1 - (now % window) / float(window)
+    for scope, identifier, limit in subjects(request, username):
+        current = make_key('count', scope, identifier, bucket)
+        previous = make_key('count', scope, identifier, bucket - 1)
+        cache.add(current, 0, 2 * window)
+        try:
+            count = cache.incr(current)
+        except ValueError:
+            # Evicted between add() and incr().
+            cache.set(current, 1, 2 * window)
+            count = 1
+        estimate = count + cache.get(previous, 0) * overlap
+        if estimate >= limit:
+            lock_out(cache, scope, identifier, now)
+
+
+def lock_out(cache, scope, identifier, now):
+    """Locks a key out, doubling the lockout for repeat offenders."""
+    strikes_key = make_key('strikes', scope, identifier)
+    decay = config('DECAY')
+    cache.add(strikes_key, 0, decay)
+    try:
+        strikes = cache.incr(strikes_key)
+    except ValueError:
+        strikes = 1
+    # Re-set to restart the decay period from this lockout.
+    cache.set(strikes_key, strikes, decay)
+    lockout = min(config('LOCKOUT') * 2 ** (strikes - 1),
+                  config('MAX_LOCKOUT'))
+    cache.set(make_key('lock', scope, identifier), now + lockout, lockout)
+
+
+def reset(request, username):
+    """Forgets failed sign-ins for a username after a successful one."""
+    cache = caches[config('CACHE')]
+    bucket = int(time.time() // config('WINDOW'))
+    identifier = username.lower()
+    cache.delete_many([
+        make_key('count', 'username', identifier, bucket),
+        make_key('count', 'username', identifier, bucket - 1),
+        make_key('strikes', 'username', identifier),
+    ])
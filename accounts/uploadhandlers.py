@@ -0,0 +1,84 @@
+"""Upload handler that vets avatar images while they stream in."""
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.template.defaultfilters import filesizeformat
+
+
+# Bytes to read before giving up on finding an image header.
+HEADER_LIMIT = 256 * 1024
+
+
+class AvatarUploadHandler(FileUploadHandler):
+    """Rejects unusable avatar uploads from their first chunks.
+
+    Placed in front of Django's default handlers, it parses the image header
+    as soon as it arrives and only passes chunks on while the upload looks
+    acceptable. Bad formats, oversized dimensions, decompression bombs and
+    uploads over the byte limit are skipped before the rest of the body is
+    buffered anywhere. The reason is kept in `error` for the form to report.
+    """
+    field_name = 'avatar'
+
+    def __init__(self, request=None):
+        super(AvatarUploadHandler, self).__init__(request)
+        self.error = None
+        self.active = False
+        self.max_bytes = getattr(settings, 'AVATAR_MAX_UPLOAD_SIZE',
+                                 10 * 1024 * 1024)
+        self.max_dimension = getattr(settings, 'AVATAR_MAX_DIMENSION', 8000)
+        self.max_pixels = getattr(settings, 'AVATAR_MAX_PIXELS', 40000000)
+        self.formats = getattr(settings, 'AVATAR_UPLOAD_FORMATS',
+                               ('JPEG', 'PNG', 'GIF'))
+
+    def new_file(self, field_name, *args, **kwargs):
+        from PIL import ImageFile
+        super(AvatarUploadHandler, self).new_file(field_name, *args, **kwargs)
+        self.active = field_name == self.field_name
+        self.parser = ImageFile.Parser() if self.active else None
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.active:
+            return raw_data
+        self.received += len(raw_data)
+        if self.received > self.max_bytes:
+            self.reject("Avatar must be smaller than {}.".format(
+                filesizeformat(self.max_bytes)))
+        if self.parser is not None:
+            self.check_header(raw_data)
+        return raw_data
+
+    def check_header(self, raw_data):
+        """Feeds data to the header parser until the image size is known."""
+        from PIL import Image
+        try:
+            self.parser.feed(raw_data)
+        except Exception:
+            self.reject("Upload a valid image.")
+        image = self.parser.image
+        if image is None:
+            if self.received > HEADER_LIMIT:
+                self.reject("Upload a valid image.")
+            return
+        # Stop parsing: past the header the parser starts decoding pixels.
+        self.parser = None
+        width, height = image.size
+        if image.format not in self.formats:
+            self.reject("Avatar must be one of: {}.".format(
+                ', '.join(self.formats)))
+        if max(width, height) > self.max_dimension:
+            self.reject("Avatar must be at most {0}x{0} pixels.".format(
+                self.max_dimension))
+        if width * height > min(self.max_pixels, Image.MAX_IMAGE_PIXELS):
+            self.reject("Avatar has too many pixels.")
+
+    def reject(self, error):
+        """Skips the rest of the upload, remembering why."""
+        self.error = error
+        self.active = False
+        self.parser = None
+        raise SkipFile(error)
+
+    def file_complete(self, file_size):
+        # Leave the file itself to the handlers that follow.
+        return None
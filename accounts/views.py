@@ -1,25 +1,45 @@
 from django.contrib import messages
-from django.contrib.auth import (authenticate, login, logout,
-                                 update_session_auth_hash)
+from django.conf import settings
+from django.contrib.auth import login, logout, update_session_auth_hash
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import AuthenticationForm, UserCreationForm
 from django.core.urlresolvers import reverse
-from django.http import HttpResponseRedirect
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import (HttpResponseBadRequest, HttpResponseRedirect,
+                         JsonResponse, StreamingHttpResponse)
 from django.shortcuts import render
-from PIL import Image
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag, urlencode
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django_countries import countries
+from project_7 import metrics
+from project_7.routers import read_database, replica_reads, wrote_primary
 
-from . import forms
+from . import (avatars, export, forms, jobs, profile_cache, throttle,
+               uploadhandlers)
+from . import directory as directory_search
 
 
 def sign_in(request):
     """Sign in view."""
     form = AuthenticationForm()
     if request.method == 'POST':
+        username = request.POST.get('username', '')
+        wait = throttle.blocked_for(request, username)
+        if wait:
+            messages.error(
+                request,
+                "Too many failed sign in attempts. Try again in {} "
+                "seconds.".format(wait)
+            )
+            return render(request, 'accounts/sign_in.html', {'form': form},
+                          status=429)
         form = AuthenticationForm(data=request.POST)
         if form.is_valid():
             if form.user_cache is not None:
                 user = form.user_cache
                 if user.is_active:
+                    throttle.reset(request, username)
                     login(request, user)
                     return HttpResponseRedirect(reverse('accounts:profile'))
                 else:
@@ -32,6 +52,8 @@ def sign_in(request):
                     request,
                     "Username or password is incorrect."
                 )
+        else:
+            throttle.record_failure(request, username)
     return render(request, 'accounts/sign_in.html', {'form': form})
 
 
@@ -41,11 +63,10 @@ def sign_up(request):
     if request.method == 'POST':
         form = UserCreationForm(data=request.POST)
         if form.is_valid():
-            form.save()
-            user = authenticate(
-                username=form.cleaned_data['username'],
-                password=form.cleaned_data['password1']
-            )
+            user = form.save()
+            # The password was hashed by save(); authenticate() would only
+            # hash it again to check it, so log the new user in directly.
+            user.backend = settings.AUTHENTICATION_BACKENDS[0]
             login(request, user)
             messages.success(
                 request,
@@ -63,50 +84,62 @@ def sign_out(request):
 
 
 @login_required
+@replica_reads
 def profile(request):
     """User profile view."""
-    user = request.user
-    user_data = [
-        ('first_name', user.first_name),
-        ('last_name', user.last_name),
-        ('email', user.email),
-        ('date_of_birth', user.profile.date_of_birth),
-        ('website', user.profile.website),
-        ('country', user.profile.country),
-        ('bio', user.profile.bio),
-    ]
+    entry = profile_cache.get_entry(request.user)
+    # A 304 would swallow pending flash messages, so only answer
+    # conditional requests when there are none.
+    if not len(messages.get_messages(request)):
+        response = get_conditional_response(
+            request,
+            etag=entry['etag'],
+            last_modified=entry['last_modified']
+        )
+        if response is not None:
+            return response
+
+    response = render(request, 'accounts/profile.html', {
+        'profile_html': entry['html']})
+    response['ETag'] = quote_etag(entry['etag'])
+    response['Last-Modified'] = http_date(entry['last_modified'])
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
-    # Remove items with NULL values
-    cleaned_user_data = [(key, value) for key, value in user_data if value]
 
-    return render(request, 'accounts/profile.html', {
-        'user_data': cleaned_user_data})
+@login_required
+@replica_reads
+def directory(request):
+    """Searchable directory of user profiles."""
+    query = request.GET.get('q', '').strip()
+    country = request.GET.get('country', '')
+    profiles, cursor = directory_search.search(
+        query, country=country, cursor=request.GET.get('after'))
+    next_url = None
+    if cursor:
+        next_url = '?' + urlencode({'q': query, 'country': country,
+                                    'after': cursor})
+    return render(request, 'accounts/directory.html', {
+        'profiles': profiles,
+        'query': query,
+        'country': country,
+        'countries': countries,
+        'next_url': next_url,
+    })
 
 
 @login_required
 def edit_profile(request):
     """View to edit user profile."""
-    user = request.user
-    user_form = forms.UserForm(instance=user,
-                               initial={'verify_email': user.email})
-    formset = forms.UserProfileInlineFormSet(instance=user)
-
+    form = forms.EditProfileForm(request.user)
     if request.method == 'POST':
-        user_form = forms.UserForm(instance=user,
-                                   data=request.POST, files=request.FILES)
-        formset = forms.UserProfileInlineFormSet(instance=user,
-                                                 data=request.POST,
-                                                 files=request.FILES)
-        if user_form.is_valid() and formset.is_valid():
-            user_form.save()
-            for form in formset:
-                user_profile = form.save(commit=False)
-                user_profile.user = user
-                user_profile.save()
+        form = forms.EditProfileForm(request.user, data=request.POST,
+                                     files=request.FILES)
+        if form.is_valid() and form.save():
             messages.success(request, "User profile updated.")
             return HttpResponseRedirect(reverse('accounts:profile'))
     return render(request, 'accounts/edit_profile.html',
-                  {'form': user_form, 'formset': formset})
+                  {'form': form.user_form, 'profile_form': form.profile_form})
 
 
 @login_required
@@ -124,27 +157,52 @@ def change_password(request):
 
 
 @login_required
+@csrf_exempt
 def edit_avatar(request):
     """View to edit avatar."""
+    # The upload handler has to be installed before anything reads the
+    # request body, so CSRF is checked in _edit_avatar instead.
+    upload_handler = uploadhandlers.AvatarUploadHandler(request)
+    request.upload_handlers.insert(0, upload_handler)
+    return _edit_avatar(request, upload_handler)
+
+
+@csrf_protect
+def _edit_avatar(request, upload_handler):
     user = request.user
     form = forms.ChangeAvatarForm(instance=user.profile)
     if request.method == 'POST':
         form = forms.ChangeAvatarForm(
             instance=user.profile,
             data=request.POST,
-            files=request.FILES
+            files=request.FILES,
+            upload_error=upload_handler.error
         )
         if form.is_valid():
-            avatar = form.save()
-
+            with metrics.timed('avatar.upload'):
+                avatar = form.save()
+            avatars.reset(avatar)
             if avatar.avatar:
-                # Resize avatar to a particular width and height.
-                image = Image.open(avatar.avatar.path)
-                image.thumbnail((600, 600))
-                image.save(avatar.avatar.path)
+                jobs.enqueue(avatar, 'process_upload')
             messages.success(request, "User avatar updated.")
             return HttpResponseRedirect(reverse('accounts:edit_avatar'))
-    return render(request, 'accounts/edit_avatar.html', {'form': form})
+    avatar_size = None
+    if user.profile.avatar:
+        avatar_size = avatars.edited_size(user.profile)
+    return render(request, 'accounts/edit_avatar.html',
+                  {'form': form, 'avatar_size': avatar_size})
+
+
+@login_required
+def edit_avatar_status(request):
+    """Reports whether the user's latest avatar change has been processed."""
+    profile = request.user.profile
+    state = jobs.latest_state(request.user) or jobs.DONE
+    return JsonResponse({
+        'state': state,
+        'ready': state != jobs.PENDING,
+        'url': avatars.rendition_url(profile, 600),
+    })
 
 
 @login_required
@@ -156,14 +214,11 @@ def edit_avatar_crop(request):
     right = request.GET['x2']
     bottom = request.GET['y2']
     if left and top and right and bottom and left != right and top != bottom:
-        left = int(left)
-        top = int(top)
-        right = int(right)
-        bottom = int(bottom)
-        image = Image.open(user.profile.avatar.path)
-        box = (left, top, right, bottom)
-        image = image.crop(box=box)
-        image.save(user.profile.avatar.path)
+        box = tuple(int(float(value))
+                    for value in (left, top, right, bottom))
+        avatars.record_edit(user.profile, 'crop', box)
+        wrote_primary(request)
+        jobs.enqueue(user.profile, 'build_renditions')
     return HttpResponseRedirect(reverse('accounts:edit_avatar'))
 
 
@@ -171,9 +226,9 @@ def edit_avatar_crop(request):
 def edit_avatar_rotate(request):
     """Rotates user avatar."""
     user = request.user
-    image = Image.open(user.profile.avatar.path)
-    image = image.transpose(Image.ROTATE_270)
-    image.save(user.profile.avatar.path)
+    avatars.record_edit(user.profile, 'rotate')
+    wrote_primary(request)
+    jobs.enqueue(user.profile, 'build_renditions')
     return HttpResponseRedirect(reverse('accounts:edit_avatar'))
 
 
@@ -181,7 +236,30 @@ def edit_avatar_rotate(request):
 def edit_avatar_flip(request):
     """Flips user avatar."""
     user = request.user
-    image = Image.open(user.profile.avatar.path)
-    image = image.transpose(Image.FLIP_TOP_BOTTOM)
-    image.save(user.profile.avatar.path)
+    avatars.record_edit(user.profile, 'flip')
+    wrote_primary(request)
+    jobs.enqueue(user.profile, 'build_renditions')
     return HttpResponseRedirect(reverse('accounts:edit_avatar'))
+
+
+@staff_member_required
+def export_profiles(request):
+    """Streams users and profiles as CSV or JSON lines."""
+    file_format = request.GET.get('format', 'csv')
+    if file_format not in export.FORMATS:
+        return HttpResponseBadRequest("Unknown export format.")
+    try:
+        lines = export.export_lines(
+            file_format,
+            country=request.GET.get('country'),
+            joined_after=request.GET.get('joined_after'),
+            joined_before=request.GET.get('joined_before'),
+            using=read_database(request),
+        )
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    response = StreamingHttpResponse(
+        lines, content_type=export.FORMATS[file_format])
+    response['Content-Disposition'] = (
+        'attachment; filename="profiles.{}"'.format(file_format))
+    return response
@@ -0,0 +1,45 @@
+"""Bounds on CPU-bound work inside a worker process.
+
+Password hashing and Pillow spend nearly all their time in C code that
+releases the GIL, so a worker serving requests from several threads runs
+them in parallel with each other and with cheap requests. Running more of
+them than there are cores only slows all of them down, so each takes one
+of CPU_BOUND_CONCURRENCY slots; requests that need none never queue
+behind them.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from . import metrics
+
+
+_slots = None
+_lock = threading.Lock()
+
+
+def slots():
+    """Returns the process's semaphore of CPU-bound slots."""
+    global _slots
+    with _lock:
+        if _slots is None:
+            _slots = threading.BoundedSemaphore(
+                getattr(settings, 'CPU_BOUND_CONCURRENCY', None) or
+                os.cpu_count() or 1)
+        return _slots
+
+
+@contextmanager
+def cpu_bound():
+    """Runs the block once a CPU-bound slot is free."""
+    semaphore = slots()
+    started = time.perf_counter()
+    semaphore.acquire()
+    metrics.record('cpu_bound.wait', time.perf_counter() - started)
+    try:
+        yield
+    finally:
+        semaphore.release()
@@ -0,0 +1,17 @@
+"""Password hashers reporting their cost to project_7.metrics and bounded
+by project_7.concurrency."""
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+from . import concurrency, metrics
+
+
+class TimedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """PBKDF2 with SHA256, timing every hash and running it in a CPU-bound
+    slot.
+
+    Keeps the algorithm name, so existing hashes verify unchanged.
+    """
+    def encode(self, password, salt, iterations=None):
+        with concurrency.cpu_bound(), metrics.timed('password.hash'):
+            return super(TimedPBKDF2PasswordHasher, self).encode(
+                password, salt, iterations)
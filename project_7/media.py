@@ -0,0 +1,169 @@
+"""Serving of uploaded media.
+
+Responses carry a strong ETag built from the file's size, modification
+time and inode, answer If-None-Match/If-Modified-Since with 304s and honour
+single byte ranges. Content-addressed files, whose names change whenever
+their content does, are cached for a year.
+
+With MEDIA_OFFLOAD set to 'x-accel-redirect' (nginx) or 'x-sendfile'
+(Apache, lighttpd), Django only checks the request and the front server
+streams the file itself.
+"""
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+
+from django.conf import settings
+from django.http import (FileResponse, Http404, HttpResponse,
+                         StreamingHttpResponse)
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+from django.utils.six.moves.urllib.parse import unquote
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+mimetypes.add_type('image/webp', '.webp')
+
+
+def resolve(path):
+    """Returns the filesystem path of a media file, or raises Http404."""
+    path = posixpath.normpath(unquote(path)).lstrip('/')
+    if path.startswith('..') or not path or path == '.':
+        raise Http404("Invalid media path.")
+    return path, os.path.join(settings.MEDIA_ROOT, *path.split('/'))
+
+
+def file_etag(stats):
+    """Returns a strong ETag for a file's current content."""
+    key = '{}:{}:{}'.format(stats.st_ino, stats.st_size, stats.st_mtime_ns)
+    return hashlib.sha1(key.encode('ascii')).hexdigest()[:20]
+
+
+def cache_control(path):
+    """Returns the Cache-Control header for a media path."""
+    prefixes = getattr(settings, 'MEDIA_IMMUTABLE_PREFIXES', ())
+    if any(path.startswith(prefix) for prefix in prefixes):
+        return IMMUTABLE_CACHE_CONTROL
+    return 'public, max-age={}'.format(
+        getattr(settings, 'MEDIA_MAX_AGE', 3600))
+
+
+def parse_range(header, size):
+    """Returns the (start, end) of a single inclusive byte range header,
+    None to serve the whole file, or False if it can't be satisfied."""
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if not match or not any(match.groups()):
+        # Multiple ranges and other units are served whole.
+        return None
+    first, last = match.groups()
+    if not first:
+        # A suffix range: the final `last` bytes.
+        length = int(last)
+        if not length:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def read_range(path, start, length):
+    """Yields `length` bytes of a file from offset `start`."""
+    with open(path, 'rb') as source:
+        source.seek(start)
+        while length > 0:
+            chunk = source.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+
+
+def if_range_matches(request, etag, last_modified):
+    """Returns False if an If-Range validator names another version."""
+    validator = request.META.get('HTTP_IF_RANGE')
+    if not validator:
+        return True
+    if validator.startswith('"'):
+        return validator == quote_etag(etag)
+    return parse_http_date_safe(validator) == last_modified
+
+
+def set_headers(response, path, etag, last_modified):
+    response['ETag'] = quote_etag(etag)
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = cache_control(path)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def serve(request, path):
+    """Serves a file from MEDIA_ROOT."""
+    if request.method not in ('GET', 'HEAD'):
+        response = HttpResponse(status=405)
+        response['Allow'] = 'GET, HEAD'
+        return response
+    path, full_path = resolve(path)
+    try:
+        stats = os.stat(full_path)
+    except OSError:
+        raise Http404("Media file not found.")
+    if not stat.S_ISREG(stats.st_mode):
+        raise Http404("Media file not found.")
+
+    etag = file_etag(stats)
+    last_modified = int(stats.st_mtime)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        return set_headers(response, path, etag, last_modified)
+
+    content_type = mimetypes.guess_type(full_path)[0]
+    content_type = content_type or 'application/octet-stream'
+    offload = getattr(settings, 'MEDIA_OFFLOAD', None)
+    if offload:
+        # The front server handles ranges and sends the bytes.
+        response = HttpResponse(content_type=content_type)
+        if offload == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = (
+                settings.MEDIA_ACCEL_REDIRECT_PREFIX + path)
+        else:
+            response['X-Sendfile'] = full_path
+        return set_headers(response, path, etag, last_modified)
+
+    size = stats.st_size
+    byte_range = None
+    if 'HTTP_RANGE' in request.META and if_range_matches(
+            request, etag, last_modified):
+        byte_range = parse_range(request.META['HTTP_RANGE'], size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{}'.format(size)
+        return set_headers(response, path, etag, last_modified)
+
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+    elif byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            read_range(full_path, start, end - start + 1),
+            status=206, content_type=content_type)
+    else:
+        response = FileResponse(open(full_path, 'rb'),
+                                content_type=content_type)
+    if byte_range:
+        start, end = byte_range
+        response.status_code = 206
+        response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, size)
+        response['Content-Length'] = end - start + 1
+    else:
+        response['Content-Length'] = size
+    return set_headers(response, path, etag, last_modified)
@@ -0,0 +1,289 @@
+"""In-process request metrics.
+
+MetricsMiddleware times every request by view and counts the database
+queries it runs, and `timed()` measures named sections, such as avatar
+processing or password hashing. Measurements are aggregated into
+fixed-bucket histograms kept in memory, so recording one costs a bisect
+and a few additions under a lock. `metrics_view` exposes them in the
+Prometheus text format, and requests slower than METRICS_SLOW_REQUEST_SECONDS
+are logged with their breakdown.
+
+Every process aggregates its own measurements, so each worker has to be
+scraped. Scrapers are recognized by their address, as found by
+project_7.proxy, and must also send METRICS_TOKEN as a bearer token when
+one is set.
+"""
+import bisect
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.backends import utils
+from django.http import Http404, HttpResponse
+from django.template.backends.django import DjangoTemplates
+from django.utils.crypto import constant_time_compare
+
+from . import proxy
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+_state = threading.local()
+
+
+class Histogram(object):
+    """Counts observations into cumulative buckets."""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self):
+        """Yields (upper bound, cumulative count) pairs, ending with +Inf."""
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield bound, total
+
+
+class Registry(object):
+    """Holds every histogram and counter of the process."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def declare(self, name, kind, help_text, buckets=None):
+        with self._lock:
+            self._metrics.setdefault(name, (kind, help_text, buckets, {}))
+
+    def observe(self, name, labels, value):
+        _, _, buckets, series = self._metrics[name]
+        with self._lock:
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram(buckets)
+            histogram.observe(value)
+
+    def increment(self, name, labels, amount=1):
+        series = self._metrics[name][3]
+        with self._lock:
+            series[labels] = series.get(labels, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            for _, _, _, series in self._metrics.values():
+                series.clear()
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, _, series) in sorted(
+                    self._metrics.items()):
+                lines.append('# HELP {} {}'.format(name, help_text))
+                lines.append('# TYPE {} {}'.format(name, kind))
+                for labels, value in sorted(series.items()):
+                    if kind == 'counter':
+                        lines.append('{}{} {}'.format(
+                            name, format_labels(labels), value))
+                        continue
+                    for bound, count in value.samples():
+                        lines.append('{}_bucket{} {}'.format(
+                            name, format_labels(labels + (('le', bound),)),
+                            count))
+                    lines.append('{}_sum{} {}'.format(
+                        name, format_labels(labels), value.sum))
+                    lines.append('{}_count{} {}'.format(
+                        name, format_labels(labels), sum(value.counts)))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    """Formats a tuple of (name, value) pairs as a Prometheus label set."""
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels) + '}'
+
+
+registry = Registry()
+registry.declare('http_request_duration_seconds', 'histogram',
+                 'Time spent handling requests, by view.', DEFAULT_BUCKETS)
+registry.declare('http_requests_total', 'counter',
+                 'Requests handled, by view and status code.')
+registry.declare('db_queries_per_request', 'histogram',
+                 'Database queries run per request, by view.', QUERY_BUCKETS)
+registry.declare('db_query_seconds_total', 'counter',
+                 'Time spent in database queries, by view.')
+registry.declare('section_duration_seconds', 'histogram',
+                 'Time spent in instrumented sections.', DEFAULT_BUCKETS)
+
+
+class RequestStats(object):
+    """Measurements of the request being handled by this thread."""
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.sections = {}
+
+
+def current_stats():
+    """Returns the stats of this thread's current request, or None."""
+    return getattr(_state, 'stats', None)
+
+
+def record(section, seconds):
+    """Records time spent in a named section."""
+    registry.observe('section_duration_seconds', (('section', section),),
+                     seconds)
+    stats = current_stats()
+    if stats is not None:
+        stats.sections[section] = stats.sections.get(section, 0.0) + seconds
+
+
+@contextmanager
+def timed(section):
+    """Times the block, or decorated function, as a named section."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(section, time.perf_counter() - started)
+
+
+class QueryTimingMixin(object):
+    """Counts and times the queries run through a cursor."""
+    def execute(self, sql, params=None):
+        started = time.perf_counter()
+        try:
+            return super(QueryTimingMixin, self).execute(sql, params)
+        finally:
+            self.record_query(started)
+
+    def executemany(self, sql, param_list):
+        started = time.perf_counter()
+        try:
+            return super(QueryTimingMixin, self).executemany(sql, param_list)
+        finally:
+            self.record_query(started)
+
+    def record_query(self, started):
+        stats = current_stats()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_seconds += time.perf_counter() - started
+
+
+class QueryTimingCursor(QueryTimingMixin, utils.CursorWrapper):
+    pass
+
+
+class QueryTimingDebugCursor(QueryTimingMixin, utils.CursorDebugWrapper):
+    pass
+
+
+def install_query_timing(sender, connection, **kwargs):
+    """Makes a new connection's cursors record their queries."""
+    connection.make_cursor = functools.partial(QueryTimingCursor,
+                                               db=connection)
+    connection.make_debug_cursor = functools.partial(QueryTimingDebugCursor,
+                                                     db=connection)
+
+
+class TimedTemplate(object):
+    """Wraps a template so its rendering is timed."""
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        with timed('template'):
+            return self.template.render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """The Django template backend, timing every render."""
+    def from_string(self, template_code):
+        return TimedTemplate(
+            super(TimedDjangoTemplates, self).from_string(template_code))
+
+    def get_template(self, template_name, *args, **kwargs):
+        return TimedTemplate(super(TimedDjangoTemplates, self).get_template(
+            template_name, *args, **kwargs))
+
+
+def view_name(view_func):
+    """Returns the dotted name of a view function."""
+    return '{}.{}'.format(view_func.__module__,
+                          getattr(view_func, '__name__',
+                                  type(view_func).__name__))
+
+
+class MetricsMiddleware(object):
+    """Records the latency and queries of every request, by view.
+
+    Goes first in MIDDLEWARE_CLASSES, so the other middleware is measured
+    too. Streamed responses are timed up to the first byte.
+    """
+    def process_request(self, request):
+        request.metrics_started = time.perf_counter()
+        request.metrics_view = '<unresolved>'
+        request.metrics = _state.stats = RequestStats()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_view = view_name(view_func)
+
+    def process_response(self, request, response):
+        stats = current_stats()
+        started = getattr(request, 'metrics_started', None)
+        _state.stats = None
+        if stats is None or started is None:
+            return response
+        elapsed = time.perf_counter() - started
+        view = (('view', request.metrics_view),)
+
+        registry.observe('http_request_duration_seconds', view, elapsed)
+        registry.increment('http_requests_total',
+                           view + (('status', response.status_code),))
+        registry.observe('db_queries_per_request', view, stats.queries)
+        registry.increment('db_query_seconds_total', view,
+                           stats.query_seconds)
+
+        if elapsed >= getattr(settings, 'METRICS_SLOW_REQUEST_SECONDS', 1.0):
+            logger.warning(
+                "Slow request %s %s (%s): %.0fms, %d queries in %.0fms%s",
+                request.method, request.path, request.metrics_view,
+                1000 * elapsed, stats.queries, 1000 * stats.query_seconds,
+                ''.join(', {} {:.0f}ms'.format(section, 1000 * seconds)
+                        for section, seconds in sorted(
+                            stats.sections.items())))
+        return response
+
+
+def metrics_view(request):
+    """Exposes the process's metrics to scrapers in METRICS_ALLOWED_IPS
+    presenting METRICS_TOKEN, if set."""
+    allowed = getattr(settings, 'METRICS_ALLOWED_IPS', ('127.0.0.1', '::1'))
+    if proxy.client_ip(request) not in allowed:
+        raise Http404
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and not constant_time_compare(
+            request.META.get('HTTP_AUTHORIZATION', ''), 'Bearer ' + token):
+        raise Http404
+    return HttpResponse(registry.render(),
+                        content_type='text/plain; version=0.0.4')
@@ -0,0 +1,113 @@
+"""Prebuilt, memory-mapped index of common passwords.
+
+The index is a sorted array of 64-bit SHA-1 prefixes of normalized
+passwords behind a short header. It is built offline by the
+build_password_index management command and opened with mmap, so every
+worker process shares the same read-only pages instead of loading its own
+copy of the word list, and lookups are a binary search.
+"""
+import array
+import gzip
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import threading
+
+
+MAGIC = b'PWIDX001'
+HEADER = struct.Struct('>8sQ')
+ENTRY = struct.Struct('>Q')
+
+_indexes = {}
+_lock = threading.Lock()
+
+
+def normalize(password):
+    """Normalizes passwords the way Django's CommonPasswordValidator does."""
+    return password.lower().strip()
+
+
+def fingerprint(password):
+    """Returns the 64-bit index entry of a password."""
+    digest = hashlib.sha1(normalize(password).encode('utf-8')).digest()
+    return ENTRY.unpack_from(digest)[0]
+
+
+class PasswordIndex(object):
+    """Read-only view of an index file."""
+    def __init__(self, path):
+        with open(path, 'rb') as index_file:
+            self.map = mmap.mmap(index_file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        magic, self.count = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError("{} is not a password index.".format(path))
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, password):
+        target = fingerprint(password)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            entry = ENTRY.unpack_from(
+                self.map, HEADER.size + middle * ENTRY.size)[0]
+            if entry < target:
+                low = middle + 1
+            elif entry > target:
+                high = middle
+            else:
+                return True
+        return False
+
+
+def get_index(path):
+    """Returns the index at `path`, mapping it again whenever the file has
+    been replaced since it was last mapped.
+
+    Raises OSError if there is no file at `path`.
+    """
+    stat = os.stat(path)
+    identity = (stat.st_ino, stat.st_mtime_ns)
+    with _lock:
+        mapped = _indexes.get(path)
+        if mapped is None or mapped[0] != identity:
+            # The replaced mapping is closed once no lookup still uses it.
+            mapped = _indexes[path] = (identity, PasswordIndex(path))
+        return mapped[1]
+
+
+def read_words(path):
+    """Yields the passwords of a plain or gzipped word list."""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as word_file:
+        for line in word_file:
+            word = line.decode('utf-8', 'replace').rstrip('\r\n')
+            if word:
+                yield word
+
+
+def build_index(words, path):
+    """Writes an index of `words` to `path`, returning its entry count.
+
+    The file is written next to its destination and moved into place, so
+    no process ever maps a partly written index: lookups running against
+    the old mapping finish on it, and the next get_index() maps the new
+    file.
+    """
+    entries = array.array('Q', sorted(set(fingerprint(word)
+                                          for word in words)))
+    if sys.byteorder == 'little':
+        entries.byteswap()
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary, 'wb') as index_file:
+        index_file.write(HEADER.pack(MAGIC, len(entries)))
+        entries.tofile(index_file)
+    os.replace(temporary, path)
+    return len(entries)
@@ -0,0 +1,15 @@
+"""Client addresses of requests coming through the front proxy."""
+from django.conf import settings
+
+
+def client_ip(request):
+    """Returns the address a request came from, using CLIENT_IP_HEADER.
+
+    The header must be one the front proxy overwrites; requests without it
+    came straight to the worker, so REMOTE_ADDR is used. Of a list, as in
+    X-Forwarded-For, only the last entry was added by the proxy itself; the
+    ones before it are whatever the client sent.
+    """
+    header = getattr(settings, 'CLIENT_IP_HEADER', 'REMOTE_ADDR')
+    value = request.META.get(header) or request.META.get('REMOTE_ADDR', '')
+    return value.split(',')[-1].strip()
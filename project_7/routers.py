@@ -0,0 +1,111 @@
+"""Read replica routing.
+
+Writes always go to the primary. Reads go to the primary too, except inside
+`use_replica()`, where they are spread over the DATABASE_REPLICAS aliases.
+Views opt in with `replica_reads`.
+
+After a browser submits a write, ReplicaStickinessMiddleware pins it to the
+primary for REPLICA_STICKY_SECONDS, so users always see their own edits
+however far replicas lag behind. Views that write on a safe method call
+`wrote_primary()` to get the same treatment.
+"""
+import functools
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+STICKY_COOKIE = 'db_primary_until'
+
+_state = threading.local()
+
+
+def replicas():
+    """Returns the configured replica aliases."""
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+def reading_from_replica():
+    """Returns True inside `use_replica()`."""
+    return getattr(_state, 'depth', 0) > 0
+
+
+@contextmanager
+def use_replica(enabled=True):
+    """Sends reads in the block to a replica, if `enabled`."""
+    if not enabled:
+        yield
+        return
+    _state.depth = getattr(_state, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _state.depth -= 1
+
+
+def read_database(request=None):
+    """Returns the alias reads for a request should use.
+
+    For work that outlives the view, such as streamed responses.
+    """
+    if (request is not None and getattr(request, 'pin_primary', False)) or (
+            not replicas()):
+        return 'default'
+    return random.choice(replicas())
+
+
+def wrote_primary(request):
+    """Records that a request wrote to the primary, whatever its method, so
+    the browser is pinned to it."""
+    request.wrote_primary = True
+    request.pin_primary = True
+
+
+def replica_reads(view):
+    """Decorates a view whose reads may be served by a replica."""
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with use_replica(not getattr(request, 'pin_primary', False)):
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter(object):
+    """Routes reads inside `use_replica()` to a replica and everything else
+    to the primary."""
+    def db_for_read(self, model, **hints):
+        if reading_from_replica() and replicas():
+            return random.choice(replicas())
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same data.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas receive the schema along with the data.
+        return db not in replicas()
+
+
+class ReplicaStickinessMiddleware(object):
+    """Pins browsers that recently wrote something to the primary."""
+    def process_request(self, request):
+        try:
+            until = float(request.COOKIES.get(STICKY_COOKIE, 0))
+        except ValueError:
+            until = 0
+        request.pin_primary = until > time.time()
+
+    def process_response(self, request, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS', 'TRACE') or (
+                getattr(request, 'wrote_primary', False)):
+            seconds = getattr(settings, 'REPLICA_STICKY_SECONDS', 10)
+            response.set_cookie(STICKY_COOKIE, str(time.time() + seconds),
+                                max_age=seconds, httponly=True)
+        return response
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/1.9/ref/settings/
 """
 
+import importlib.util
 import os
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -27,6 +28,13 @@ DEBUG = True
 
 ALLOWED_HOSTS = []
 
+# Behind the front proxy every request comes from 127.0.0.1, so client
+# addresses, used by the sign-in throttle and /metrics, are read from this
+# header, which the proxy must overwrite with the client's. Requests
+# without it came straight to a worker and use REMOTE_ADDR (see
+# project_7.proxy).
+CLIENT_IP_HEADER = 'HTTP_X_REAL_IP'
+
 
 # Application definition
 
@@ -37,15 +45,20 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'django_cleanup',
-    'debug_toolbar',
     'django_countries',
     'accounts',
 ]
 
+# The toolbar is only loaded for development, and only where installed.
+if DEBUG and importlib.util.find_spec('debug_toolbar') is not None:
+    INSTALLED_APPS.insert(INSTALLED_APPS.index('django_countries'),
+                          'debug_toolbar')
+
 MIDDLEWARE_CLASSES = [
+    'project_7.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'project_7.routers.ReplicaStickinessMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -58,7 +71,7 @@ ROOT_URLCONF = 'project_7.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'project_7.metrics.TimedDjangoTemplates',
         'DIRS': [os.path.join(BASE_DIR, 'templates')],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -82,10 +95,151 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'CONN_MAX_AGE': 600,
+    }
+}
+
+# Tests get in-process caches, away from those running servers share.
+TEST_RUNNER = 'project_7.testing.IsolatedCachesRunner'
+
+# Read replicas, as a comma separated list of SQLite files in
+# DATABASE_REPLICA_FILES. Locally, `manage.py sync_replicas` refreshes them
+# from the primary. Views decorated with project_7.routers.replica_reads
+# read from them, except for browsers that wrote within
+# REPLICA_STICKY_SECONDS.
+DATABASE_REPLICAS = []
+for number, path in enumerate(
+        filter(None, os.environ.get('DATABASE_REPLICA_FILES', '').split(',')),
+        start=1):
+    alias = 'replica{}'.format(number)
+    DATABASES[alias] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': path,
+        'CONN_MAX_AGE': 600,
+        'TEST': {
+            'MIRROR': 'default',
+        },
     }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['project_7.routers.ReplicaRouter']
+REPLICA_STICKY_SECONDS = 10
+
+# Applied to every new SQLite connection (see project_7.sqlite). WAL lets
+# readers and the writer proceed concurrently, and only needs fsyncs at
+# checkpoints with synchronous = normal.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'temp_store': 'memory',
+    'cache_size': -20000,
+    'mmap_size': 256 * 1024 * 1024,
 }
 
 
+# Caches
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Rendered profiles (see accounts.profile_cache). Kept in process, so
+    # with several worker processes, point this at a shared backend such as
+    # the 'users' one, or a worker keeps serving a profile another changed.
+    'profiles': {
+        'BACKEND': 'accounts.lrucache.LRUCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # Sign-in throttle counters. Bounded, so an attack spread over many
+    # usernames or addresses can't exhaust memory. With several worker
+    # processes, use a shared backend such as FileBasedCache or a
+    # DatabaseCache on SQLite so every worker sees the same counters.
+    'throttle': {
+        'BACKEND': 'accounts.lrucache.LRUCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+    # Sessions must survive restarts and be shared by every worker. Django's
+    # FileBasedCache lists its whole directory on every write, so this one
+    # only checks MAX_ENTRIES every CULL_INTERVAL seconds.
+    'sessions': {
+        'BACKEND': 'accounts.filecache.PeriodicCullFileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'var', 'cache', 'sessions'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'CULL_INTERVAL': 60,
+        },
+    },
+    # Signed-in users and their profiles (see accounts.backends). Shared by
+    # every worker and avatar job process, so a save in one of them drops
+    # the copy all the others would serve.
+    'users': {
+        'BACKEND': 'accounts.filecache.PeriodicCullFileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'var', 'cache', 'users'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'CULL_INTERVAL': 60,
+        },
+    },
+}
+
+ACCOUNTS_PROFILE_CACHE = 'profiles'
+ACCOUNTS_PROFILE_CACHE_TIMEOUT = 3600
+
+
+# Sessions
+# Read through the 'sessions' cache and only written to the database when
+# they actually change (see accounts.sessions). Flash messages live in a
+# cookie so they never touch the session at all. Expired sessions are
+# removed with `manage.py sweep_sessions`.
+
+SESSION_ENGINE = 'accounts.sessions'
+SESSION_CACHE_ALIAS = 'sessions'
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+
+# Authentication
+# Users are loaded with their profile in one query and cached between
+# requests (see accounts.backends).
+
+AUTHENTICATION_BACKENDS = [
+    'accounts.backends.ProfileBackend',
+]
+
+ACCOUNTS_USER_CACHE = 'users'
+ACCOUNTS_USER_CACHE_TIMEOUT = 300
+
+# Failed sign-ins allowed per username and client IP within WINDOW seconds
+# before a lockout, which doubles with each repeat up to MAX_LOCKOUT and is
+# forgotten after DECAY seconds (see accounts.throttle).
+LOGIN_THROTTLE = {
+    'CACHE': 'throttle',
+    'USERNAME_LIMIT': 5,
+    'IP_LIMIT': 20,
+    'WINDOW': 300,
+    'LOCKOUT': 60,
+    'MAX_LOCKOUT': 3600,
+    'DECAY': 86400,
+}
+
+# The default hashers, with PBKDF2 timed by project_7.metrics.
+PASSWORD_HASHERS = [
+    'project_7.hashers.TimedPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django.contrib.auth.hashers.BCryptPasswordHasher',
+    'django.contrib.auth.hashers.SHA1PasswordHasher',
+    'django.contrib.auth.hashers.MD5PasswordHasher',
+    'django.contrib.auth.hashers.UnsaltedSHA1PasswordHasher',
+    'django.contrib.auth.hashers.UnsaltedMD5PasswordHasher',
+    'django.contrib.auth.hashers.CryptPasswordHasher',
+]
+
 # Password validation
 # https://docs.djangoproject.com/en/1.9/ref/settings/#auth-password-validators
 
@@ -103,19 +257,20 @@ AUTH_PASSWORD_VALIDATORS = [
         },
     },
     {
-        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
-    },
-    {
-        'NAME': 'project_7.validators.UpperLowerCaseValidator',
-    },
-    {
-        'NAME': 'project_7.validators.ContainsNumberValidator',
+        'NAME': 'project_7.validators.IndexedCommonPasswordValidator',
     },
     {
-        'NAME': 'project_7.validators.ContainsSpecialCharactersValidator',
+        'NAME': 'project_7.validators.PasswordPolicyValidator',
+        'OPTIONS': {
+            'require_mixed_case': True,
+            'require_digit': True,
+            'require_special': True,
+        },
     },
 ]
 
+# Built with `manage.py build_password_index` (see project_7.password_index).
+COMMON_PASSWORD_INDEX = os.path.join(BASE_DIR, 'var', 'common-passwords.idx')
 
 # Internationalization
 # https://docs.djangoproject.com/en/1.9/topics/i18n/
@@ -139,5 +294,73 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'assets'),
 ]
 
+# Per-page bundles built by `manage.py build_assets` into assets/bundles/
+# (see accounts.assets). Templates link the sources instead while
+# ASSET_USE_BUNDLES is off or the bundles haven't been built.
+ASSET_BUNDLES = {
+    'base.css': ['css/global.css'],
+    'base.js': ['js/autogrow.js', 'js/global.js'],
+    'strength.css': ['css/strength.css'],
+    'strength.js': ['js/strength.js', 'js/js.js'],
+    'jcrop.css': ['css/jquery.Jcrop.css'],
+    'jcrop.js': ['js/jquery.Jcrop.min.js'],
+}
+ASSET_USE_BUNDLES = not DEBUG
+
 MEDIA_ROOT = os.path.join(BASE_DIR, 'uploads')
 MEDIA_URL = '/uploads/'
+
+# Media is served by project_7.media. Files under these prefixes are named
+# after their content and cached for a year; others for MEDIA_MAX_AGE
+# seconds. Set MEDIA_OFFLOAD to 'x-accel-redirect' or 'x-sendfile' to have
+# the front server send the bytes; nginx needs an internal location at
+# MEDIA_ACCEL_REDIRECT_PREFIX aliased to MEDIA_ROOT.
+MEDIA_IMMUTABLE_PREFIXES = ('avatars/', 'renditions/')
+MEDIA_MAX_AGE = 3600
+MEDIA_OFFLOAD = None
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-uploads/'
+
+# Avatar renditions, built once per distinct image (see accounts.avatars).
+# Uploads are kept as the source renditions are built from, unless a side
+# exceeds AVATAR_SOURCE_MAX_DIMENSION, when a high quality copy scaled to
+# fit replaces them.
+AVATAR_RENDITION_SIZES = (48, 96, 240, 600)
+AVATAR_RENDITION_FORMATS = ('jpeg', 'webp')
+AVATAR_SOURCE_MAX_DIMENSION = 2048
+
+# Background avatar processing (see accounts.jobs). Set AVATAR_JOB_WORKERS
+# to 0 to process avatars inline, in the request.
+AVATAR_JOB_BACKEND = 'accounts.jobs.DatabaseJobBackend'
+AVATAR_JOB_WORKERS = 2
+
+# Avatars are stored by content hash (see accounts.storage) and shared by
+# identical uploads. An unreferenced avatar file is deleted unless it was
+# stored or reused within AVATAR_RELEASE_GRACE seconds, which protects
+# references still being saved; `manage.py relocate_avatars --prune`
+# removes the ones left behind.
+AVATAR_RELEASE_GRACE = 600
+
+# Avatar uploads are rejected while streaming if they break these limits
+# (see accounts.uploadhandlers).
+AVATAR_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+AVATAR_MAX_DIMENSION = 8000
+AVATAR_MAX_PIXELS = 40000000
+AVATAR_UPLOAD_FORMATS = ('JPEG', 'PNG', 'GIF')
+
+# Metrics
+# Request latency, query counts and timed sections are aggregated in each
+# process (see project_7.metrics) and served at /metrics to the addresses
+# in METRICS_ALLOWED_IPS, read from CLIENT_IP_HEADER. With METRICS_TOKEN
+# set, scrapers must also send it as "Authorization: Bearer <token>".
+# Slower requests are logged with their breakdown.
+METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_SLOW_REQUEST_SECONDS = 1.0
+
+# Worker threads
+# A worker may serve requests from several threads, e.g. under gunicorn's
+# gthread workers. Password hashing and inline avatar processing then run in
+# at most CPU_BOUND_CONCURRENCY threads at once, the number of cores by
+# default (see project_7.concurrency); `manage.py benchmark_concurrency`
+# compares threaded serving with one request at a time.
+CPU_BOUND_CONCURRENCY = None
@@ -0,0 +1,12 @@
+"""SQLite connection tuning."""
+from django.conf import settings
+
+
+def set_pragmas(sender, connection, **kwargs):
+    """Applies SQLITE_PRAGMAS to each new SQLite connection."""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = getattr(settings, 'SQLITE_PRAGMAS', {})
+    with connection.cursor() as cursor:
+        for name, value in sorted(pragmas.items()):
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
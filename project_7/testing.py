@@ -0,0 +1,36 @@
+"""Test running kept apart from the caches running servers use."""
+from django.conf import settings
+from django.core.cache.backends.filebased import FileBasedCache
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+from django.utils.module_loading import import_string
+
+
+def isolated_caches():
+    """Returns an override_settings replacing the caches shared through the
+    filesystem with in-process ones.
+
+    Test databases reuse user ids, so a test user cached in the shared
+    'users' cache would otherwise be served to a running server's user.
+    """
+    caches = {}
+    for alias, config in settings.CACHES.items():
+        if issubclass(import_string(config['BACKEND']), FileBasedCache):
+            config = {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'test-' + alias,
+            }
+        caches[alias] = config
+    return override_settings(CACHES=caches)
+
+
+class IsolatedCachesRunner(DiscoverRunner):
+    """Runs tests with isolated_caches()."""
+    def setup_test_environment(self, **kwargs):
+        super(IsolatedCachesRunner, self).setup_test_environment(**kwargs)
+        self.caches = isolated_caches()
+        self.caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self.caches.disable()
+        super(IsolatedCachesRunner, self).teardown_test_environment(**kwargs)
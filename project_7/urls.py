@@ -17,16 +17,19 @@ from django.conf.urls import url, include
 from django.contrib import admin
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 
-from . import views
+from . import media, metrics, views
 
 from django.conf import settings
-from django.conf.urls.static import static
 
 
 urlpatterns = [
     url(r'^admin/', admin.site.urls),
     url(r'^accounts/', include('accounts.urls', namespace='accounts')),
     url(r'^$', views.home, name='home'),
+    url(r'^metrics$', metrics.metrics_view, name='metrics'),
 ]
 urlpatterns += staticfiles_urlpatterns()
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+urlpatterns += [
+    url(r'^{}(?P<path>.*)$'.format(settings.MEDIA_URL.lstrip('/')),
+        media.serve, name='media'),
+]
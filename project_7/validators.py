@@ -1,49 +1,121 @@
-import re
+import logging
+import string
 
+from django.conf import settings
+from django.contrib.auth.password_validation import CommonPasswordValidator
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext as _
 
+from . import password_index
+
+
+logger = logging.getLogger(__name__)
+
+
+LOWERCASE = frozenset(string.ascii_lowercase)
+UPPERCASE = frozenset(string.ascii_uppercase)
+DIGITS = frozenset(string.digits)
+ALPHANUMERIC = LOWERCASE | UPPERCASE | DIGITS
+
+
+class PasswordPolicyValidator(object):
+    """Checks the character classes a password must contain.
+
+    Every character is classified in a single pass and all failing rules
+    are reported together.
+    """
+    def __init__(self, require_mixed_case=True, require_digit=True,
+                 require_special=True):
+        self.require_mixed_case = require_mixed_case
+        self.require_digit = require_digit
+        self.require_special = require_special
 
-class UpperLowerCaseValidator(object):
-    """Checks that password contains both upper and lower case letters."""
     def validate(self, password, user=None):
-        if not re.search(r'[a-z]+', password) or (
-                not re.search(r'[A-Z]+', password)):
-            raise ValidationError(
+        characters = set(password)
+        errors = []
+        if self.require_mixed_case and not (
+                characters & LOWERCASE and characters & UPPERCASE):
+            errors.append(ValidationError(
                 _("Your password doesn't contain both uppercase and lowercase"
                   " letters."),
-            )
+                code='password_no_mixed_case',
+            ))
+        if self.require_digit and not characters & DIGITS:
+            errors.append(ValidationError(
+                _("Your password doesn't contain numerical digits."),
+                code='password_no_digit',
+            ))
+        if self.require_special and not any(
+                not character.isalnum() and not character.isspace()
+                for character in characters - ALPHANUMERIC):
+            errors.append(ValidationError(
+                _("Your password doesn't contain special characters, such as"
+                  " @, #, $."),
+                code='password_no_special_character',
+            ))
+        if errors:
+            raise ValidationError(errors)
 
     def get_help_text(self):
-        return _(
-            "Your password must contain both uppercase and lowercase letters."
-        )
+        requirements = []
+        if self.require_mixed_case:
+            requirements.append(_("both uppercase and lowercase letters"))
+        if self.require_digit:
+            requirements.append(_("one or more numerical digits"))
+        if self.require_special:
+            requirements.append(_("special characters, such as @, #, $"))
+        return _("Your password must contain %s.") % _("; ").join(
+            requirements)
 
 
-class ContainsNumberValidator(object):
-    """Checks that password contains at least one number."""
-    def validate(self, password, user=None):
-        if not re.search(r'[0-9]+', password):
-            raise ValidationError(
-                _("Your password doesn't contain numerical digits."),
-            )
+class UpperLowerCaseValidator(PasswordPolicyValidator):
+    """Checks that password contains both upper and lower case letters."""
+    def __init__(self):
+        super(UpperLowerCaseValidator, self).__init__(
+            require_digit=False, require_special=False)
 
-    def get_help_text(self):
-        return _(
-            "Your password must contain one or more numerical digits."
-        )
+
+class ContainsNumberValidator(PasswordPolicyValidator):
+    """Checks that password contains at least one number."""
+    def __init__(self):
+        super(ContainsNumberValidator, self).__init__(
+            require_mixed_case=False, require_special=False)
 
 
-class ContainsSpecialCharactersValidator(object):
+class ContainsSpecialCharactersValidator(PasswordPolicyValidator):
     """Checks that password contains at least one special character."""
+    def __init__(self):
+        super(ContainsSpecialCharactersValidator, self).__init__(
+            require_mixed_case=False, require_digit=False)
+
+
+class IndexedCommonPasswordValidator(object):
+    """Checks that password isn't in the prebuilt common password index.
+
+    Falls back to Django's word list while the index hasn't been built.
+    """
+    def __init__(self, index_path=None):
+        self.index_path = index_path or settings.COMMON_PASSWORD_INDEX
+        self.fallback = None
+
     def validate(self, password, user=None):
-        if not re.search(r'[0-9]+', password):
+        try:
+            index = password_index.get_index(self.index_path)
+        except OSError:
+            if self.fallback is None:
+                logger.warning(
+                    "Common password index %s is missing; run `manage.py "
+                    "build_password_index`.", self.index_path)
+                self.fallback = CommonPasswordValidator()
+            common = password_index.normalize(password) in (
+                self.fallback.passwords)
+        else:
+            common = password in index
+        if common:
             raise ValidationError(
-                _("Your password doesn't contain special characters, such as"
-                  " @, #, $."),
+                _("This password is too common."),
+                code='password_too_common',
             )
 
     def get_help_text(self):
-        return _(
-            "Your password must contain special characters, such as @, #, $."
-        )
+        return _("Your password can't be a commonly used password.")